@@ -5,57 +5,136 @@
 
 */
 
+#include <stdlib.h>
 #include <util/atomic.h>
 #include "AccelerometerBuf.h"
 
 AccelerometerBuf::AccelerometerBuf() {
+    data = 0;
+    recordSize = 0;
+    capacity = 0;
+    clear();
 }
 
-void AccelerometerBuf::init(unsigned int _bufSize) {
-    bufSize = _bufSize;
-    xBuf.init(2*bufSize);
-    yBuf.init(2*bufSize);
-    zBuf.init(2*bufSize);
+// Allocates the buffer for records of _recordSize bytes using the free RAM
+// less reserve bytes for the stack, up to maxRecords records. Returns false if
+// there is no room for any records.
+bool AccelerometerBuf::init(unsigned int _recordSize, unsigned int reserve, unsigned int maxRecords) {
+    int space;
+    deAllocate();
+    recordSize = _recordSize;
+    space = freeRam() - (int) reserve;
+    if (space < (int) recordSize) {
+        return false;
+    }
+    capacity = min((unsigned int) space/recordSize, maxRecords);
+    data = (unsigned char *) malloc(capacity*recordSize);
+    if (data == 0) {
+        capacity = 0;
+        return false;
+    }
+    clear();
+    return true;
 }
 
-void AccelerometerBuf::putVal(AccelerometerRaw raw) {
+// Adds a sample and its sequence number. Returns false if the buffer is full
+// and the sample was dropped. Called from the timer interrupt.
+bool AccelerometerBuf::putVal(AccelerometerRaw raw, unsigned int seq) {
+    unsigned int size;
+    unsigned char *rec;
     ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
-        if (xBuf.getSize() < xBuf.getCapacity()) {
-            xBuf.putInt(raw.XAxis);
-            yBuf.putInt(raw.YAxis);
-            zBuf.putInt(raw.ZAxis);
-        }
+        size = count;
+    }
+    if (size >= capacity) {
+        return false;
+    }
+    rec = &data[tail*recordSize];
+    rec[0] = lowByte(raw.XAxis);
+    rec[1] = highByte(raw.XAxis);
+    rec[2] = lowByte(raw.YAxis);
+    rec[3] = highByte(raw.YAxis);
+    rec[4] = lowByte(raw.ZAxis);
+    rec[5] = highByte(raw.ZAxis);
+    if (recordSize > 7) {
+        rec[6] = lowByte(seq);
+        rec[7] = highByte(seq);
+    }
+    else {
+        rec[6] = 0;
+    }
+    tail++;
+    if (tail == capacity) {
+        tail = 0;
     }
-}
-
-AccelerometerRaw AccelerometerBuf::getVal() {
-    AccelerometerRaw raw;
     ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
-        raw.XAxis = xBuf.getInt();
-        raw.YAxis = yBuf.getInt();
-        raw.ZAxis = zBuf.getInt();
+        count++;
     }
-    return raw;
+    return true;
 }
 
-int AccelerometerBuf::getSize() {
-    return xBuf.getSize()/2;
+// Returns a pointer to the record index places from the oldest.
+unsigned char *AccelerometerBuf::peek(unsigned int index) {
+    index += head;
+    if (index >= capacity) {
+        index -= capacity;
+    }
+    return &data[index*recordSize];
 }
 
-void AccelerometerBuf::clear() {
-    xBuf.clear();
-    yBuf.clear();
-    zBuf.clear();
+// Sets ptr to the oldest record and returns the number of records stored
+// contiguously from it.
+unsigned int AccelerometerBuf::getContiguous(unsigned char *&ptr) {
+    ptr = &data[head*recordSize];
+    return min(getSize(), capacity - head);
 }
 
-void AccelerometerBuf::deAllocate() {
-    xBuf.deAllocate();
-    yBuf.deAllocate();
-    zBuf.deAllocate();
+// Removes the num oldest records.
+void AccelerometerBuf::consume(unsigned int num) {
+    head += num;
+    if (head >= capacity) {
+        head -= capacity;
+    }
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        count -= num;
+    }
 }
 
+unsigned int AccelerometerBuf::getSize() {
+    unsigned int size;
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        size = count;
+    }
+    return size;
+}
 
+unsigned int AccelerometerBuf::getCapacity() {
+    return capacity;
+}
 
+unsigned int AccelerometerBuf::getRecordSize() {
+    return recordSize;
+}
 
+void AccelerometerBuf::clear() {
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        head = 0;
+        tail = 0;
+        count = 0;
+    }
+}
 
+void AccelerometerBuf::deAllocate() {
+    clear();
+    if (data != 0) {
+        free(data);
+        data = 0;
+    }
+    capacity = 0;
+}
 
+// Returns the number of bytes between the top of the heap and the stack.
+int freeRam() {
+    extern int __heap_start, *__brkval;
+    int v;
+    return (int) &v - (__brkval == 0 ? (int) &__heap_start : (int) __brkval);
+}
@@ -8,23 +8,36 @@
 #else
 #include "WProgram.h"
 #endif
-#include <ByteBuffer.h>
 #include <FastADXL345.h>
 //#include <ADXL345.h>
 
+// Ring buffer of samples stored as records of recordSize bytes: the x, y and
+// z values, low byte first, followed by either a zero byte (7 byte records,
+// the legacy frame format, so runs of records can be sent as they are) or the
+// 16 bit sequence number (8 byte records, for packed frames). The timer
+// interrupt adds records and the main loop removes them. Each side only
+// updates its own index, so interrupts are only disabled to update count.
 class AccelerometerBuf {
 
     public:
         AccelerometerBuf();
-        void init(unsigned int bufSize);
-        void putVal(AccelerometerRaw raw);
-        AccelerometerRaw getVal();
-        int getSize();
+        bool init(unsigned int recordSize, unsigned int reserve, unsigned int maxRecords);
+        bool putVal(AccelerometerRaw raw, unsigned int seq);
+        unsigned char *peek(unsigned int index);
+        unsigned int getContiguous(unsigned char *&ptr);
+        void consume(unsigned int num);
+        unsigned int getSize();
+        unsigned int getCapacity();
+        unsigned int getRecordSize();
         void clear();
         void deAllocate();
-        unsigned int bufSize;
     private:
-        ByteBuffer xBuf;
-        ByteBuffer yBuf;
-        ByteBuffer zBuf;
+        unsigned char *data;
+        unsigned int recordSize;
+        unsigned int capacity;
+        unsigned int head;
+        unsigned int tail;
+        volatile unsigned int count;
 };
+
+int freeRam();
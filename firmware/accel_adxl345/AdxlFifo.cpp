@@ -0,0 +1,87 @@
+/*
+   AdxlFifo.cpp
+
+   Register access to the ADXL345's output data rate and 32 level FIFO for
+   streaming without timer interrupts.
+*/
+#include <FastWire.h>
+#include "constants.h"
+#include "AdxlFifo.h"
+
+void adxlWriteRegister(unsigned char reg, unsigned char value) {
+    Wire.beginTransmission(adxlAddress);
+#if defined(ARDUINO) && ARDUINO >= 100
+    Wire.write(reg);
+    Wire.write(value);
+#else
+    Wire.send(reg);
+    Wire.send(value);
+#endif
+    Wire.endTransmission();
+}
+
+void adxlReadRegisters(unsigned char reg, unsigned char num, unsigned char *buf) {
+    Wire.beginTransmission(adxlAddress);
+#if defined(ARDUINO) && ARDUINO >= 100
+    Wire.write(reg);
+#else
+    Wire.send(reg);
+#endif
+    Wire.endTransmission();
+    Wire.requestFrom(adxlAddress, num);
+    for (unsigned char i=0; i<num; i++) {
+#if defined(ARDUINO) && ARDUINO >= 100
+        buf[i] = Wire.read();
+#else
+        buf[i] = Wire.receive();
+#endif
+    }
+}
+
+// The BW_RATE register value used in timer mode, saved by fifoStart and
+// restored by fifoStop.
+static bool fifoActive = false;
+static unsigned char timerBwRate;
+
+// Sets the output data rate and starts the FIFO in stream mode, where the
+// oldest entries are overwritten when it is full. Switching through bypass
+// mode empties the FIFO.
+void fifoStart(unsigned char odrCode, unsigned char watermark) {
+    if (!fifoActive) {
+        adxlReadRegisters(adxlRegBwRate, 1, &timerBwRate);
+        fifoActive = true;
+    }
+    adxlWriteRegister(adxlRegBwRate, odrCode & 0x0F);
+    adxlWriteRegister(adxlRegFifoCtl, adxlFifoBypass);
+    adxlWriteRegister(adxlRegFifoCtl, adxlFifoStream | (watermark & 0x1F));
+}
+
+// Returns the FIFO to bypass mode and restores the timer mode output data
+// rate, as the timer reads the data registers directly and would otherwise
+// get repeated samples at the slower FIFO rates.
+void fifoStop() {
+    adxlWriteRegister(adxlRegFifoCtl, adxlFifoBypass);
+    if (fifoActive) {
+        adxlWriteRegister(adxlRegBwRate, timerBwRate);
+        fifoActive = false;
+    }
+}
+
+// Returns the number of samples waiting in the FIFO.
+unsigned char fifoEntries() {
+    unsigned char status;
+    adxlReadRegisters(adxlRegFifoStatus, 1, &status);
+    return status & 0x3F;
+}
+
+// Reads the oldest sample from the FIFO. All six data registers must be read
+// in one transaction for the FIFO to advance.
+AccelerometerRaw fifoRead() {
+    unsigned char buf[6];
+    AccelerometerRaw raw;
+    adxlReadRegisters(adxlRegDataX0, 6, buf);
+    raw.XAxis = (int) word(buf[1], buf[0]);
+    raw.YAxis = (int) word(buf[3], buf[2]);
+    raw.ZAxis = (int) word(buf[5], buf[4]);
+    return raw;
+}
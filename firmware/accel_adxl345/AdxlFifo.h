@@ -0,0 +1,23 @@
+/*
+   AdxlFifo.h
+
+   Register access to the ADXL345's output data rate and 32 level FIFO for
+   streaming without timer interrupts.
+*/
+#ifndef ADXL_FIFO_H
+#define ADXL_FIFO_H
+#if defined(ARDUINO) && ARDUINO >= 100
+#include "Arduino.h"
+#else
+#include "WProgram.h"
+#endif
+#include <FastADXL345.h>
+
+void adxlWriteRegister(unsigned char reg, unsigned char value);
+void adxlReadRegisters(unsigned char reg, unsigned char num, unsigned char *buf);
+void fifoStart(unsigned char odrCode, unsigned char watermark);
+void fifoStop();
+unsigned char fifoEntries();
+AccelerometerRaw fifoRead();
+
+#endif
@@ -12,7 +12,17 @@ SystemState::SystemState() {
     mode = MODE_STOPPED;
     timerPeriod = defaultTimerPeriod;
     setRange(defaultRange);
+    fullRes = defaultFullRes;
     badSampleCount = 0;
+    sampleCount = 0;
+    timestampReady = false;
+    baudRate = ::baudRate;
+    frameFormat = FRAME_LEGACY;
+    sampleMode = SAMPLE_TIMER;
+    odrCode = defaultOdrCode;
+    triggerLevel = 0;
+    triggerPre = defaultTriggerPre;
+    triggerPost = defaultTriggerPost;
 }
 
 void SystemState::init() {
@@ -24,7 +34,7 @@ void SystemState::setTimerInterrupt(void (*isr)()) {
 }
 
 void SystemState::setTimerPeriod(unsigned long value) {
-    if ((value >= minTimerPeriod) && (value <= maxTimerPeriod)) {
+    if ((value >= getMinTimerPeriod()) && (value <= maxTimerPeriod)) {
         timerPeriod = value;
         Timer1.setPeriod(timerPeriod);
     }
@@ -52,4 +62,125 @@ void SystemState::setRange(unsigned int value) {
     }
 }
 
+bool SystemState::getFullRes() {
+    return fullRes;
+}
+
+void SystemState::setFullRes(bool value) {
+    fullRes = value;
+}
+
+bool SystemState::setBaudRate(unsigned long value) {
+    bool test = false;
+    // Check that value is in the set of allowed baud rates
+    for (int i=0; i<numBaudRate; i++) {
+        if (value == allowedBaudRate[i]) {
+            test = true;
+        }
+    }
+    if (test) {
+        baudRate = value;
+        // Timer period may no longer be allowed at the new baud rate
+        if (timerPeriod < getMinTimerPeriod()) {
+            setTimerPeriod(getMinTimerPeriod());
+        }
+    }
+    return test;
+}
+
+unsigned long SystemState::getBaudRate() {
+    return baudRate;
+}
+
+unsigned long SystemState::getMinTimerPeriod() {
+    unsigned long bits;
+    unsigned long period;
+    if (baudRate < fastBaudRate) {
+        return minTimerPeriod;
+    }
+    // 10 bits per byte on the wire, per sample in microseconds
+    if (frameFormat == FRAME_PACKED) {
+        bits = (10000000UL*packetSize)/packetSamples;
+    }
+    else {
+        bits = 10000000UL*legacyRecordSize;
+    }
+    period = bits/baudRate;
+    period += period/16;
+    return max(period, fastMinTimerPeriod);
+}
+
+void SystemState::setFrameFormat(FrameFormat value) {
+    if ((value == FRAME_LEGACY) || (value == FRAME_PACKED)) {
+        frameFormat = value;
+        // Timer period may no longer be allowed in the new format
+        if (timerPeriod < getMinTimerPeriod()) {
+            setTimerPeriod(getMinTimerPeriod());
+        }
+    }
+}
+
+FrameFormat SystemState::getFrameFormat() {
+    return frameFormat;
+}
+
+void SystemState::setSampleMode(SampleMode value) {
+    if ((value == SAMPLE_TIMER) || (value == SAMPLE_FIFO)) {
+        sampleMode = value;
+    }
+}
+
+SampleMode SystemState::getSampleMode() {
+    return sampleMode;
+}
+
+// Sets the ADXL345 output data rate code. Rates faster than the serial link
+// can carry are not allowed.
+bool SystemState::setOdrCode(unsigned int value) {
+    if ((value < minOdrCode) || (value > maxOdrCode)) {
+        return false;
+    }
+    if ((1000000UL << (15 - value))/3200 < getMinTimerPeriod()) {
+        return false;
+    }
+    odrCode = value;
+    return true;
+}
+
+unsigned int SystemState::getOdrCode() {
+    return odrCode;
+}
 
+// Returns the sample period in microseconds: the timer period, or in FIFO mode
+// the period of the output data rate, rounded down.
+unsigned long SystemState::getSamplePeriod() {
+    if (sampleMode == SAMPLE_FIFO) {
+        return (1000000UL << (15 - odrCode))/3200;
+    }
+    return timerPeriod;
+}
+
+// Sets the threshold trigger: while streaming only the samples from pre
+// samples before one with an absolute value of at least level raw counts on
+// any axis to post samples after it are sent. A level of zero turns the
+// trigger off.
+void SystemState::setTrigger(unsigned int level, unsigned int pre, unsigned int post) {
+    if (post == 0) {
+        return;
+    }
+    triggerLevel = level;
+    triggerPre = pre;
+    triggerPost = post;
+}
+
+unsigned int SystemState::getTriggerLevel() {
+    return triggerLevel;
+}
+
+unsigned int SystemState::getTriggerPre() {
+    return triggerPre;
+}
+
+unsigned int SystemState::getTriggerPost() {
+    return triggerPost;
+}
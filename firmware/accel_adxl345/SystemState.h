@@ -19,10 +19,38 @@ class SystemState {
         unsigned long getTimerPeriod();
         void setRange(unsigned int value);
         unsigned int getRange();
+        void setFullRes(bool value);
+        bool getFullRes();
+        bool setBaudRate(unsigned long value);
+        unsigned long getBaudRate();
+        unsigned long getMinTimerPeriod();
+        void setFrameFormat(FrameFormat value);
+        FrameFormat getFrameFormat();
+        void setSampleMode(SampleMode value);
+        SampleMode getSampleMode();
+        bool setOdrCode(unsigned int value);
+        unsigned int getOdrCode();
+        unsigned long getSamplePeriod();
+        void setTrigger(unsigned int level, unsigned int pre, unsigned int post);
+        unsigned int getTriggerLevel();
+        unsigned int getTriggerPre();
+        unsigned int getTriggerPost();
         unsigned int badSampleCount;
+        unsigned int sampleCount;
+        bool timestampReady;
+        unsigned int timestampSeq;
+        unsigned long timestampMicros;
     private:
         unsigned long timerPeriod; 
         unsigned int range;
+        bool fullRes;
+        unsigned long baudRate;
+        FrameFormat frameFormat;
+        SampleMode sampleMode;
+        unsigned int odrCode;
+        unsigned int triggerLevel;
+        unsigned int triggerPre;
+        unsigned int triggerPost;
 };
 
 #endif
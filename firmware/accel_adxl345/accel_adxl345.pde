@@ -18,11 +18,24 @@
 #include "constants.h"
 #include "AccelerometerBuf.h"
 #include "SystemState.h"
+#include "AdxlFifo.h"
 
 // Function prototypes
 void setAccelData();
 void timerCallback();
 void handleMessage();
+void sendValues(unsigned int mask);
+void sendAccelData();
+void sendAccelPacket();
+void sendTimestampPacket();
+void initBuffer();
+void drainFifo();
+void applyTrigger();
+void resetTrigger();
+unsigned int getSendSize();
+void consumeRecords(unsigned int num);
+void sendPeek();
+void sendRangeStatus();
 
 // Global varialbles
 ADXL345 accel;                       
@@ -30,6 +43,10 @@ AccelerometerBuf buffer;
 SystemState state; 
 SerialReceiver receiver;
 bool isFirst = true;
+unsigned long lastDrain = 0;
+unsigned int triggerScanned = 0;
+unsigned int triggerRelease = 0;
+unsigned int triggerHold = 0;
 
 // Initialize serial port, I2C communications, setup accelerometer, acceleromter 
 //  buffer and timer
@@ -43,9 +60,9 @@ void setup() {
     digitalWrite(A5,LOW);
     accel = ADXL345();
 
-    buffer.init(bufferSize);
+    initBuffer();
 
-    accel.SetRange(state.getRange(), true);
+    accel.SetRange(state.getRange(), state.getFullRes());
     accel.EnableMeasurements();
 
     state.init();
@@ -67,6 +84,12 @@ void loop() {
     
     // Send acceleration data to host PC
     if (state.mode  == MODE_STREAMING) {
+        if (state.getSampleMode() == SAMPLE_FIFO) {
+            drainFifo();
+        }
+        if (state.getTriggerLevel() > 0) {
+            applyTrigger();
+        }
         sendAccelData();
     }
 }
@@ -77,6 +100,10 @@ void handleMessage() {
     SerialCmd cmd;
     long timerPeriod;
     unsigned int range;
+    unsigned long baud;
+    unsigned int level;
+    unsigned int pre;
+    unsigned int post;
     AccelerometerRaw raw;
 
     cmd = (SerialCmd) receiver.readInt(0);
@@ -87,8 +114,12 @@ void handleMessage() {
             ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
                 state.mode = MODE_STOPPED;
             }
+            if (state.getSampleMode() == SAMPLE_FIFO) {
+                fifoStop();
+            }
             isFirst = true;
             buffer.clear();
+            resetTrigger();
             break;
 
         case CMD_START_STREAM:
@@ -96,6 +127,15 @@ void handleMessage() {
                 state.mode = MODE_STREAMING;
                 isFirst = true;
             }
+            ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+                state.sampleCount = 0;
+                state.timestampReady = false;
+            }
+            resetTrigger();
+            if (state.getSampleMode() == SAMPLE_FIFO) {
+                fifoStart(state.getOdrCode(), fifoWatermark);
+                lastDrain = micros();
+            }
             break;
 
         case CMD_SET_TIMER_PERIOD:
@@ -107,7 +147,7 @@ void handleMessage() {
 
         case CMD_GET_TIMER_PERIOD:
             if (state.mode == MODE_STOPPED) { 
-                Serial << state.getTimerPeriod() << endl;
+                Serial << state.getSamplePeriod() << endl;
             }
             break;
 
@@ -115,7 +155,16 @@ void handleMessage() {
             if (state.mode == MODE_STOPPED) {
                 range = (unsigned int) receiver.readInt(1);
                 state.setRange(range);
-                accel.SetRange(state.getRange(),true);
+                accel.SetRange(state.getRange(),state.getFullRes());
+                sendRangeStatus();
+            }
+            break;
+
+        case CMD_SET_RESOLUTION:
+            if (state.mode == MODE_STOPPED) {
+                state.setFullRes(receiver.readInt(1) != 0);
+                accel.SetRange(state.getRange(),state.getFullRes());
+                sendRangeStatus();
             }
             break;
 
@@ -133,6 +182,12 @@ void handleMessage() {
             }
             break;
 
+        case CMD_PEEK:
+            if (state.mode == MODE_STOPPED) {
+                sendPeek();
+            }
+            break;
+
         case CMD_GET_MAX_TIMER_PERIOD:
             if (state.mode == MODE_STOPPED) {
                 Serial << maxTimerPeriod << endl; 
@@ -141,7 +196,7 @@ void handleMessage() {
 
         case CMD_GET_MIN_TIMER_PERIOD:  
             if (state.mode == MODE_STOPPED) {
-                Serial << minTimerPeriod << endl;
+                Serial << state.getMinTimerPeriod() << endl;
             }
             break;
 
@@ -151,30 +206,395 @@ void handleMessage() {
             }
             break;
 
+        case CMD_GET_CONFIG:
+            // Timer period, range, min and max timer period and full
+            // resolution flag in one reply
+            if (state.mode == MODE_STOPPED) {
+                Serial << state.getSamplePeriod() << " " << state.getRange() << " ";
+                Serial << state.getMinTimerPeriod() << " " << maxTimerPeriod << " ";
+                Serial << state.getFullRes() << endl;
+            }
+            break;
+
+        case CMD_GET_VALUES:
+            // Argument is a bit mask of the get command ids to reply to
+            if (state.mode == MODE_STOPPED) {
+                sendValues((unsigned int) receiver.readInt(1));
+            }
+            break;
+
+        case CMD_SET_BAUD_RATE:
+            // Acknowledge with the new baud rate (0 if not allowed) at the old
+            // baud rate and then switch.
+            if (state.mode == MODE_STOPPED) {
+                baud = (unsigned long) receiver.readLong(1);
+                if (state.setBaudRate(baud)) {
+                    Serial << state.getBaudRate() << endl;
+                    Serial.flush();
+                    Serial.end();
+                    Serial.begin(state.getBaudRate());
+                }
+                else {
+                    Serial << 0 << endl;
+                }
+            }
+            break;
+
+        case CMD_SET_FRAME_FORMAT:
+            if (state.mode == MODE_STOPPED) {
+                state.setFrameFormat((FrameFormat) receiver.readInt(1));
+                initBuffer();
+            }
+            break;
+
+        case CMD_SET_SAMPLE_MODE:
+            if (state.mode == MODE_STOPPED) {
+                state.setSampleMode((SampleMode) receiver.readInt(1));
+            }
+            break;
+
+        case CMD_GET_SAMPLE_MODE:
+            if (state.mode == MODE_STOPPED) {
+                Serial << state.getSampleMode() << endl;
+            }
+            break;
+
+        case CMD_SET_ODR:
+            if (state.mode == MODE_STOPPED) {
+                state.setOdrCode((unsigned int) receiver.readInt(1));
+            }
+            break;
+
+        case CMD_GET_ODR:
+            if (state.mode == MODE_STOPPED) {
+                Serial << state.getOdrCode() << endl;
+            }
+            break;
+
+        case CMD_SET_TRIGGER:
+            // Arguments are the level in raw counts, zero for off, and the
+            // pre and post trigger sample counts
+            if (state.mode == MODE_STOPPED) {
+                level = (unsigned int) receiver.readLong(1);
+                pre = (unsigned int) receiver.readLong(2);
+                post = (unsigned int) receiver.readLong(3);
+                state.setTrigger(level, min(pre, buffer.getCapacity()/2), post);
+            }
+            break;
+
+        case CMD_GET_TRIGGER:
+            if (state.mode == MODE_STOPPED) {
+                Serial << state.getTriggerLevel() << " " << state.getTriggerPre() << " ";
+                Serial << state.getTriggerPost() << endl;
+            }
+            break;
+
         default:
             break;
     }
 
 }
 
-// Sends accelerometer data to the host PC
+// Sends the values for the get commands whose bits are set in mask on a single
+// line, in order of command id, separated by spaces.
+void sendValues(unsigned int mask) {
+    bool isFirstValue = true;
+    for (unsigned int id=0; id<16; id++) {
+        if (!(mask & (1 << id))) {
+            continue;
+        }
+        if (!isFirstValue) {
+            Serial << " ";
+        }
+        isFirstValue = false;
+        switch ((SerialCmd) id) {
+            case CMD_GET_TIMER_PERIOD:
+                Serial << state.getSamplePeriod();
+                break;
+            case CMD_GET_RANGE:
+                Serial << state.getRange();
+                break;
+            case CMD_GET_MAX_TIMER_PERIOD:
+                Serial << maxTimerPeriod;
+                break;
+            case CMD_GET_MIN_TIMER_PERIOD:
+                Serial << state.getMinTimerPeriod();
+                break;
+            case CMD_GET_BAD_SAMPLE_COUNT:
+                Serial << state.badSampleCount;
+                break;
+            default:
+                Serial << 0;
+                break;
+        }
+    }
+    Serial << endl;
+}
+
+// Sends the range and full resolution flag applied, in reply to the set_range
+// and set_resolution commands, so the host needn't read them back.
+void sendRangeStatus() {
+    Serial << state.getRange() << " " << state.getFullRes() << endl;
+}
+
+// Reads a single sample and sends it as a binary reply with one write, for
+// low latency polling.
+void sendPeek() {
+    unsigned char reply[peekSize];
+    unsigned char chk = 0;
+    AccelerometerRaw raw;
+
+    raw = accel.ReadRawAxis();
+    reply[0] = packetSync0;
+    reply[1] = packetSync1;
+    reply[2] = lowByte(raw.XAxis);
+    reply[3] = highByte(raw.XAxis);
+    reply[4] = lowByte(raw.YAxis);
+    reply[5] = highByte(raw.YAxis);
+    reply[6] = lowByte(raw.ZAxis);
+    reply[7] = highByte(raw.ZAxis);
+    for (unsigned int i=2; i<peekSize-1; i++) {
+        chk += reply[i];
+    }
+    reply[peekSize-1] = chk;
+    Serial.write(reply,peekSize);
+}
+
+// Allocates the sample buffer with the record size for the frame format from
+// the free RAM.
+void initBuffer() {
+    if (state.getFrameFormat() == FRAME_PACKED) {
+        buffer.init(packedRecordSize, ramReserve, maxBufferRecords);
+    }
+    else {
+        buffer.init(legacyRecordSize, ramReserve, maxBufferRecords);
+    }
+    state.setTrigger(
+            state.getTriggerLevel(),
+            min(state.getTriggerPre(), buffer.getCapacity()/2),
+            state.getTriggerPost()
+            );
+}
+
+// Clears the threshold trigger's position in the sample buffer.
+void resetTrigger() {
+    triggerScanned = 0;
+    triggerRelease = 0;
+    triggerHold = 0;
+}
+
+// Checks the samples added to the buffer since the last call against the
+// threshold trigger. A sample with an absolute value of at least the level on
+// any axis releases it and the samples before it to be sent and holds the
+// trigger open for the post trigger count. While nothing is released only the
+// last pre trigger samples are kept. The discarded samples show up on the
+// host as gaps in the sequence numbers of packed frames.
+void applyTrigger() {
+    unsigned int size = buffer.getSize();
+    unsigned int level = state.getTriggerLevel();
+    unsigned int pre = state.getTriggerPre();
+    unsigned char *rec;
+    int value;
+
+    while (triggerScanned < size) {
+        rec = buffer.peek(triggerScanned);
+        for (unsigned int i=0; i<3; i++) {
+            value = (int) word(rec[2*i+1], rec[2*i]);
+            if ((unsigned int) abs(value) >= level) {
+                triggerHold = state.getTriggerPost();
+            }
+        }
+        triggerScanned++;
+        if (triggerHold > 0) {
+            triggerHold--;
+            triggerRelease = triggerScanned;
+        }
+    }
+    if ((triggerRelease == 0) && (size > pre)) {
+        buffer.consume(size - pre);
+        triggerScanned -= size - pre;
+    }
+}
+
+// Returns the number of samples at the front of the buffer which can be sent.
+unsigned int getSendSize() {
+    if (state.getTriggerLevel() > 0) {
+        return triggerRelease;
+    }
+    return buffer.getSize();
+}
+
+// Removes sent samples from the buffer.
+void consumeRecords(unsigned int num) {
+    buffer.consume(num);
+    if (state.getTriggerLevel() > 0) {
+        triggerScanned -= num;
+        triggerRelease -= num;
+    }
+}
+
+// Sends accelerometer data to the host PC. Legacy records are complete frames
+// so a run of them is sent with a single write.
 void sendAccelData() {
-    unsigned int sendCnt=0;
-    int maxValue;
-    static AccelerometerRaw raw;
-    static AccelerometerRaw rawlast;
-
-    while ((buffer.getSize() > 0) && (sendCnt < maxSendCnt)) {
-        raw = buffer.getVal();
-        Serial << _BYTE(lowByte(raw.XAxis)) << _BYTE(highByte(raw.XAxis));
-        Serial << _BYTE(lowByte(raw.YAxis)) << _BYTE(highByte(raw.YAxis));
-        Serial << _BYTE(lowByte(raw.ZAxis)) << _BYTE(highByte(raw.ZAxis));
-        Serial << _BYTE(0); // bit to check that data is in sync.
-        sendCnt++;
+    unsigned char *ptr;
+    unsigned int num;
+    if (state.getFrameFormat() == FRAME_PACKED) {
+        sendAccelPacket();
+        return;
+    }
+    num = buffer.getContiguous(ptr);
+    num = min(num, getSendSize());
+    num = min(num, maxSendBytes/legacyRecordSize);
+    if (num > 0) {
+        Serial.write(ptr, num*legacyRecordSize);
+        consumeRecords(num);
         isFirst = false;
     }
 }
 
+// Sends accelerometer data to the host PC as a single packed frame. Waits for
+// a full packet unless the timer period is long or the end of a triggered
+// window has been reached. A packet ends early if the
+// next sample does not follow on in sequence, that sample then starts the
+// next packet. Samples are copied from the buffer without disabling
+// interrupts and only removed once the packet is built.
+void sendAccelPacket() {
+    unsigned char packet[packetSize];
+    unsigned char chk = 0;
+    unsigned int size;
+    unsigned int count;
+    unsigned int pos;
+    unsigned int seq;
+    unsigned int firstSeq = 0;
+    unsigned char *rec;
+
+    sendTimestampPacket();
+
+    size = getSendSize();
+    if (size == 0) {
+        return;
+    }
+    if ((size < packetSamples) && (state.getSamplePeriod() < packetFlushPeriod)) {
+        if ((state.getTriggerLevel() == 0) || (triggerHold > 0)) {
+            return;
+        }
+    }
+
+    count = 0;
+    while ((count < packetSamples) && (count < size)) {
+        rec = buffer.peek(count);
+        seq = word(rec[7], rec[6]);
+        if (count == 0) {
+            firstSeq = seq;
+        }
+        else if (seq != (unsigned int) (firstSeq + count)) {
+            break;
+        }
+        memcpy(&packet[5+6*count], rec, 6);
+        count++;
+    }
+    consumeRecords(count);
+    for (pos=5+6*count; pos<packetSize-1; pos++) {
+        packet[pos] = 0;
+    }
+
+    packet[0] = packetSync0;
+    packet[1] = packetSync1;
+    packet[2] = lowByte(firstSeq);
+    packet[3] = highByte(firstSeq);
+    packet[4] = (unsigned char) count;
+    for (unsigned int i=2; i<packetSize-1; i++) {
+        chk += packet[i];
+    }
+    packet[packetSize-1] = chk;
+    Serial.write(packet,packetSize);
+    isFirst = false;
+}
+
+// Sends the timestamp taken by the timer interrupt, if there is a new one, as
+// a packet with the count set to packetTimestamp.
+void sendTimestampPacket() {
+    unsigned char packet[packetSize];
+    unsigned char chk = 0;
+    unsigned int seq;
+    unsigned long t;
+    unsigned int badCount;
+    bool ready;
+
+    ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+        ready = state.timestampReady;
+        seq = state.timestampSeq;
+        t = state.timestampMicros;
+        badCount = state.badSampleCount;
+        state.timestampReady = false;
+    }
+    if (!ready) {
+        return;
+    }
+
+    for (unsigned int pos=0; pos<packetSize; pos++) {
+        packet[pos] = 0;
+    }
+    packet[0] = packetSync0;
+    packet[1] = packetSync1;
+    packet[2] = lowByte(seq);
+    packet[3] = highByte(seq);
+    packet[4] = packetTimestamp;
+    for (unsigned int i=0; i<4; i++) {
+        packet[5+i] = (unsigned char) (t >> (8*i));
+    }
+    packet[9] = lowByte(badCount);
+    packet[10] = highByte(badCount);
+    packet[11] = (unsigned char) state.getRange();
+    packet[12] = (unsigned char) state.getFullRes();
+    for (unsigned int i=2; i<packetSize-1; i++) {
+        chk += packet[i];
+    }
+    packet[packetSize-1] = chk;
+    Serial.write(packet,packetSize);
+}
+
+// Moves the samples in the ADXL345's FIFO into the sample buffer once there
+// are fifoWatermark of them or fifoMaxWait has passed since the last drain. A
+// full FIFO may have overwritten samples, which is counted as a bad sample.
+// A timestamp is the drain time less the nominal sample period for each newer
+// sample in the FIFO, so it is late by up to one sample period.
+void drainFifo() {
+    unsigned char num;
+    unsigned int seq;
+    unsigned long t;
+    AccelerometerRaw raw;
+
+    t = micros();
+    if ((t - lastDrain) < fifoMaxWait) {
+        num = fifoEntries();
+        if (num < fifoWatermark) {
+            return;
+        }
+    }
+    else {
+        num = fifoEntries();
+    }
+    lastDrain = t;
+    if (num >= adxlFifoSize) {
+        state.badSampleCount++;
+    }
+    for (unsigned char i=0; i<num; i++) {
+        raw = fifoRead();
+        seq = state.sampleCount++;
+        if (!buffer.putVal(raw,seq)) {
+            state.badSampleCount++;
+        }
+        if ((seq % timestampInterval) == 0) {
+            ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+                state.timestampMicros = t - (num - 1 - i)*state.getSamplePeriod();
+                state.timestampSeq = seq;
+                state.timestampReady = true;
+            }
+        }
+    }
+}
+
 // Interrupt serive routine for timer1 overflow. Reads data from the accelerometer
 // and puts it into the accelerometer buffer.
 void timerCallback() {
@@ -185,8 +605,22 @@ void timerCallback() {
     unsigned long t0;
     unsigned long t1;
     unsigned long t2;
+    unsigned int seq;
 
+    if (state.getSampleMode() == SAMPLE_FIFO) {
+        return;
+    }
     if ((accel.IsConnected) && (state.mode == MODE_STREAMING)) { 
+        // Every sample period gets a sequence number so that bad and dropped
+        // samples show up as gaps on the host.
+        seq = state.sampleCount++;
+        // Timestamp the sample period before interrupts are enabled so the
+        // reading is not delayed.
+        if ((seq % timestampInterval) == 0) {
+            state.timestampMicros = micros();
+            state.timestampSeq = seq;
+            state.timestampReady = true;
+        }
         sei();
         // Take two measurements ... and compare them
         raw0 = accel.ReadRawAxis();
@@ -201,7 +635,9 @@ void timerCallback() {
             test=false;
         }
         if (test) {
-            buffer.putVal(raw0);
+            if (!buffer.putVal(raw0,seq)) {
+                state.badSampleCount++;
+            }
         }
         else {
             state.badSampleCount++;
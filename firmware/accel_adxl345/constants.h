@@ -12,25 +12,103 @@
 
 // Constants
 const unsigned long baudRate = 38400;
-const unsigned int maxSendCnt = 20;
-const unsigned int bufferSize = 100;
+
+// The sample buffer takes the RAM left after setup less ramReserve bytes for
+// the stack, up to maxBufferRecords samples. Legacy frames are sent straight
+// from the buffer in writes of up to maxSendBytes bytes.
+const unsigned int ramReserve = 384;
+const unsigned int maxBufferRecords = 512;
+const unsigned int legacyRecordSize = 7;
+const unsigned int packedRecordSize = 8;
+const unsigned int maxSendBytes = 128;
+
+// Baud rates which the host can switch to after connecting. At or above
+// fastBaudRate the minimum timer period is the time to send a sample at the
+// baud rate, plus 1/16 for headroom, but no less than fastMinTimerPeriod.
+const unsigned int numBaudRate = 6;
+const unsigned long allowedBaudRate[] = {38400, 57600, 115200, 250000, 500000, 1000000};
+const unsigned long fastBaudRate = 115200;
 
 const unsigned long defaultTimerPeriod = 2000;
 const unsigned long minTimerPeriod = 2000;
+const unsigned long fastMinTimerPeriod = 312;
 const unsigned long maxTimerPeriod = 100000;
 
+// Packed frame format: sync bytes, 16 bit sample sequence number of the first
+// sample, sample count, packetSamples samples (unused samples are zero) and an
+// 8 bit sum of the bytes from the sequence number to the last sample. Samples
+// in a packet always have consecutive sequence numbers. At long timer periods
+// partial packets are sent rather than waiting for the packet to fill.
+const unsigned char packetSync0 = 0xA5;
+const unsigned char packetSync1 = 0x5A;
+const unsigned int packetSamples = 8;
+const unsigned int packetSize = 6 + 6*packetSamples;
+const unsigned long packetFlushPeriod = 10000;
+
+// Timestamp packets have the same layout as sample packets with the count set
+// to packetTimestamp. The sequence number is that of the sample period at
+// which micros() was read and the first four data bytes hold the 32 bit
+// micros() value, low byte first, followed by the 16 bit bad sample count so
+// the host can monitor it while streaming. One is sent every timestampInterval sample
+// periods so the host can correct for the drift of the firmware clock.
+const unsigned char packetTimestamp = 0xFF;
+const unsigned int timestampInterval = 256;
+
+// Binary reply to the peek command: sync bytes, the x, y and z values, low
+// byte first, and an 8 bit sum of the six value bytes.
+const unsigned int peekSize = 9;
+
 const unsigned int numRange = 4;
 const unsigned int allowedRange[] = {2,4,8,16};
 const unsigned int defaultRange = 16;
 
+// In full resolution mode the ADXL345 scale is 3.9 mg per count at every range,
+// otherwise the values are 10 bit and the scale doubles with each range. The
+// set_range and set_resolution commands reply with the range and resolution
+// applied, and timestamp packets carry them in data bytes 6 and 7.
+const bool defaultFullRes = true;
+
 const int maxSampleDiff = 200;
 
+// ADXL345 registers for FIFO sampling. In SAMPLE_FIFO mode the chip samples at
+// the output data rate given by odrCode, 3200/2^(15 - odrCode) Hz, into its
+// FIFO, which the main loop drains once it holds fifoWatermark samples or
+// fifoMaxWait microseconds have passed.
+const unsigned char adxlAddress = 0x53;
+const unsigned char adxlRegBwRate = 0x2C;
+const unsigned char adxlRegDataX0 = 0x32;
+const unsigned char adxlRegFifoCtl = 0x38;
+const unsigned char adxlRegFifoStatus = 0x39;
+const unsigned char adxlFifoBypass = 0x00;
+const unsigned char adxlFifoStream = 0x80;
+const unsigned char adxlFifoSize = 32;
+const unsigned char fifoWatermark = 16;
+const unsigned long fifoMaxWait = 50000;
+const unsigned char minOdrCode = 6;
+const unsigned char maxOdrCode = 15;
+const unsigned char defaultOdrCode = 10;
+
+// Threshold trigger. The samples before a trigger are held in the sample
+// buffer, so the pre-trigger count is limited to half of its capacity.
+const unsigned int defaultTriggerPre = 64;
+const unsigned int defaultTriggerPost = 256;
+
 // Enumss
 enum OperatingMode {
     MODE_STOPPED, 
     MODE_STREAMING
 };
 
+enum SampleMode {
+    SAMPLE_TIMER,
+    SAMPLE_FIFO
+};
+
+enum FrameFormat {
+    FRAME_LEGACY,
+    FRAME_PACKED
+};
+
 enum SerialCmd {
     CMD_STOP_STREAM, 
     CMD_START_STREAM,
@@ -41,7 +119,19 @@ enum SerialCmd {
     CMD_GET_SAMPLE,
     CMD_GET_MAX_TIMER_PERIOD,
     CMD_GET_MIN_TIMER_PERIOD,
-    CMD_GET_BAD_SAMPLE_COUNT
+    CMD_GET_BAD_SAMPLE_COUNT,
+    CMD_GET_CONFIG,
+    CMD_GET_VALUES,
+    CMD_SET_BAUD_RATE,
+    CMD_SET_FRAME_FORMAT,
+    CMD_SET_SAMPLE_MODE,
+    CMD_GET_SAMPLE_MODE,
+    CMD_SET_ODR,
+    CMD_GET_ODR,
+    CMD_SET_TRIGGER,
+    CMD_GET_TRIGGER,
+    CMD_PEEK,
+    CMD_SET_RESOLUTION
 };
 
 #endif
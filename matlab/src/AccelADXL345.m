@@ -148,11 +148,13 @@ classdef AccelADXL345 < handle
         end
         
         function setRange(self, range)
-           % Sets the current acceleration range
+           % Sets the current acceleration range. The device replies with
+           % the range and full resolution flag applied.
            self.checkRange(range);
            cmd = sprintf('[%d, %d]', self.cmdSetRange, range);
            self.sendCmd(cmd);
-           self.range = self.getRange();
+           status = str2array(fscanf(self.ser));
+           self.range = status(1);
         end
         
         function accel = peek(self)
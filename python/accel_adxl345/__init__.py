@@ -1 +1,10 @@
 from accel_adxl345 import *
+from ring_buffer import SampleRingBuffer
+from async_accel_adxl345 import AsyncAccelADXL345, DeviceLoop, Reply
+from device_group import DeviceGroup
+from capture_file import CaptureWriter, RotatingCaptureWriter, CaptureFile
+from spectral import WelchPSD
+from timebase import Timebase
+from sample_chunk import SampleChunk, concatChunks
+from trigger import TriggerEngine, ThresholdTrigger, SlopeTrigger, BandEnergyTrigger
+from calibration import Calibration, CalibrationFitter, CalibrationStore
@@ -8,32 +8,150 @@ import time
 import serial
 import sys
 import numpy
-import struct
+from frame_decoder import FrameDecoder
+from frame_decoder import FRAME_LEGACY
+from frame_decoder import FRAME_PACKED
+from frame_decoder import createDecoder
+from frame_decoder import PACKET_SYNC
+from timebase import Timebase
+from sample_chunk import SampleChunk
+from metrics import Metrics
+from streaming import StreamReader, DEFAULT_QUEUE_SIZE
+from config_cache import ConfigCache
+from calibration import Calibration
+from calibration import CalibrationStore
+from capture_file import CaptureWriter
+from capture_file import RotatingCaptureWriter
+from capture_file import ROTATE_MAX_BYTES
+from capture_file import ROTATE_MAX_DURATION
 
 BUF_EMPTY_NUM = 5
 BUF_EMPTY_DT = 0.05
+READY_TIMEOUT = 3.0
+NO_RESET_READY_TIMEOUT = 0.5
+
+# Command ids
+CMD_ID = {
+        'stop_streaming'       : 0,
+        'start_streaming'      : 1,
+        'set_timer_period'     : 2, 
+        'get_timer_period'     : 3,
+        'set_range'            : 4,
+        'get_range'            : 5,
+        'get_sample'           : 6,
+        'get_max_timer_period' : 7,
+        'get_min_timer_period' : 8,
+        'get_bad_sample_count' : 9,
+        'get_config'           : 10,
+        'get_values'           : 11,
+        'set_baud_rate'        : 12,
+        'set_frame_format'     : 13,
+        'set_sample_mode'      : 14,
+        'get_sample_mode'      : 15,
+        'set_odr'              : 16,
+        'get_odr'              : 17,
+        'set_trigger'          : 18,
+        'get_trigger'          : 19,
+        'peek'                 : 20,
+        'set_resolution'       : 21,
+        }
+
+# Single value get commands which can be combined in a get_values command and
+# the type of their values (int unless given)
+VALUE_CMDS = (
+        'get_timer_period', 
+        'get_range', 
+        'get_max_timer_period', 
+        'get_min_timer_period', 
+        'get_bad_sample_count',
+        )
+VALUE_TYPES = {
+        'get_timer_period' : float,
+        'get_sample'       : float,
+        }
+
+# Values returned by the get_config command, in order. Firmware without the
+# full_res value always uses full resolution.
+CONFIG_KEYS = ('sample_dt', 'range', 'min_sample_dt', 'max_sample_dt', 'full_res')
+CONFIG_CMDS = ('get_timer_period', 'get_range', 'get_min_timer_period', 'get_max_timer_period')
+
+# Allowed accelerations ranges and scale factors. In full resolution mode the
+# scale is the same at every range, otherwise the values are 10 bit and the
+# scale doubles with each range. ACCEL_SCALE_TABLE maps (range, full_res) to the
+# scale in m/s^2 per count.
+ALLOWED_ACCEL_RANGE = (2, 4, 8, 16)
+ACCEL_SCALE = 0.0384431560448
+ACCEL_SCALE_TABLE = dict(
+        [((x,True),ACCEL_SCALE) for x in ALLOWED_ACCEL_RANGE] +
+        [((x,False),ACCEL_SCALE*x/2) for x in ALLOWED_ACCEL_RANGE]
+        )
+
+# Sampling modes: the firmware timer reads each sample, or the ADXL345 samples
+# at its output data rate into its FIFO which the firmware drains
+SAMPLE_TIMER = 0
+SAMPLE_FIFO = 1
+
+# ADXL345 output data rate codes allowed in SAMPLE_FIFO mode and their rates
+ODR_CODES = range(6,16)
+ODR_RATES = dict((code,3200.0/2**(15-code)) for code in ODR_CODES)
+
+# Binary reply to the peek command: sync word, x, y and z values and an 8 bit
+# sum of the value bytes
+PEEK_DTYPE = numpy.dtype([
+    ('sync', '<u2'),
+    ('data', '<i2', (3,)),
+    ('chk',  'u1'),
+    ])
+PEEK_SIZE = PEEK_DTYPE.itemsize
+
+# Default firmware threshold trigger pre and post trigger sample counts
+DEFAULT_TRIGGER_PRE = 64
+DEFAULT_TRIGGER_POST = 256
+
+# Metrics counted by the frame decoder: metric name, decoder attribute, help
+DECODER_METRICS = (
+        ('bytes_read',      'bytesDecoded',  'Bytes of streaming data read'),
+        ('frames_decoded',  'framesDecoded', 'Frames or packets decoded'),
+        ('samples_decoded', 'sampleIndex',   'Samples decoded'),
+        ('sync_errors',     'syncErrors',    'Times the stream lost sync'),
+        ('skipped_bytes',   'skippedBytes',  'Bytes skipped while resynchronising'),
+        ('lost_samples',    'lostSamples',   'Samples missing from the stream'),
+        )
+
+# Baud rates the device can be switched to after connecting at the default rate
+DEFAULT_BAUD_RATE = 38400
+ALLOWED_BAUD_RATE = (38400, 57600, 115200, 250000, 500000, 1000000)
+
+def parseValue(line,convert):
+    """
+    Converts a reply line containing a single value or a list of values
+    separated by spaces.
+    """
+    if ' ' in line:
+        return [convert(x) for x in line.split(' ')]
+    return convert(line)
+
+def parseConfig(value):
+    """
+    Returns the configuration dictionary for the list of values in a
+    get_config reply, or None if it isn't one.
+    """
+    if not isinstance(value,list) or not len(CONFIG_KEYS) - 1 <= len(value) <= len(CONFIG_KEYS):
+        return None
+    return dict(zip(CONFIG_KEYS,value))
+
 
 class AccelADXL345(serial.Serial):
 
     def __init__(self, **kwarg):
 
-        # Command ids
-        self.cmd_id = {
-                'stop_streaming'       : 0,
-                'start_streaming'      : 1,
-                'set_timer_period'     : 2, 
-                'get_timer_period'     : 3,
-                'set_range'            : 4,
-                'get_range'            : 5,
-                'get_sample'           : 6,
-                'get_max_timer_period' : 7,
-                'get_min_timer_period' : 8,
-                'get_bad_sample_count' : 9,
-                }
-
-        # Allowed accelerations ranges and scale factors
-        self.allowedAccelRange = (2, 4, 8, 16)
-        self.accelScale = 0.0384431560448
+        self.cmd_id = CMD_ID
+        self.peekCmd = '[{0}]\n'.format(CMD_ID['peek'])
+        self.allowedAccelRange = ALLOWED_ACCEL_RANGE
+        self.accelScale = ACCEL_SCALE
+        self.fullRes = True
+        self.rangeReply = False
+        self.hasPeek = False
 
         try:
             self.reset_sleep = kwarg.pop('reset_sleep')
@@ -47,30 +165,313 @@ class AccelADXL345(serial.Serial):
         if not self.checkAccelRange(self.accelRange):
             raise ValueError, 'unknown acceleration range {0}'.format(self.accelRange)
 
+        try:
+            self.configCache = ConfigCache(kwarg.pop('config_cache'))
+        except KeyError:
+            self.configCache = None
+
+        try:
+            self.cacheKey = kwarg.pop('cache_key')
+        except KeyError:
+            self.cacheKey = None
+
+        try:
+            self.calibrationStore = CalibrationStore(kwarg.pop('calibration_file'))
+        except KeyError:
+            self.calibrationStore = None
+
+        try:
+            self.negotiateBaudRate = kwarg.pop('negotiate_baudrate')
+        except KeyError:
+            self.negotiateBaudRate = None
+
+        try:
+            frameFormat = kwarg.pop('frame_format')
+        except KeyError:
+            frameFormat = FRAME_LEGACY
+
         _kwarg = {
                 'port'     : '/dev/ttyUSB0',
                 'timeout'  : 0.1,
-                'baudrate' : 38400,
+                'baudrate' : DEFAULT_BAUD_RATE,
                 }
 
         _kwarg.update(kwarg)
+        self.decoder = FrameDecoder()
+        self.createMetrics()
+        self.gaps = []
+        self.timebase = Timebase(0)
+        self.sampleMode = SAMPLE_TIMER
+        self.outputDataRate = None
+        self.frameFormat = FRAME_LEGACY
+        self.streamReader = None
+        self.streaming = False
+        self.combinedQuery = False
+        self.calibration = None
         super(AccelADXL345,self).__init__(**_kwarg)
+        if self.cacheKey is None:
+            self.cacheKey = self.port
+
+        # Wait for the device to respond rather than sleeping through the reset
         if self.reset_sleep:
-            time.sleep(2.0)
-        self.emptyBuffer()
+            config = self.waitReady(READY_TIMEOUT)
+        else:
+            config = self.waitReady(NO_RESET_READY_TIMEOUT)
 
-        # Get sample dt and current range setting
-        self.sampleDt = self.getSampleDt()
-        self.accelRange = self.getRange()
+        # Get sample dt, current range setting and max and min allowed sample dt
+        self.combinedQuery = config is not None
+        if config is None:
+            config = self.getConfigPipelined()
+        self.setConfig(config)
+
+        # Switch to higher baud rate and frame format for streaming
+        if self.negotiateBaudRate is not None:
+            self.setBaudRate(self.negotiateBaudRate)
+        if frameFormat != FRAME_LEGACY:
+            self.setFrameFormat(frameFormat)
+
+    def createMetrics(self):
+        """
+        Creates the registry of metrics, self.metrics, for the device.
+        """
+        self.metrics = Metrics()
+        for name, attr, doc in DECODER_METRICS:
+            self.metrics.counter(name,doc)
+        self.decoderTotals = dict((name,0) for name, attr, doc in DECODER_METRICS)
+        self.overrunTotal = 0
+        self.queueOverruns = self.metrics.counter('queue_overruns','Chunks dropped because the stream queue was full')
+        self.queueSize = self.metrics.gauge('queue_size','Samples waiting in the stream queue')
+        self.inWaitingMax = self.metrics.gauge('in_waiting_max','High water mark of bytes waiting in the serial input buffer')
+        self.deviceBadSamples = self.metrics.gauge('device_bad_samples','Firmware count of bad or dropped samples')
+        self.readLatency = self.metrics.histogram('read_latency_seconds','Time taken by each readValues, readInto or readIntoRing call')
+        self.commandRtt = self.metrics.histogram('command_rtt_seconds','Time from sending a command to reading a reply')
+        self.cmdTime = 0.0
+        self.metrics.addCollector(self.collectMetrics)
+
+    def collectMetrics(self):
+        """
+        Copies the counts kept by the decoder and stream reader into the
+        metrics.
+        """
+        for name, attr, doc in DECODER_METRICS:
+            self.metrics.get(name).value = self.decoderTotals[name] + getattr(self.decoder,attr)
+        if self.decoder.badSampleCount is not None:
+            self.deviceBadSamples.set(self.decoder.badSampleCount)
+            self.decoder.badSampleCount = None
+        overruns = self.overrunTotal
+        if self.streamReader is not None:
+            overruns += self.streamReader.overruns
+            self.queueSize.set(self.streamReader.queuedSamples)
+        self.queueOverruns.value = overruns
+
+    def getMetrics(self):
+        """
+        Returns a dictionary of the current value of each metric, see
+        metrics.Metrics.snapshot.
+        """
+        return self.metrics.snapshot()
+
+    def resetDecoder(self,decoder=None):
+        """
+        Adds the decoder's counts to the metrics totals and resets it, or
+        replaces it with decoder if given. The range reported by the stream,
+        if any, is kept first.
+        """
+        self.checkStreamRange()
+        for name, attr, doc in DECODER_METRICS:
+            self.decoderTotals[name] += getattr(self.decoder,attr)
+        if decoder is None:
+            self.decoder.reset()
+        else:
+            self.decoder = decoder
 
-        # Get max and min allowed sample dt
-        self.minSampleDt = self.getMinSampleDt()
-        self.maxSampleDt = self.getMaxSampleDt()
+    def inWaiting(self):
+        num = super(AccelADXL345,self).inWaiting()
+        self.inWaitingMax.setMax(num)
+        return num
+
+    def waitReady(self,timeout):
+        """
+        Polls the device until it responds or timeout seconds have elapsed. 
+        Each attempt stops any streaming and sends the get_config and
+        get_range commands. Returns the device configuration dictionary if the
+        firmware supports get_config and None if only get_range was answered.
+        """
+        cmd = ''.join([self.formatCmd(name) for name in ('stop_streaming','get_config','get_range')])
+        t0 = time.time()
+        while time.time() - t0 < timeout:
+            self.flushInput()
+            self.resetDecoder()
+            self.sendCmd(cmd)
+            try:
+                value = self.readInt()
+            except ValueError:
+                continue
+            config = parseConfig(value)
+            if config is not None:
+                self.readValue()
+                return config
+            if value in self.allowedAccelRange:
+                self.flushInput()
+                return None
+        raise IOError, 'device on {0} not responding'.format(self.port)
+
+    def getConfig(self):
+        """
+        Returns the device configuration dictionary (sample_dt, range,
+        min_sample_dt, max_sample_dt, full_res) using the combined get_config
+        command.
+        """
+        self.sendCmd(self.formatCmd('get_config'))
+        config = parseConfig(self.readInt())
+        if config is None:
+            raise IOError, 'bad get_config reply'
+        return config
+
+    def getConfigPipelined(self):
+        """
+        Returns the device configuration dictionary for firmware without the
+        get_config command. The queries are written together and the replies
+        read in order. The min and max sample dt, which are fixed by the
+        firmware, are taken from the config cache when available.
+        """
+        cached = None
+        if self.configCache is not None:
+            cached = self.configCache.get(self.cacheKey)
+        if cached is not None:
+            keys, cmds = CONFIG_KEYS[:2], CONFIG_CMDS[:2]
+        else:
+            keys, cmds = CONFIG_KEYS, CONFIG_CMDS
+        config = dict(zip(keys,self.query(cmds)))
+        if cached is not None:
+            config['min_sample_dt'] = cached['min_sample_dt']
+            config['max_sample_dt'] = cached['max_sample_dt']
+        return config
+
+    def setConfig(self,config):
+        """
+        Sets the host side copy of the device configuration and saves it in
+        the config cache if one is in use. Firmware which reports full_res also
+        replies to set_range with the range and resolution applied and has the
+        binary peek command.
+        """
+        self.sampleDt = float(config['sample_dt'])
+        if self.sampleMode == SAMPLE_FIFO:
+            # The firmware rounds the output data rate period to microseconds
+            self.sampleDt = 1.0e6/self.outputDataRate
+        self.accelRange = int(config['range'])
+        self.fullRes = bool(config.get('full_res',True))
+        self.accelScale = ACCEL_SCALE_TABLE[(self.accelRange,self.fullRes)]
+        self.rangeReply = 'full_res' in config
+        self.hasPeek = self.rangeReply
+        self.minSampleDt = int(config['min_sample_dt'])
+        self.maxSampleDt = int(config['max_sample_dt'])
+        if self.configCache is not None:
+            self.configCache.set(self.cacheKey,config)
+        self.loadCalibration()
+
+    def loadCalibration(self):
+        """
+        Loads the calibration for the device, by cache key, and the current
+        range from the calibration file if one is in use. Without one the
+        nominal accelScale is used.
+        """
+        if self.calibrationStore is not None:
+            self.calibration = self.calibrationStore.get(self.cacheKey,self.accelRange,self.fullRes)
+
+    def setCalibration(self,calibration,save=True):
+        """
+        Sets the Calibration applied to the samples at the current range, None
+        for the nominal accelScale, and if save is True stores it in the
+        calibration file.
+        """
+        self.calibration = calibration
+        if save and self.calibrationStore is not None:
+            self.calibrationStore.set(self.cacheKey,self.accelRange,calibration,self.fullRes)
+
+    def getCalibration(self):
+        """
+        Returns the Calibration in use, or one for the nominal accelScale.
+        """
+        if self.calibration is None:
+            return Calibration.fromScale(self.accelScale)
+        return self.calibration
+
+    def setBaudRate(self,baudRate):
+        """
+        Switches the device and the serial port to the given baud rate. The
+        device acknowledges at the old rate before switching. The device 
+        configuration is then read again at the new rate as the minimum 
+        sample dt depends on the baud rate. The device returns to the default
+        baud rate when it is reset.
+        """
+        _baudRate = int(baudRate)
+        if not _baudRate in ALLOWED_BAUD_RATE:
+            raise ValueError, 'baud rate {0} not allowed'.format(_baudRate)
+        self.sendCmd(self.formatCmd('set_baud_rate',_baudRate))
+        try:
+            ack = self.readInt()
+        except ValueError:
+            ack = None
+        if ack != _baudRate:
+            raise IOError, 'device did not accept baud rate {0}'.format(_baudRate)
+        self.baudrate = _baudRate
+        config = self.waitReady(NO_RESET_READY_TIMEOUT)
+        if config is None:
+            config = self.getConfigPipelined()
+        self.setConfig(config)
+
+    def setFrameFormat(self,frameFormat):
+        """
+        Sets the format of the streaming data, FRAME_LEGACY for 7 byte frames
+        or FRAME_PACKED for packets of several samples with a sequence number
+        and checksum, and selects the matching decoder. The configuration is
+        read back as the minimum sample dt depends on the format.
+        """
+        self.resetDecoder(createDecoder(frameFormat))
+        self.sendCmd(self.formatCmd('set_frame_format',frameFormat))
+        self.frameFormat = frameFormat
+        if self.combinedQuery:
+            self.setConfig(self.getConfig())
+        else:
+            self.setConfig(self.getConfigPipelined())
+
+    def query(self,names):
+        """
+        Sends the get commands in the list, names, and returns their values in
+        the same order, e.g. query(['get_range','get_bad_sample_count']). If 
+        the firmware supports it and all the commands return single values
+        they are combined into one get_values command with a single reply line.
+        Otherwise all the commands are written at once and the replies are read
+        in order.
+        """
+        names = list(names)
+        if self.combinedQuery and all(name in VALUE_CMDS for name in names):
+            ids = sorted(set(self.cmd_id[name] for name in names))
+            mask = sum(1 << x for x in ids)
+            self.sendCmd(self.formatCmd('get_values',mask))
+            line = self.readValue()
+            values = line.split(' ') if line else []
+            if len(values) != len(ids):
+                raise IOError, 'bad get_values reply'
+            values = dict(zip(ids,values))
+            return [VALUE_TYPES.get(name,int)(values[self.cmd_id[name]]) for name in names]
+        self.sendCmd(''.join([self.formatCmd(name) for name in names]))
+        return [parseValue(self.readValue(),VALUE_TYPES.get(name,int)) for name in names]
+
+    def formatCmd(self,name,*args):
+        """
+        Returns the command string for the command with the given name and
+        arguments.
+        """
+        vals = [str(self.cmd_id[name])] + [str(x) for x in args]
+        return '[{0}]\n'.format(','.join(vals))
 
     def sendCmd(self,cmd):
         """
         Send the command, cmd, to the device
         """
+        self.cmdTime = time.time()
         self.write(cmd)
 
     def readValue(self):
@@ -78,6 +479,8 @@ class AccelADXL345(serial.Serial):
         Read a value from the device.
         """
         line = self.readline()
+        if line:
+            self.commandRtt.observe(time.time() - self.cmdTime)
         line = line.strip()
         return line
 
@@ -113,6 +516,7 @@ class AccelADXL345(serial.Serial):
             #print 'empty %d'%(i,), self.inWaiting()
             self.flushInput()
             time.sleep(BUF_EMPTY_DT)
+        self.resetDecoder()
 
 
     def checkAccelRange(self,value):
@@ -121,19 +525,88 @@ class AccelADXL345(serial.Serial):
         """
         return value in self.allowedAccelRange
 
-    def startStreaming(self):
+    def startStreaming(self,background=False,queueSize=DEFAULT_QUEUE_SIZE):
         """
-        Start data streaming form the accelerometer
+        Start data streaming form the accelerometer. If background is True a
+        StreamReader thread is started which drains the serial port into a
+        queue of sample chunks, holding up to queueSize samples, read with
+        getChunk or iterChunks. The serial port should not be read by the
+        caller while the reader is running.
         """
+        self.timebase.reset(self.sampleDt)
+        if background:
+            if self.streamReader is not None:
+                self.overrunTotal += self.streamReader.overruns
+            self.resetDecoder()
+            self.streamReader = StreamReader(self,queueSize)
         cmd = '[{0}]\n'.format(self.cmd_id['start_streaming'])
         self.sendCmd(cmd)
+        self.streaming = True
+        if background:
+            self.streamReader.start()
 
     def stopStreaming(self):
         """
-        Stop data streaming from the accelerometer
+        Stop data streaming from the accelerometer. Any background reader is
+        stopped, chunks already in its queue can still be retrieved.
         """
         cmd = '[{0}]\n'.format(self.cmd_id['stop_streaming'])
         self.sendCmd(cmd)
+        self.streaming = False
+        if self.streamReader is not None:
+            self.streamReader.stop()
+
+    def getChunk(self,timeout=None):
+        """
+        Returns the next SampleChunk from the background reader, or None if
+        no chunk arrives within timeout seconds.
+        """
+        return self.streamReader.getChunk(timeout)
+
+    def iterChunks(self):
+        """
+        Iterates over the chunks of samples from the background reader until
+        streaming has been stopped and the queue is empty.
+        """
+        return self.streamReader.iterChunks()
+
+    def getStreamStats(self):
+        """
+        Returns the background reader's counters: bytes and samples read, 
+        chunks and queue overruns, sync errors and dropped samples.
+        """
+        return self.streamReader.getStats()
+
+    def updateTimebase(self):
+        """
+        Adds the timestamps received by the decoder to the timebase.
+        """
+        stamps = self.decoder.timestamps
+        while stamps:
+            self.timebase.addTimestamp(*stamps.pop(0))
+
+    def getTimes(self,start,num):
+        """
+        Returns the times in seconds, from the start of streaming, of num
+        samples received since streaming started from sample index start. Gaps
+        are allowed for and, in the packed frame format, the times are
+        corrected for the drift of the firmware clock.
+        """
+        self.updateTimebase()
+        return self.timebase.getTimes(self.decoder.getPeriodIndex(start,num))
+
+    def getTimebaseStats(self):
+        """
+        Returns a dictionary of the timebase fit: the number of timestamps
+        received, the measured sample dt in microseconds and the drift of the
+        host clock relative to the firmware clock in ppm.
+        """
+        self.updateTimebase()
+        return {
+                'timestamps' : self.timebase.getNumTimestamps(),
+                'sample_dt'  : self.timebase.getSampleDt(),
+                'drift_ppm'  : 1.0e6*self.timebase.getDrift(),
+                }
 
     def getSampleDt(self):
         """
@@ -151,32 +624,166 @@ class AccelADXL345(serial.Serial):
         cmd = '[{0}]\n'.format(self.cmd_id['get_bad_sample_count'])
         self.sendCmd(cmd)
         val = self.readInt()
+        self.deviceBadSamples.set(val)
         return val
 
+    def getLossStats(self):
+        """
+        Returns a dictionary of the sample losses seen by the decoder since
+        streaming started: the gaps, number of lost samples, sync errors and
+        skipped bytes. If streaming has stopped the firmware's count of
+        bad/dropped samples is included. While streaming, in the foreground
+        or background, the device is not queried as its replies would be
+        mixed with the stream.
+        """
+        stats = {
+                'gaps'          : list(self.decoder.gaps),
+                'lost_samples'  : self.decoder.lostSamples,
+                'sync_errors'   : self.decoder.syncErrors,
+                'skipped_bytes' : self.decoder.skippedBytes,
+                }
+        if not self.streaming:
+            stats['bad_sample_count'] = self.getBadSampleCount()
+        return stats
+
     def setSampleDt(self,dt):
         """
-        Sets the sample interval in microseconds.
+        Sets the sample interval in microseconds. This is the firmware timer
+        period, which is only used in SAMPLE_TIMER mode.
         """
         _dt = int(dt)
         if _dt > self.maxSampleDt or _dt < self.minSampleDt:
             raise ValueError, 'sample dt out of range'
         cmd = '[{0},{1}]\n'.format(self.cmd_id['set_timer_period'],_dt)
         self.sendCmd(cmd)
-        self.sampleDt = _dt
+        if self.sampleMode == SAMPLE_TIMER:
+            self.sampleDt = _dt
 
     def getSampleRate(self):
         """
         Returns the sample rate in Hz
         """
-        return 1.0/self.sampleDt
-
+        return 1.0e6/self.sampleDt
 
-    def setSampleRate(self,freq):
+    def setSampleRate(self,freq,mode=None):
         """
-        Sets the sample rate in Hz
+        Sets the sample rate in Hz. In SAMPLE_TIMER mode the firmware timer
+        period is set to the nearest microsecond. In SAMPLE_FIFO mode the
+        ADXL345 output data rate is set to the nearest of its native rates,
+        see getAllowedOutputDataRates. The mode is changed first if given.
+        Returns the sample rate set.
         """
+        if mode is not None and mode != self.sampleMode:
+            self.setSampleMode(mode)
+        if self.sampleMode == SAMPLE_FIFO:
+            return self.setOutputDataRate(freq)
         dt = int(1.0e6/freq)
         self.setSampleDt(dt)
+        return self.getSampleRate()
+
+    def setSampleMode(self,mode):
+        """
+        Selects how samples are taken: SAMPLE_TIMER, where the firmware timer
+        reads each sample twice and drops it if the reads differ, or
+        SAMPLE_FIFO, where the ADXL345 samples at its output data rate into
+        its FIFO and the firmware reads the FIFO in bursts. Raises IOError if
+        the firmware does not support the mode.
+        """
+        if mode not in (SAMPLE_TIMER,SAMPLE_FIFO):
+            raise ValueError, 'unknown sample mode {0}'.format(mode)
+        self.sendCmd(self.formatCmd('set_sample_mode',mode))
+        if self.getSampleMode() != mode:
+            raise IOError, 'firmware does not support sample mode {0}'.format(mode)
+        self.sampleMode = mode
+        if mode == SAMPLE_FIFO:
+            self.outputDataRate = self.getOutputDataRate()
+            self.sampleDt = 1.0e6/self.outputDataRate
+        else:
+            self.sampleDt = self.getSampleDt()
+
+    def getSampleMode(self):
+        """
+        Returns the firmware's sample mode, SAMPLE_TIMER or SAMPLE_FIFO.
+        """
+        self.sendCmd(self.formatCmd('get_sample_mode'))
+        try:
+            return self.readInt()
+        except ValueError:
+            raise IOError, 'no reply to get_sample_mode'
+
+    def setOutputDataRate(self,freq):
+        """
+        Sets the ADXL345 output data rate, used in SAMPLE_FIFO mode, to the
+        allowed native rate nearest to freq in Hz. Returns the rate set.
+        """
+        rates = self.getAllowedOutputDataRates()
+        if not rates:
+            raise ValueError, 'no output data rates allowed'
+        rate = min(rates,key=lambda x: abs(x - freq))
+        code = [k for k, v in ODR_RATES.iteritems() if v == rate][0]
+        self.sendCmd(self.formatCmd('set_odr',code))
+        if self.getOutputDataRate() != rate:
+            raise IOError, 'device did not accept output data rate {0}'.format(rate)
+        self.outputDataRate = rate
+        if self.sampleMode == SAMPLE_FIFO:
+            self.sampleDt = 1.0e6/rate
+        return rate
+
+    def getOutputDataRate(self):
+        """
+        Returns the ADXL345 output data rate in Hz.
+        """
+        self.sendCmd(self.formatCmd('get_odr'))
+        try:
+            code = self.readInt()
+        except ValueError:
+            raise IOError, 'no reply to get_odr'
+        return ODR_RATES[code]
+
+    def getAllowedOutputDataRates(self):
+        """
+        Returns the native ADXL345 output data rates, in Hz, which the serial
+        link can carry at the current baud rate and frame format.
+        """
+        return [ODR_RATES[code] for code in ODR_CODES if int(1.0e6/ODR_RATES[code]) >= self.minSampleDt]
+
+    def setDeviceTrigger(self,level,preTrigger=DEFAULT_TRIGGER_PRE,postTrigger=DEFAULT_TRIGGER_POST):
+        """
+        Sets the firmware's threshold trigger, which reduces the serial load
+        when only events are wanted. While streaming the firmware then only
+        sends the samples from preTrigger samples before one with an absolute
+        value of at least level m/s^2 on any axis to postTrigger samples after
+        it, and discards the rest. The firmware limits preTrigger to half of
+        its sample buffer. A level of None turns the trigger off. The level is
+        set in raw counts so should be set after the range.
+
+        Requires the packed frame format, in which the discarded samples show
+        up as gaps, so sample indices and times stay correct. The decoder
+        counts them as lost samples. Returns the trigger set, as
+        getDeviceTrigger.
+        """
+        if level is not None and self.frameFormat != FRAME_PACKED:
+            raise ValueError, 'the device trigger requires the packed frame format'
+        counts = 0 if level is None else max(1,int(numpy.ceil(level/self.accelScale)))
+        self.sendCmd(self.formatCmd('set_trigger',counts,int(preTrigger),int(postTrigger)))
+        trigger = self.getDeviceTrigger()
+        if trigger[0] is None and counts > 0:
+            raise IOError, 'device did not accept the trigger'
+        return trigger
+
+    def getDeviceTrigger(self):
+        """
+        Returns the firmware's threshold trigger as a tuple of the level in
+        m/s^2, None if the trigger is off, and the pre and post trigger sample
+        counts.
+        """
+        self.sendCmd(self.formatCmd('get_trigger'))
+        try:
+            counts, pre, post = self.readInt()
+        except (ValueError, TypeError):
+            raise IOError, 'no reply to get_trigger'
+        level = counts*self.accelScale if counts > 0 else None
+        return level, pre, post
 
     def getMaxSampleDt(self):
         """
@@ -221,14 +828,65 @@ class AccelADXL345(serial.Serial):
 
     def setRange(self,value):
         """
-        Sets the current accelerometer range.
+        Sets the current accelerometer range. Firmware which reports its
+        resolution replies with the range applied, otherwise it is read back.
         """
         _value = int(value)
-        if _value in self.allowedAccelRange:
-            cmd = '[{0}, {1}]\n'.format(self.cmd_id['set_range'],_value)
-        self.sendCmd(cmd)
-        _value = self.getRange()
-        self.accelRange = _value
+        if not _value in self.allowedAccelRange:
+            raise ValueError, 'unknown acceleration range {0}'.format(_value)
+        self.sendCmd(self.formatCmd('set_range',_value))
+        if self.rangeReply:
+            self.readRangeStatus()
+        else:
+            self.updateRange(self.getRange(),self.fullRes)
+
+    def setResolution(self,fullRes):
+        """
+        Sets full resolution mode, in which the scale is the same at every
+        range, if fullRes is True, or 10 bit values otherwise.
+        """
+        if not self.rangeReply:
+            raise IOError, 'firmware does not support set_resolution'
+        self.sendCmd(self.formatCmd('set_resolution',int(bool(fullRes))))
+        self.readRangeStatus()
+
+    def getResolution(self):
+        """
+        Returns True in full resolution mode and False for 10 bit values.
+        """
+        return self.fullRes
+
+    def readRangeStatus(self):
+        """
+        Reads the range and full resolution flag sent in reply to set_range
+        and set_resolution.
+        """
+        value = self.readInt()
+        if not isinstance(value,list) or len(value) != 2:
+            raise IOError, 'bad range status reply'
+        self.updateRange(value[0],value[1])
+
+    def updateRange(self,accelRange,fullRes):
+        """
+        Sets the host side range, resolution and scale, looked up in
+        ACCEL_SCALE_TABLE, and reloads the calibration if they have changed.
+        """
+        accelRange, fullRes = int(accelRange), bool(fullRes)
+        if (accelRange,fullRes) == (self.accelRange,self.fullRes):
+            return
+        self.accelRange = accelRange
+        self.fullRes = fullRes
+        self.accelScale = ACCEL_SCALE_TABLE[(accelRange,fullRes)]
+        self.loadCalibration()
+
+    def checkStreamRange(self):
+        """
+        Updates the range and resolution from those the firmware sends in the
+        packed format's timestamp packets, so chunks are scaled correctly
+        even if the device was reconfigured behind the host's back.
+        """
+        if self.decoder.accelRange is not None:
+            self.updateRange(self.decoder.accelRange,self.decoder.fullRes)
 
     def getAllowedAccelRange(self):
         """
@@ -240,42 +898,149 @@ class AccelADXL345(serial.Serial):
         """
         Grabs a sinlge sample (ax,ay,az) from the accelerometer.
         """
-        cmd = '[{0}]\n'.format(self.cmd_id['get_sample'])
-        self.sendCmd(cmd)
-        samples = self.readFloat()
-        samples = [x*self.accelScale for x in samples]
-        return samples
-        
-    def getSamples(self,N,verbose=False): 
+        if self.calibration is not None:
+            return self.calibration.apply(numpy.array(self.peekSample())).tolist()
+        return [x*self.accelScale for x in self.peekSample()]
+
+    def peekSample(self,out=None):
+        """
+        Grabs a single raw sample from the accelerometer with the binary peek
+        command, which is read with a single fixed size read rather than
+        parsed from a line. Returns the (x,y,z) tuple of ints or, if out is
+        given, fills the int16 array out, e.g. numpy.zeros((3,),dtype=numpy.int16)
+        reused between calls, and returns it. Raises IOError if the reply is
+        incomplete or corrupt. Firmware without the peek command is sent
+        get_sample instead. Not named peek, which io.IOBase.readline would
+        call.
+        """
+        if not self.hasPeek:
+            self.sendCmd(self.formatCmd('get_sample'))
+            value = self.readInt()
+            if not isinstance(value,list) or len(value) != 3:
+                raise IOError, 'bad get_sample reply'
+            if out is None:
+                return tuple(value)
+            out[:] = value
+            return out
+        self.sendCmd(self.peekCmd)
+        byteVals = self.read(PEEK_SIZE)
+        if len(byteVals) < PEEK_SIZE:
+            raise IOError, 'no reply to peek'
+        self.commandRtt.observe(time.time() - self.cmdTime)
+        reply = numpy.frombuffer(byteVals,dtype=PEEK_DTYPE)[0]
+        chk = sum(bytearray(byteVals[2:-1])) & 0xff
+        if reply['sync'] != PACKET_SYNC or reply['chk'] != chk:
+            raise IOError, 'corrupt peek reply'
+        if out is None:
+            x, y, z = reply['data']
+            return int(x), int(y), int(z)
+        out[:] = reply['data']
+        return out
+
+    def getSamples(self,N,verbose=False,raw=False,capture=None): 
         """
         Streams N samples from the accelerometer at the current sample rate 
-        setting.
+        setting and returns the array of sample times and the (N,3) array of
+        samples, raw int16 values if raw is True and accelerations otherwise.
+        See getSampleChunk.
+        """
+        chunk = self.getSampleChunk(N,verbose=verbose,capture=capture)
+        if raw:
+            return chunk.times, chunk.raw
+        return chunk.times, chunk.getAccel()
+
+    def getSampleChunk(self,N,verbose=False,capture=None):
+        """
+        Streams N samples from the accelerometer at the current sample rate 
+        setting and returns them as a SampleChunk. The samples are decoded
+        straight into a preallocated (N,3) int16 array. Samples lost from the
+        stream are skipped in the times and listed in self.gaps. In the packed
+        frame format the times are corrected using the firmware timestamps. If
+        a CaptureWriter, capture, is given the raw samples are also written to
+        it as they arrive.
         """
         # Start streaming 
         self.emptyBuffer()
         self.startStreaming()
 
         # Read samples
-        data = []
-        while len(data) < N:
+        data = numpy.empty((N,3),dtype=numpy.int16)
+        count = 0
+        while count < N:
             if verbose:
-                print len(data)
-            newData = self.readValues()
-            data.extend(newData)
+                print count
+            num = self.readInto(data[count:])
+            if capture is not None and num > 0:
+                capture.write(data[count:count+num],self.decoder.getPeriodIndex(count,num))
+            count += num
+        self.gaps = [(i,n) for i,n in self.decoder.gaps if i < N]
+        t = self.getTimes(0,N)
 
         #  Stop streaming and empty buffer
         self.stopStreaming()
         self.emptyBuffer()
+        return self.createChunk(data,0,t)
+
+    def createChunk(self,data,start=0,times=None):
+        """
+        Returns a SampleChunk for the (N,3) int16 array of samples, data, with
+        the device's current range, scale and calibration.
+        """
+        self.checkStreamRange()
+        return SampleChunk(data,self.accelScale,start=start,times=times,accelRange=self.accelRange,
+                calibration=self.calibration)
 
-        # Convert to an array, truncate to number of samples requested 
-        data = numpy.array(data) 
-        data = self.accelScale*data[:N,:]
-        
-        # Use sample rate to get array of time points
-        dtSec = self.sampleDt*1.0e-6
-        t = dtSec*numpy.arange(data.shape[0])
+    def createCapture(self,filename):
+        """
+        Returns a CaptureWriter for a new capture file, filename, with a header
+        holding the current range, resolution, scale and sample dt of the
+        device and its cache key as the device id, so the capture's calibration
+        can be found in the CalibrationStore.
+        """
+        return CaptureWriter(
+                filename,
+                self.accelRange,
+                self.accelScale,
+                self.sampleDt,
+                deviceId=str(self.cacheKey),
+                fullRes=self.fullRes,
+                )
 
-        return t, data
+    def createRotatingCapture(self,filename,maxBytes=ROTATE_MAX_BYTES,maxDuration=ROTATE_MAX_DURATION):
+        """
+        Returns a RotatingCaptureWriter for a series of capture files named
+        after filename, each holding at most maxBytes of samples or maxDuration
+        seconds of data.
+        """
+        return RotatingCaptureWriter(
+                filename,
+                self.accelRange,
+                self.accelScale,
+                self.sampleDt,
+                deviceId=str(self.cacheKey),
+                fullRes=self.fullRes,
+                maxBytes=maxBytes,
+                maxDuration=maxDuration,
+                )
+
+    def streamToRing(self,ring,duration,verbose=False):
+        """
+        Streams samples from the accelerometer into the SampleRingBuffer, ring,
+        for duration seconds. Only the last ring.capacity samples are kept so
+        memory use does not depend on the duration. Returns the total number
+        of samples acquired.
+        """
+        self.emptyBuffer()
+        self.startStreaming()
+        count = 0
+        t0 = time.time()
+        while time.time() - t0 < duration:
+            count += self.readIntoRing(ring)
+            if verbose:
+                print count
+        self.stopStreaming()
+        self.emptyBuffer()
+        return count
 
     #def readValues(self,verbose=False):
     #    data = []
@@ -295,17 +1060,45 @@ class AccelADXL345(serial.Serial):
     #    return data
 
     def readValues(self):
-        data = []
-        while self.inWaiting() >= 7:
-            byteVals = self.read(7)
-            ax = struct.unpack('<h',byteVals[0:2])[0]
-            ay = struct.unpack('<h',byteVals[2:4])[0]
-            az = struct.unpack('<h',byteVals[4:6])[0]
-            chk = ord(byteVals[6]) 
-            if not chk == 0:
-                raise IOError, 'streaming data is not in sync.'
-            data.append([ax,ay,az])
-        return data
+        """
+        Reads all streaming data currently waiting in the input buffer and
+        returns it as a SampleChunk of raw int16 samples with their times.
+        Partial frames are held by the decoder until the rest of the frame
+        arrives.
+        """
+        t0 = time.time()
+        numBytes = self.inWaiting()
+        if numBytes > 0:
+            byteVals = self.read(numBytes)
+        else:
+            byteVals = ''
+        data = self.decoder.decode(byteVals)
+        start = self.decoder.sampleIndex - data.shape[0]
+        chunk = self.createChunk(data,start,self.getTimes(start,data.shape[0]))
+        self.readLatency.observe(time.time() - t0)
+        return chunk
+
+    def readInto(self,out):
+        """
+        Reads the streaming data waiting in the input buffer directly into the
+        (M,3) int16 array out. Returns the number of samples read, at most M.
+        """
+        t0 = time.time()
+        num = self.decoder.readInto(self,out)
+        self.updateTimebase()
+        self.readLatency.observe(time.time() - t0)
+        return num
+
+    def readIntoRing(self,ring):
+        """
+        Reads the streaming data waiting in the input buffer into the
+        SampleRingBuffer, ring. Returns the number of samples read.
+        """
+        t0 = time.time()
+        num = self.decoder.readIntoRing(self,ring)
+        self.updateTimebase()
+        self.readLatency.observe(time.time() - t0)
+        return num
 
 
 
@@ -0,0 +1,525 @@
+"""
+async_accel_adxl345.py
+
+This module defines the AsyncAccelADXL345 class, a non-blocking client for the
+ADXL345 accelerometer firmware, and the DeviceLoop class which services any
+number of these clients from a single thread using select.
+
+Commands return Reply objects which are completed by the loop when the
+device's response arrives, so many devices can be configured and streamed at
+the same time without a thread per port. The loop relies on select working
+with serial port file descriptors and so requires a posix system.
+
+Example:
+
+    loop = DeviceLoop()
+    devs = [AsyncAccelADXL345(port=p,loop=loop) for p in ports]
+    loop.runUntilComplete([dev.connect() for dev in devs])
+    for dev in devs:
+        dev.startStreaming()
+    for dev, chunk in loop.stream(duration=10.0):
+        ...
+"""
+import time
+import heapq
+import select
+import collections
+import serial
+from frame_decoder import FrameDecoder
+from timebase import Timebase
+from sample_chunk import SampleChunk
+from accel_adxl345 import CMD_ID
+from accel_adxl345 import ALLOWED_ACCEL_RANGE
+from accel_adxl345 import ACCEL_SCALE
+from accel_adxl345 import ACCEL_SCALE_TABLE
+from accel_adxl345 import BUF_EMPTY_NUM
+from accel_adxl345 import BUF_EMPTY_DT
+from accel_adxl345 import CONFIG_KEYS
+from accel_adxl345 import parseValue
+from accel_adxl345 import parseConfig
+
+RESET_DELAY = 2.0
+REPLY_TIMEOUT = 0.1
+RESYNC_DT = REPLY_TIMEOUT
+STOP_FLUSH_DT = BUF_EMPTY_NUM*BUF_EMPTY_DT
+POLL_TIMEOUT = 0.05
+
+
+class Reply(object):
+    """
+    The eventual result of a command sent to a device.
+    """
+
+    def __init__(self):
+        self.isDone = False
+        self.value = None
+        self.error = None
+        self.callbacks = []
+
+    def done(self):
+        """
+        Returns True if the reply has a result or an error.
+        """
+        return self.isDone
+
+    def result(self):
+        """
+        Returns the value of the reply, raising its error if it failed.
+        """
+        if not self.isDone:
+            raise IOError, 'reply not ready'
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def addCallback(self,func):
+        """
+        Adds a function, func(reply), to call when the reply completes.
+        """
+        if self.isDone:
+            func(self)
+        else:
+            self.callbacks.append(func)
+
+    def setResult(self,value):
+        if self.isDone:
+            return
+        self.value = value
+        self.finish()
+
+    def setError(self,error):
+        if self.isDone:
+            return
+        self.error = error
+        self.finish()
+
+    def finish(self):
+        self.isDone = True
+        callbacks, self.callbacks = self.callbacks, []
+        for func in callbacks:
+            func(self)
+
+
+def chainReply(reply,func):
+    """
+    Returns a new Reply whose value is func(value) once reply completes.
+    """
+    newReply = Reply()
+    def callback(r):
+        try:
+            newReply.setResult(func(r.result()))
+        except Exception, e:
+            newReply.setError(e)
+    reply.addCallback(callback)
+    return newReply
+
+
+def gatherReplies(replies):
+    """
+    Returns a Reply whose value is the list of values of replies.
+    """
+    replies = list(replies)
+    newReply = Reply()
+    def callback(r):
+        if r.error is not None:
+            newReply.setError(r.error)
+        elif all(x.done() for x in replies):
+            newReply.setResult([x.result() for x in replies])
+    if not replies:
+        newReply.setResult([])
+    for r in replies:
+        r.addCallback(callback)
+    return newReply
+
+
+class DeviceLoop(object):
+    """
+    Services the serial ports of a set of AsyncAccelADXL345 devices and runs
+    timed callbacks from a single thread.
+    """
+
+    def __init__(self):
+        self.devices = []
+        self.timers = []
+        self.timerCount = 0
+
+    def add(self,dev):
+        if dev not in self.devices:
+            self.devices.append(dev)
+
+    def remove(self,dev):
+        if dev in self.devices:
+            self.devices.remove(dev)
+
+    def callLater(self,delay,func):
+        """
+        Calls func() after delay seconds.
+        """
+        self.timerCount += 1
+        heapq.heappush(self.timers,(time.time() + delay, self.timerCount, func))
+
+    def runOnce(self,timeout=POLL_TIMEOUT):
+        """
+        Waits up to timeout seconds for data from any device, reads it and
+        runs any timers which have expired.
+        """
+        if self.timers:
+            timeout = max(0.0, min(timeout, self.timers[0][0] - time.time()))
+        openDevs = [dev for dev in self.devices if dev.isOpen()]
+        if openDevs:
+            readable, _, _ = select.select(openDevs,[],[],timeout)
+            for dev in readable:
+                dev.handleRead()
+        else:
+            time.sleep(timeout)
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, func = heapq.heappop(self.timers)
+            func()
+
+    def runUntilComplete(self,replies,timeout=None):
+        """
+        Runs the loop until all of the replies have completed and returns
+        their values. A single reply may be given instead of a list.
+        """
+        single = isinstance(replies,Reply)
+        if single:
+            replies = [replies]
+        t0 = time.time()
+        while not all(r.done() for r in replies):
+            if timeout is not None and time.time() - t0 > timeout:
+                raise IOError, 'timeout waiting for replies'
+            self.runOnce()
+        values = [r.result() for r in replies]
+        if single:
+            return values[0]
+        return values
+
+    def stream(self,devices=None,duration=None):
+        """
+        Generator yielding (device, chunk) pairs, where chunk is a SampleChunk
+        of raw int16 samples, as data arrives from the streaming devices. Runs
+        for duration seconds, or until the consumer stops iterating if
+        duration is None.
+        """
+        if devices is None:
+            devices = self.devices
+        t0 = time.time()
+        while duration is None or time.time() - t0 < duration:
+            self.runOnce()
+            for dev in devices:
+                while dev.chunks:
+                    yield dev, dev.chunks.popleft()
+
+
+class AsyncAccelADXL345(serial.Serial):
+
+    def __init__(self, loop=None, **kwarg):
+
+        self.cmd_id = CMD_ID
+        self.allowedAccelRange = ALLOWED_ACCEL_RANGE
+        self.accelScale = ACCEL_SCALE
+        self.fullRes = True
+        self.rangeReply = False
+
+        try:
+            self.resetDelay = kwarg.pop('reset_delay')
+        except KeyError:
+            self.resetDelay = RESET_DELAY
+
+        if loop is None:
+            loop = DeviceLoop()
+        self.loop = loop
+
+        self.decoder = FrameDecoder()
+        self.pending = collections.deque()
+        self.deferred = []
+        self.resyncing = False
+        self.lineBuf = ''
+        self.streaming = False
+        self.stopping = False
+        self.chunks = collections.deque()
+        self.timebase = Timebase(0)
+        self.sampleDt = None
+        self.accelRange = None
+        self.minSampleDt = None
+        self.maxSampleDt = None
+
+        _kwarg = {
+                'port'     : '/dev/ttyUSB0',
+                'timeout'  : 0,
+                'baudrate' : 38400,
+                }
+        _kwarg.update(kwarg)
+        super(AsyncAccelADXL345,self).__init__(**_kwarg)
+        self.loop.add(self)
+
+    def close(self):
+        self.loop.remove(self)
+        super(AsyncAccelADXL345,self).close()
+
+    def connect(self):
+        """
+        Waits for the device to come out of reset, empties the input buffer
+        and reads the device settings, with the combined get_config command if
+        the firmware answers it. Returns a Reply whose value is the device.
+        """
+        ready = Reply()
+        def afterReset():
+            self.flushInput()
+            ready.setResult(None)
+        self.loop.callLater(self.resetDelay,afterReset)
+
+        done = Reply()
+        def getConfig(r):
+            self.sendQuery('get_config',int).addCallback(setConfig)
+        def setConfig(r):
+            config = parseConfig(r.value) if r.error is None else None
+            if config is None:
+                getSettings()
+                return
+            self.setConfig(config)
+            done.setResult(self)
+        def getSettings():
+            settings = gatherReplies([
+                self.getSampleDt(),
+                self.getRange(),
+                self.getMinSampleDt(),
+                self.getMaxSampleDt(),
+                ])
+            settings.addCallback(setSettings)
+        def setSettings(r):
+            try:
+                values = r.result()
+            except Exception, e:
+                done.setError(e)
+                return
+            self.setConfig(dict(zip(CONFIG_KEYS,values)))
+            done.setResult(self)
+        ready.addCallback(getConfig)
+        return done
+
+    def setConfig(self,config):
+        """
+        Sets the host side copy of the device configuration, as
+        AccelADXL345.setConfig. Firmware which reports full_res replies to
+        set_range with the range and resolution applied.
+        """
+        self.sampleDt = float(config['sample_dt'])
+        self.minSampleDt = int(config['min_sample_dt'])
+        self.maxSampleDt = int(config['max_sample_dt'])
+        self.rangeReply = 'full_res' in config
+        self.setRangeStatus([config['range'],config.get('full_res',True)])
+
+    def handleRead(self):
+        """
+        Reads the data waiting on the port. Called by the loop when the port
+        is readable.
+        """
+        byteVals = self.read(max(1,self.inWaiting()))
+        if not byteVals or self.stopping:
+            return
+        if self.streaming:
+            data = self.decoder.decode(byteVals)
+            if data.shape[0] > 0:
+                start = self.decoder.sampleIndex - data.shape[0]
+                self.chunks.append(self.createChunk(data,start,self.getTimes(start,data.shape[0])))
+            return
+        if self.resyncing:
+            return
+        self.lineBuf += byteVals
+        while '\n' in self.lineBuf:
+            line, self.lineBuf = self.lineBuf.split('\n',1)
+            if self.pending:
+                reply, convert = self.pending.popleft()
+                try:
+                    reply.setResult(parseValue(line.strip(),convert))
+                except ValueError, e:
+                    reply.setError(e)
+
+    def sendCmd(self,name,*args):
+        """
+        Sends the command with the given name and arguments to the device.
+        """
+        cmd = '[{0}]\n'.format(','.join([str(self.cmd_id[name])] + [str(x) for x in args]))
+        self.write(cmd)
+
+    def sendQuery(self,name,convert,*args):
+        """
+        Sends a command which the device answers with a line of text and
+        returns a Reply for the value, converted with convert. While the
+        replies are being resynchronised the command is held back.
+        """
+        if self.streaming or self.stopping:
+            raise IOError, 'cannot query device while streaming'
+        reply = Reply()
+        if self.resyncing:
+            self.deferred.append((reply,convert,name,args))
+        else:
+            self.writeQuery(reply,convert,name,args)
+        return reply
+
+    def writeQuery(self,reply,convert,name,args):
+        self.pending.append((reply,convert))
+        self.sendCmd(name,*args)
+        def checkTimeout():
+            if not reply.done():
+                self.resync(reply,name)
+        self.loop.callLater(self.timeout + REPLY_TIMEOUT, checkTimeout)
+
+    def resync(self,reply,name):
+        """
+        Fails the query which timed out, reply, and the queries sent after it,
+        as a late reply would otherwise complete the wrong query. Input is
+        discarded for RESYNC_DT before any held back queries are sent.
+        """
+        self.resyncing = True
+        pending, self.pending = self.pending, collections.deque()
+        for r, convert in pending:
+            if r is reply:
+                r.setError(IOError('timeout waiting for {0} reply'.format(name)))
+            else:
+                r.setError(IOError('reply lost after {0} timed out'.format(name)))
+        def resynced():
+            self.flushInput()
+            self.lineBuf = ''
+            self.resyncing = False
+            deferred, self.deferred = self.deferred, []
+            for args in deferred:
+                self.writeQuery(*args)
+        self.loop.callLater(RESYNC_DT,resynced)
+
+    def startStreaming(self):
+        """
+        Start data streaming from the accelerometer. Chunks of samples are
+        available from stream or the loop's stream generator.
+        """
+        self.decoder.reset()
+        self.timebase.reset(self.sampleDt)
+        self.chunks.clear()
+        self.streaming = True
+        self.sendCmd('start_streaming')
+
+    def stopStreaming(self):
+        """
+        Stop data streaming from the accelerometer. Returns a Reply which
+        completes once the data sent before the stop has been discarded.
+        """
+        self.sendCmd('stop_streaming')
+        self.streaming = False
+        self.stopping = True
+        reply = Reply()
+        def flushed():
+            self.flushInput()
+            self.decoder.reset()
+            self.lineBuf = ''
+            self.stopping = False
+            reply.setResult(None)
+        self.loop.callLater(STOP_FLUSH_DT,flushed)
+        return reply
+
+    def getTimes(self,start,num):
+        """
+        Returns the times in seconds, from the start of streaming, of num
+        samples received since streaming started from sample index start, as
+        AccelADXL345.getTimes.
+        """
+        stamps = self.decoder.timestamps
+        while stamps:
+            self.timebase.addTimestamp(*stamps.pop(0))
+        return self.timebase.getTimes(self.decoder.getPeriodIndex(start,num))
+
+    def createChunk(self,data,start=0,times=None):
+        """
+        Returns a SampleChunk for the (N,3) int16 array of samples, data, with
+        the device's current range and scale.
+        """
+        return SampleChunk(data,self.accelScale,start=start,times=times,accelRange=self.accelRange)
+
+    def stream(self,duration=None):
+        """
+        Generator yielding SampleChunks of raw int16 samples, with their times,
+        from this device.
+        Other devices on the loop continue to be serviced.
+        """
+        for dev, chunk in self.loop.stream([self],duration):
+            yield chunk
+
+    def getSampleDt(self):
+        """
+        Returns a Reply for the sample interval, dt, in microseconds
+        """
+        return self.sendQuery('get_timer_period',float)
+
+    def setSampleDt(self,dt):
+        """
+        Sets the sample interval in microseconds.
+        """
+        _dt = int(dt)
+        if _dt > self.maxSampleDt or _dt < self.minSampleDt:
+            raise ValueError, 'sample dt out of range'
+        self.sendCmd('set_timer_period',_dt)
+        self.sampleDt = _dt
+
+    def setSampleRate(self,freq):
+        """
+        Sets the sample rate in Hz
+        """
+        self.setSampleDt(int(1.0e6/freq))
+
+    def getMaxSampleDt(self):
+        """
+        Returns a Reply for the maximum allowed sample dt in microseconds.
+        """
+        return self.sendQuery('get_max_timer_period',int)
+
+    def getMinSampleDt(self):
+        """
+        Returns a Reply for the minimum allowed sample dt in microseconds.
+        """
+        return self.sendQuery('get_min_timer_period',int)
+
+    def getBadSampleCount(self):
+        """
+        Returns a Reply for the number of bad/corrupted samples.
+        """
+        return self.sendQuery('get_bad_sample_count',int)
+
+    def getRange(self):
+        """
+        Returns a Reply for the current accelerometer range setting.
+        """
+        return self.sendQuery('get_range',int)
+
+    def setRange(self,value):
+        """
+        Sets the current accelerometer range. Returns a Reply for the range
+        reported by the device afterwards. Firmware which reports its
+        resolution replies with the range and resolution applied, otherwise
+        the range is read back.
+        """
+        _value = int(value)
+        if not _value in self.allowedAccelRange:
+            raise ValueError, 'unknown acceleration range {0}'.format(_value)
+        if self.rangeReply:
+            return chainReply(self.sendQuery('set_range',int,_value),self.setRangeStatus)
+        self.sendCmd('set_range',_value)
+        return chainReply(self.getRange(),lambda value: self.setRangeStatus([value,self.fullRes]))
+
+    def setRangeStatus(self,status):
+        """
+        Sets the range, resolution and scale from the status, a list of the
+        range and full resolution flag. Returns the range.
+        """
+        if not isinstance(status,list) or len(status) != 2:
+            raise IOError, 'bad range status reply'
+        self.accelRange, self.fullRes = int(status[0]), bool(status[1])
+        self.accelScale = ACCEL_SCALE_TABLE[(self.accelRange,self.fullRes)]
+        return self.accelRange
+
+    def peekValue(self):
+        """
+        Returns a Reply for a single sample (ax,ay,az) from the accelerometer.
+        """
+        reply = self.sendQuery('get_sample',float)
+        return chainReply(reply,lambda samples: [x*self.accelScale for x in samples])
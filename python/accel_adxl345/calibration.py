@@ -0,0 +1,273 @@
+"""
+calibration.py
+
+This module defines per device accelerometer calibration: the Calibration
+class, which corrects raw samples for the offset, scale and misalignment of
+each axis, the CalibrationFitter class, which fits a calibration to static
+captures taken with the device in several orientations, and the
+CalibrationStore class, which keeps the calibrations of each device and range
+in a JSON file.
+
+A calibration maps the raw values r to acceleration by
+
+    a = matrix*(r - offset)
+
+where offset is in raw counts and matrix is a 3x3 matrix in m/s^2 per count.
+The scale of each axis is on the diagonal of matrix and the misalignment of
+the axes, i.e. the cross axis sensitivity, in the upper triangle. The axes are
+referred to the x axis and the xy plane of the sensor. Applying it to a chunk
+is a single matrix multiply of the raw samples by the cached transpose of
+matrix and an in place add of the cached bias, -matrix*offset.
+
+The fit uses the mean of each static capture and the fact that at rest the
+sensor measures only gravity. Six orientations, e.g. each axis pointing up and
+down, determine the offset and scale of each axis. Nine or more are needed to
+fit the misalignment as well.
+
+Example:
+
+    fitter = CalibrationFitter()
+    for i in range(12):
+        raw_input('place the device in a new orientation and press enter')
+        fitter.addCapture(dev.getSampleChunk(1000).raw)
+    calibration = fitter.fit(dev.accelScale)
+    dev.setCalibration(calibration)
+"""
+import time
+import numpy
+from config_cache import ConfigCache
+from sample_chunk import STANDARD_GRAVITY
+
+MIN_ORIENTATIONS = 6
+MIN_ORIENTATIONS_MISALIGNMENT = 9
+FIT_MAX_ITER = 100
+FIT_TOLERANCE = 1.0e-12
+DIAGONAL_INDEX = ((0,0), (1,1), (2,2))
+TRIANGULAR_INDEX = ((0,0), (1,1), (2,2), (0,1), (0,2), (1,2))
+
+
+class Calibration(object):
+
+    def __init__(self,matrix,offset,residual=None,numOrientations=None):
+        """
+        A calibration with the 3x3 matrix in m/s^2 per count and the offset in
+        raw counts. The residual, the RMS error in m/s^2 of the fit, and the
+        number of orientations fitted are kept for reference.
+        """
+        self.matrix = numpy.array(matrix,dtype=float).reshape((3,3))
+        self.offset = numpy.array(offset,dtype=float).reshape((3,))
+        self.residual = residual
+        self.numOrientations = numOrientations
+        self.cache = {}
+
+    def __repr__(self):
+        return 'Calibration(scale={0}, offset={1}, residual={2})'.format(
+                self.getScale().tolist(),self.offset.tolist(),self.residual)
+
+    @classmethod
+    def fromScale(cls,scale):
+        """
+        Returns the calibration with the same scale on each axis and no offset
+        or misalignment, as the nominal accelScale.
+        """
+        return cls(scale*numpy.eye(3),numpy.zeros((3,)))
+
+    @classmethod
+    def fromDict(cls,values):
+        return cls(
+                values['matrix'],
+                values['offset'],
+                residual=values.get('residual'),
+                numOrientations=values.get('orientations'),
+                )
+
+    def toDict(self):
+        """
+        Returns the calibration as a dictionary which can be stored as JSON.
+        """
+        return {
+                'matrix'       : self.matrix.tolist(),
+                'offset'       : self.offset.tolist(),
+                'residual'     : self.residual,
+                'orientations' : self.numOrientations,
+                'time'         : time.time(),
+                }
+
+    def getScale(self):
+        """
+        Returns the scale of each axis in m/s^2 per count.
+        """
+        return numpy.sqrt((self.matrix**2).sum(axis=0))
+
+    def getMatrices(self,unit=1.0):
+        """
+        Returns the cached transpose of the matrix and the bias for output in
+        the given unit, e.g. STANDARD_GRAVITY for g.
+        """
+        try:
+            return self.cache[unit]
+        except KeyError:
+            matrixT = numpy.ascontiguousarray(self.matrix.T/unit)
+            bias = -numpy.dot(self.matrix,self.offset)/unit
+            self.cache[unit] = matrixT, bias
+            return matrixT, bias
+
+    def apply(self,raw,unit=1.0,out=None):
+        """
+        Returns the (N,3) float array of the corrected (N,3) array of raw
+        samples, in m/s^2 or divided by unit. If out is given the result is
+        written into it.
+        """
+        matrixT, bias = self.getMatrices(unit)
+        out = numpy.dot(raw,matrixT,out=out)
+        out += bias
+        return out
+
+    def process(self,data):
+        """
+        As apply, so a calibration can be used as a pipeline stage.
+        """
+        return self.apply(data)
+
+    def processTimed(self,data,times):
+        return self.apply(data), times
+
+    def reset(self):
+        pass
+
+    def breakStream(self):
+        pass
+
+
+class CalibrationFitter(object):
+
+    def __init__(self,gravity=STANDARD_GRAVITY,maxStd=None):
+        """
+        Collects static captures and fits a Calibration so that the magnitude
+        of each corrected capture mean is gravity in m/s^2. If maxStd is given
+        a capture whose standard deviation on any axis is more than maxStd raw
+        counts, i.e. the device moved, is rejected.
+        """
+        self.gravity = gravity
+        self.maxStd = maxStd
+        self.means = []
+
+    def __len__(self):
+        return len(self.means)
+
+    def addCapture(self,raw):
+        """
+        Adds the (N,3) array of raw samples captured with the device at rest in
+        one orientation. Returns the mean of the capture.
+        """
+        raw = numpy.asarray(raw,dtype=float)
+        if raw.shape[0] == 0:
+            raise ValueError, 'empty capture'
+        if self.maxStd is not None and (raw.std(axis=0) > self.maxStd).any():
+            raise ValueError, 'device moved during capture'
+        mean = raw.mean(axis=0)
+        self.means.append(mean)
+        return mean
+
+    def clear(self):
+        self.means = []
+
+    def fit(self,scale,misalignment=None):
+        """
+        Returns the Calibration fitted to the captures, starting from the
+        nominal scale in m/s^2 per count. The misalignment is fitted if
+        misalignment is True, or if it is None and there are enough
+        orientations.
+        """
+        num = len(self.means)
+        if misalignment is None:
+            misalignment = num >= MIN_ORIENTATIONS_MISALIGNMENT
+        index = TRIANGULAR_INDEX if misalignment else DIAGONAL_INDEX
+        if num < (MIN_ORIENTATIONS_MISALIGNMENT if misalignment else MIN_ORIENTATIONS):
+            raise ValueError, 'not enough orientations to fit, {0} captured'.format(num)
+        points = numpy.array(self.means)
+        rows = [i for i, j in index]
+        cols = [j for i, j in index]
+
+        # Levenberg-Marquardt on the residuals |matrix*(r - offset)| - gravity
+        params = numpy.zeros((3 + len(index),))
+        params[3:3+3] = scale
+        damping = 1.0e-3
+
+        def residuals(params):
+            matrix = numpy.zeros((3,3))
+            matrix[rows,cols] = params[3:]
+            v = points - params[:3]
+            w = numpy.dot(v,matrix.T)
+            norm = numpy.sqrt((w**2).sum(axis=1))
+            return matrix, v, w, norm, norm - self.gravity
+
+        matrix, v, w, norm, res = residuals(params)
+        cost = (res**2).sum()
+        for i in range(FIT_MAX_ITER):
+            jac = numpy.empty((num,params.shape[0]))
+            jac[:,:3] = -numpy.dot(w,matrix)/norm[:,numpy.newaxis]
+            jac[:,3:] = w[:,rows]*v[:,cols]/norm[:,numpy.newaxis]
+            jtj = numpy.dot(jac.T,jac)
+            jtr = numpy.dot(jac.T,res)
+            while True:
+                step = numpy.linalg.solve(jtj + damping*numpy.diag(numpy.diag(jtj)),-jtr)
+                trial = residuals(params + step)
+                trialCost = (trial[-1]**2).sum()
+                if trialCost <= cost:
+                    damping = max(damping/10.0,1.0e-12)
+                    break
+                damping *= 10.0
+                if damping > 1.0e12:
+                    break
+            if trialCost > cost:
+                break
+            params = params + step
+            matrix, v, w, norm, res = trial
+            improvement = cost - trialCost
+            cost = trialCost
+            if improvement <= FIT_TOLERANCE*max(cost,FIT_TOLERANCE):
+                break
+
+        residual = numpy.sqrt(cost/num)
+        return Calibration(matrix,params[:3],residual=residual,numOrientations=num)
+
+
+class CalibrationStore(object):
+
+    def __init__(self,filename):
+        """
+        Stores calibrations in the JSON file, filename, keyed by device id,
+        e.g. the port name or serial number, and acceleration range. The 10 bit
+        resolution of each range, which has a different scale, is kept apart
+        from full resolution.
+        """
+        self.cache = ConfigCache(filename)
+
+    def getKey(self,accelRange,fullRes):
+        if fullRes:
+            return str(accelRange)
+        return '{0}_10bit'.format(accelRange)
+
+    def get(self,deviceId,accelRange,fullRes=True):
+        """
+        Returns the Calibration for the device, range and resolution, or None
+        if there isn't one.
+        """
+        values = self.cache.get(deviceId) or {}
+        values = values.get(self.getKey(accelRange,fullRes))
+        if values is None:
+            return None
+        return Calibration.fromDict(values)
+
+    def set(self,deviceId,accelRange,calibration,fullRes=True):
+        """
+        Stores the calibration for the device, range and resolution. A
+        calibration of None removes it.
+        """
+        values = self.cache.get(deviceId) or {}
+        if calibration is None:
+            values.pop(self.getKey(accelRange,fullRes),None)
+        else:
+            values[self.getKey(accelRange,fullRes)] = calibration.toDict()
+        self.cache.set(deviceId,values)
@@ -0,0 +1,298 @@
+"""
+capture_file.py
+
+This module defines a compact binary file format for accelerometer captures.
+The CaptureWriter class appends raw samples to the file as they are streamed
+and the CaptureFile class reads a capture back as a memory mapped (N,3) array,
+so large captures are not loaded into memory.
+
+A capture file starts with a fixed size header, HEADER_DTYPE, holding the
+accelerometer range and resolution, the scale factor from raw values to m/s^2,
+the sample interval in microseconds, the host start time and a device id
+string, the key under which the device's calibrations are stored. The header
+is followed by the raw samples as little endian int16 x, y, z triples.
+
+Samples lost from the stream are recorded in a gap table of (sample index,
+number of samples missing before it) pairs, written as little endian int64s
+after the samples when the capture is closed, with the number of samples and
+gaps filled in in the header. The times of the samples are found from the
+gaps as for FrameDecoder.getPeriodIndex. If the capture was interrupted the
+header counts are zero, the number of samples is found from the size of the
+file and the gaps are not known.
+
+Version 1 files, which have neither the resolution nor the gap table, are
+read as full resolution with no gaps.
+
+For long recordings the RotatingCaptureWriter class splits the samples over a
+numbered series of capture files, starting a new file when the current one
+reaches a maximum size or duration.
+"""
+import os
+import time
+import numpy
+
+CAPTURE_MAGIC = 'ADXLCAPT'
+CAPTURE_VERSION = 2
+CAPTURE_VERSIONS = (1,2)
+CAPTURE_EXT = '.adxl'
+HEADER_DTYPE = numpy.dtype([
+    ('magic', 'S8'),
+    ('version', '<u2'),
+    ('range', '<u2'),
+    ('accel_scale', '<f8'),
+    ('sample_dt', '<f8'),
+    ('start_time', '<f8'),
+    ('device_id', 'S32'),
+    ('full_res', '<u2'),
+    ('num_gaps', '<u4'),
+    ('num_samples', '<u8'),
+    ('reserved', 'V46'),
+    ])
+HEADER_SIZE = HEADER_DTYPE.itemsize
+CAPTURE_DTYPE = numpy.dtype('<i2')
+CAPTURE_SAMPLE_SIZE = 3*CAPTURE_DTYPE.itemsize
+GAP_DTYPE = numpy.dtype('<i8')
+ROTATE_MAX_BYTES = 100*2**20
+ROTATE_MAX_DURATION = 3600.0
+
+
+class CaptureWriter(object):
+    """
+    Writes raw samples to a capture file as they are acquired. The gap table
+    and sample count are written when the file is closed.
+    """
+
+    def __init__(self,filename,accelRange,accelScale,sampleDt,deviceId='',startTime=None,fullRes=True):
+        if startTime is None:
+            startTime = time.time()
+        self.filename = filename
+        self.accelRange = accelRange
+        self.accelScale = accelScale
+        self.sampleDt = sampleDt
+        self.deviceId = deviceId
+        self.fullRes = fullRes
+        self.numSamples = 0
+        self.gaps = []
+        self.nextPeriod = None
+        self.header = numpy.zeros((1,),dtype=HEADER_DTYPE)
+        self.header['magic'] = CAPTURE_MAGIC
+        self.header['version'] = CAPTURE_VERSION
+        self.header['range'] = accelRange
+        self.header['accel_scale'] = accelScale
+        self.header['sample_dt'] = sampleDt
+        self.header['start_time'] = startTime
+        self.header['device_id'] = deviceId[:HEADER_DTYPE['device_id'].itemsize]
+        self.header['full_res'] = fullRes
+        self.fileObj = open(filename,'wb')
+        self.fileObj.write(self.header.tostring())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def write(self,samples,periods=None):
+        """
+        Appends the (N,3) array of raw samples to the file. If periods, the
+        (N,) array of the sample period index of each sample, e.g. from
+        FrameDecoder.getPeriodIndex, is given any samples lost before or
+        between them are added to the gap table.
+        """
+        samples = numpy.ascontiguousarray(samples,dtype=CAPTURE_DTYPE)
+        if periods is not None and samples.shape[0] > 0:
+            self.addPeriods(numpy.asarray(periods))
+        self.fileObj.write(samples.tostring())
+        self.numSamples += samples.shape[0]
+
+    def addPeriods(self,periods):
+        if self.nextPeriod is None:
+            self.nextPeriod = periods[0]
+        steps = numpy.diff(numpy.concatenate(([self.nextPeriod-1],periods)))
+        for i in numpy.flatnonzero(steps != 1):
+            self.gaps.append((self.numSamples + i, steps[i] - 1))
+        self.nextPeriod = periods[-1] + 1
+
+    def flush(self):
+        self.fileObj.flush()
+
+    def close(self):
+        if not self.fileObj.closed:
+            gaps = numpy.array(self.gaps,dtype=GAP_DTYPE).reshape((-1,2))
+            self.fileObj.write(gaps.tostring())
+            self.header['num_gaps'] = gaps.shape[0]
+            self.header['num_samples'] = self.numSamples
+            self.fileObj.seek(0)
+            self.fileObj.write(self.header.tostring())
+            self.fileObj.close()
+
+
+class RotatingCaptureWriter(object):
+    """
+    Writes raw samples to a series of capture files, base_0000.adxl,
+    base_0001.adxl, etc. for a filename base.adxl. A new file is started when
+    the current one holds maxBytes of samples or maxDuration seconds of data.
+    The start time in the header of each file is that of its first sample,
+    allowing for gaps if the sample period indices are given.
+    """
+
+    def __init__(self,filename,accelRange,accelScale,sampleDt,deviceId='',fullRes=True,
+            maxBytes=ROTATE_MAX_BYTES,maxDuration=ROTATE_MAX_DURATION):
+        self.base, self.ext = os.path.splitext(filename)
+        if not self.ext:
+            self.ext = CAPTURE_EXT
+        self.accelRange = accelRange
+        self.accelScale = accelScale
+        self.sampleDt = sampleDt
+        self.deviceId = deviceId
+        self.fullRes = fullRes
+        self.fileSamples = max(1,int(min(
+            maxBytes//CAPTURE_SAMPLE_SIZE, 
+            maxDuration/(sampleDt*1.0e-6),
+            )))
+        self.startTime = time.time()
+        self.numSamples = 0
+        self.firstPeriod = None
+        self.filenames = []
+        self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    @property
+    def filename(self):
+        return self.filenames[-1] if self.filenames else None
+
+    def openNext(self,period):
+        """
+        Starts the next file, whose first sample is period sample periods
+        after the first.
+        """
+        if self.writer is not None:
+            self.writer.close()
+        filename = '{0}_{1:04d}{2}'.format(self.base,len(self.filenames),self.ext)
+        self.writer = CaptureWriter(
+                filename,
+                self.accelRange,
+                self.accelScale,
+                self.sampleDt,
+                deviceId=self.deviceId,
+                startTime=self.startTime + period*self.sampleDt*1.0e-6,
+                fullRes=self.fullRes,
+                )
+        self.filenames.append(filename)
+
+    def write(self,samples,periods=None):
+        """
+        Appends the (N,3) array of raw samples, rotating files as required.
+        The sample period indices, periods, are as for CaptureWriter.write.
+        """
+        if periods is not None and self.firstPeriod is None and samples.shape[0] > 0:
+            self.firstPeriod = periods[0]
+        pos = 0
+        while pos < samples.shape[0]:
+            if self.writer is None or self.writer.numSamples >= self.fileSamples:
+                if periods is None:
+                    self.openNext(self.numSamples)
+                else:
+                    self.openNext(periods[pos] - self.firstPeriod)
+            num = min(samples.shape[0] - pos, self.fileSamples - self.writer.numSamples)
+            if periods is None:
+                self.writer.write(samples[pos:pos+num])
+            else:
+                self.writer.write(samples[pos:pos+num],periods[pos:pos+num])
+            self.numSamples += num
+            pos += num
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class CaptureFile(object):
+    """
+    Reads a capture file. The raw samples, data, are a read only memory mapped
+    (N,3) int16 array and gaps is the (M,2) array of the gap table.
+    """
+
+    def __init__(self,filename):
+        self.filename = filename
+        with open(filename,'rb') as f:
+            headerBytes = f.read(HEADER_SIZE)
+        if len(headerBytes) < HEADER_SIZE:
+            raise IOError, 'capture file header too short'
+        header = numpy.frombuffer(headerBytes,dtype=HEADER_DTYPE)[0]
+        if header['magic'] != CAPTURE_MAGIC:
+            raise IOError, 'not a capture file: {0}'.format(filename)
+        if header['version'] not in CAPTURE_VERSIONS:
+            raise IOError, 'unknown capture file version {0}'.format(header['version'])
+        self.version = int(header['version'])
+        self.accelRange = int(header['range'])
+        self.accelScale = float(header['accel_scale'])
+        self.sampleDt = float(header['sample_dt'])
+        self.startTime = float(header['start_time'])
+        self.deviceId = str(header['device_id'])
+        self.fullRes = self.version < 2 or bool(header['full_res'])
+
+        num = (os.path.getsize(filename) - HEADER_SIZE)//CAPTURE_SAMPLE_SIZE
+        self.gaps = numpy.zeros((0,2),dtype=GAP_DTYPE)
+        if self.version >= 2 and header['num_samples'] > 0:
+            num = int(header['num_samples'])
+            numGaps = int(header['num_gaps'])
+            if numGaps > 0:
+                with open(filename,'rb') as f:
+                    f.seek(HEADER_SIZE + num*CAPTURE_SAMPLE_SIZE)
+                    gapBytes = f.read(2*numGaps*GAP_DTYPE.itemsize)
+                self.gaps = numpy.frombuffer(gapBytes,dtype=GAP_DTYPE).reshape((numGaps,2))
+        if num > 0:
+            self.data = numpy.memmap(
+                    filename,
+                    dtype=CAPTURE_DTYPE,
+                    mode='r',
+                    offset=HEADER_SIZE,
+                    shape=(num,3),
+                    )
+        else:
+            self.data = numpy.zeros((0,3),dtype=CAPTURE_DTYPE)
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def getPeriodIndex(self,start=0,stop=None):
+        """
+        Returns the sample period index, counted from the first sample, of each
+        of the samples from start to stop, allowing for the gaps.
+        """
+        start, stop, step = slice(start,stop).indices(len(self))
+        index = numpy.arange(start,stop)
+        if self.gaps.shape[0] == 0:
+            return index
+        totals = numpy.concatenate(([0],numpy.cumsum(self.gaps[:,1])))
+        return index + totals[numpy.searchsorted(self.gaps[:,0],index,side='right')]
+
+    def getTime(self,start=0,stop=None):
+        """
+        Returns the times, in seconds, of the samples from start to stop.
+        """
+        return self.sampleDt*1.0e-6*self.getPeriodIndex(start,stop)
+
+    def getScaled(self,start=0,stop=None):
+        """
+        Returns the samples from start to stop converted to accelerations.
+        """
+        return numpy.multiply(self.data[start:stop],self.accelScale)
+
+    def getCalibrated(self,calibration,start=0,stop=None):
+        """
+        Returns the samples from start to stop corrected by the Calibration,
+        e.g. from CalibrationStore.get(capture.deviceId,capture.accelRange,
+        capture.fullRes).
+        """
+        return calibration.apply(self.data[start:stop])
@@ -0,0 +1,42 @@
+"""
+config_cache.py
+
+This module defines the ConfigCache class which stores the last known
+configuration of each device in a small JSON file, keyed by serial port name
+or device serial number. 
+"""
+import os
+import json
+
+
+class ConfigCache(object):
+
+    def __init__(self,filename):
+        self.filename = os.path.expanduser(filename)
+
+    def load(self):
+        """
+        Returns the dictionary of all cached configurations.
+        """
+        try:
+            with open(self.filename,'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def get(self,key):
+        """
+        Returns the cached configuration for key or None if there isn't one.
+        """
+        return self.load().get(key)
+
+    def set(self,key,config):
+        """
+        Stores the configuration dictionary, config, for key.
+        """
+        cache = self.load()
+        cache[key] = config
+        tmpFilename = self.filename + '.tmp'
+        with open(tmpFilename,'w') as f:
+            json.dump(cache,f,indent=2,sort_keys=True)
+        os.rename(tmpFilename,self.filename)
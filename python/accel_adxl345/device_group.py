@@ -0,0 +1,131 @@
+"""
+device_group.py
+
+This module defines the DeviceGroup class for acquiring data from several
+ADXL345 accelerometers at once. The devices are opened together, so their
+reset delays overlap, and are read from a single thread by a DeviceLoop. The
+samples from every device are returned as SampleChunks whose times, from each
+device's timebase, are shifted onto a shared host clock timebase.
+"""
+import time
+from sample_chunk import concatChunks
+from async_accel_adxl345 import AsyncAccelADXL345
+from async_accel_adxl345 import DeviceLoop
+from async_accel_adxl345 import gatherReplies
+
+
+class DeviceGroup(object):
+
+    def __init__(self,ports,**kwarg):
+        self.loop = DeviceLoop()
+        self.devices = []
+        try:
+            for port in ports:
+                dev = AsyncAccelADXL345(port=port,loop=self.loop,**kwarg)
+                self.devices.append(dev)
+        except:
+            self.close()
+            raise
+        self.startTimes = {}
+        self.t0 = None
+
+    def __len__(self):
+        return len(self.devices)
+
+    def close(self):
+        """
+        Closes all of the devices in the group.
+        """
+        for dev in self.devices:
+            dev.close()
+
+    def run(self,replies,timeout=None):
+        """
+        Runs the loop until the replies complete and returns their values.
+        """
+        return self.loop.runUntilComplete(replies,timeout)
+
+    def connect(self,timeout=None):
+        """
+        Waits for all devices to come out of reset and reads their settings.
+        The reset delays of the devices run concurrently.
+        """
+        self.run([dev.connect() for dev in self.devices],timeout)
+
+    def setRange(self,value):
+        """
+        Sets the accelerometer range of all devices.
+        """
+        return self.run([dev.setRange(value) for dev in self.devices])
+
+    def setSampleRate(self,freq):
+        """
+        Sets the sample rate, in Hz, of all devices.
+        """
+        for dev in self.devices:
+            dev.setSampleRate(freq)
+
+    def startStreaming(self):
+        """
+        Starts streaming on all devices. The commands are written back to back
+        and the host time of each is recorded for aligning the samples.
+        """
+        for dev in self.devices:
+            dev.decoder.reset()
+            dev.chunks.clear()
+            dev.flushInput()
+        for dev in self.devices:
+            dev.startStreaming()
+            self.startTimes[dev] = time.time()
+        self.t0 = min(self.startTimes.values())
+
+    def stopStreaming(self):
+        """
+        Stops streaming on all devices and waits for the data sent after the
+        stop to be discarded.
+        """
+        self.run(gatherReplies([dev.stopStreaming() for dev in self.devices]))
+
+    def getSkew(self):
+        """
+        Returns the spread, in seconds, of the host times at which streaming
+        was started on the devices.
+        """
+        times = self.startTimes.values()
+        return max(times) - min(times)
+
+    def getSamples(self,N,timeout=None):
+        """
+        Streams N samples from every device. Returns a dictionary, keyed by
+        port, of SampleChunks whose times are in seconds relative to the first
+        start command, on the shared host clock.
+        """
+        chunks = dict((dev.port,[]) for dev in self.devices)
+        counts = dict((dev.port,0) for dev in self.devices)
+        self.startStreaming()
+        try:
+            for port, chunk in self.stream(timeout):
+                chunks[port].append(chunk)
+                counts[port] += len(chunk)
+                if min(counts.values()) >= N:
+                    break
+        finally:
+            self.stopStreaming()
+        if min(counts.values()) < N:
+            raise IOError, 'timeout acquiring samples'
+
+        samples = {}
+        for port in chunks:
+            samples[port] = concatChunks(chunks[port])[:N]
+        return samples
+
+    def stream(self,duration=None):
+        """
+        Generator yielding (port, chunk) pairs as data arrives from the
+        devices, where chunk is a SampleChunk of raw samples. The chunk times
+        come from the device's timebase, so allow for gaps, shifted onto the
+        shared timebase. Streaming must have been started with startStreaming.
+        """
+        for dev, chunk in self.loop.stream(self.devices,duration):
+            chunk.times += self.startTimes[dev] - self.t0
+            yield dev.port, chunk
@@ -0,0 +1,463 @@
+"""
+frame_decoder.py
+
+This module defines the FrameDecoder class which converts the raw byte stream
+sent by the firmware while streaming into arrays of accelerometer samples.
+
+The firmware sends data in one of two formats. In the legacy format each
+frame is 7 bytes long: the x, y and z axis values as little endian 16 bit
+integers followed by a sync byte which is always zero. In the packed format,
+decoded by PackedFrameDecoder, each packet holds up to PACKET_SAMPLES samples
+after a two byte sync word, the 16 bit sequence number of the first sample and
+a sample count, and ends with an 8 bit checksum.
+
+Neither decoder raises when the stream is out of sync. Instead the decoder
+scans forward for the next valid frame boundary and records the samples lost
+as gaps, a list of (sample index, number of missing samples) pairs. For the
+packed format the gaps are exact, as they are found from the sequence numbers.
+For the legacy format they are estimated from the number of bytes skipped.
+
+In the packed format the firmware also sends timestamp packets, with the count
+set to PACKET_TIMESTAMP, holding its microsecond clock at a given sample
+period, its count of bad samples and its range and resolution setting. The
+packed decoder collects these in timestamps, a list of (sample period index,
+device micros, host time) tuples, for use by Timebase, and keeps the latest bad
+sample count, range and full resolution flag. Firmware which doesn't report the
+range sends zero in its place.
+"""
+import math
+import time
+import bisect
+import numpy
+
+FRAME_SIZE = 7
+FRAME_DTYPE = numpy.dtype([
+    ('ax',   '<i2'),
+    ('ay',   '<i2'),
+    ('az',   '<i2'),
+    ('sync', 'u1'),
+    ])
+SAMPLE_DTYPE = numpy.int16
+BUFFER_FRAMES = 2048
+RESYNC_FRAMES = 8
+
+FRAME_LEGACY = 0
+FRAME_PACKED = 1
+
+PACKET_SYNC = 0x5AA5
+PACKET_SAMPLES = 8
+PACKET_DTYPE = numpy.dtype([
+    ('sync',  '<u2'),
+    ('seq',   '<u2'),
+    ('count', 'u1'),
+    ('data',  '<i2', (PACKET_SAMPLES,3)),
+    ('chk',   'u1'),
+    ])
+PACKET_SIZE = PACKET_DTYPE.itemsize
+PACKET_SEQ_MOD = 2**16
+PACKET_TIMESTAMP = 0xFF
+TIMESTAMP_INTERVAL = 256
+BUFFER_PACKETS = 256
+
+
+class FrameDecoder(object):
+
+    frameSize = FRAME_SIZE
+
+    def __init__(self,bufferFrames=BUFFER_FRAMES):
+        self.buf = bytearray(bufferFrames*self.frameSize)
+        self.bufView = memoryview(self.buf)
+        self.reset()
+
+    def reset(self):
+        """
+        Discards any partial frame or undelivered samples left over from
+        previous calls and clears the gap and sync error counts.
+        """
+        self.partial = 0
+        self.pending = numpy.zeros((0,3),dtype=SAMPLE_DTYPE)
+        self.syncLost = False
+        self.lostSkipped = 0
+        self.sampleIndex = 0
+        self.gaps = []
+        self.gapStarts = []
+        self.gapTotals = []
+        self.lostSamples = 0
+        self.syncErrors = 0
+        self.skippedBytes = 0
+        self.firstPeriod = 0
+        self.timestamps = []
+        self.bytesDecoded = 0
+        self.framesDecoded = 0
+        self.badSampleCount = None
+        self.accelRange = None
+        self.fullRes = None
+
+    def maxSamples(self,numBytes):
+        """
+        Returns the largest number of samples which numBytes bytes can hold.
+        """
+        return numBytes//self.frameSize
+
+    def maxBytes(self,numSamples):
+        """
+        Returns the number of bytes to read to get up to numSamples samples.
+        """
+        return numSamples*self.frameSize
+
+    def decode(self,byteVals):
+        """
+        Decodes the string of bytes, byteVals, into an (N,3) array of int16
+        samples. Any partial frame at the end of the data is kept and
+        prepended to the bytes passed to the next call.
+        """
+        self.bytesDecoded += len(byteVals)
+        if self.partial:
+            byteVals = str(self.buf[:self.partial]) + byteVals
+        byteArray = numpy.frombuffer(byteVals,dtype='u1')
+        pending = self.pending
+        self.pending = pending[:0]
+        out = numpy.empty((self.maxSamples(len(byteVals)),3),dtype=SAMPLE_DTYPE)
+        num, consumed = self.decodeBytes(byteArray,out)
+        remainder = byteVals[consumed:]
+        self.buf[:len(remainder)] = remainder
+        self.partial = len(remainder)
+        if pending.shape[0] > 0:
+            return numpy.concatenate((pending,out[:num]))
+        return out[:num]
+
+    def readInto(self,port,out):
+        """
+        Reads the bytes waiting on the serial port, port, into the decoder's
+        preallocated buffer with readinto and decodes the complete frames
+        directly into the (M,3) int16 array out. Samples which do not fit are
+        kept for the next call. Returns the number of samples written.
+        """
+        outSamples = out.shape[0]
+        count = min(self.pending.shape[0], outSamples)
+        out[:count] = self.pending[:count]
+        self.pending = self.pending[count:]
+        while count < outSamples:
+            space = min(len(self.buf), self.partial + self.maxBytes(outSamples - count))
+            numRequest = min(port.inWaiting(), space - self.partial)
+            if numRequest <= 0:
+                break
+            numRead = port.readinto(self.bufView[self.partial:self.partial+numRequest])
+            self.bytesDecoded += numRead
+            total = self.partial + numRead
+            byteArray = numpy.frombuffer(self.buf,dtype='u1',count=total)
+            num, consumed = self.decodeBytes(byteArray,out[count:])
+            count += num
+            self.buf[:total-consumed] = self.buf[consumed:total]
+            self.partial = total - consumed
+            if numRead < numRequest:
+                break
+        return count
+
+    def readIntoRing(self,port,ring):
+        """
+        Reads the bytes waiting on the serial port, port, and decodes them
+        into the ring buffer, ring, wrapping around as required. Returns the
+        number of samples written.
+        """
+        count = 0
+        while True:
+            view = ring.getWriteView()
+            num = self.readInto(port,view)
+            ring.advance(num)
+            count += num
+            if num < view.shape[0]:
+                break
+        return count
+
+    def writeSamples(self,samples,out,count):
+        """
+        Writes the (N,3) array samples into out starting at count. Samples
+        which do not fit are added to the pending samples. Returns the new
+        count.
+        """
+        num = min(samples.shape[0], out.shape[0] - count)
+        out[count:count+num] = samples[:num]
+        if num < samples.shape[0]:
+            self.pending = numpy.concatenate((self.pending,samples[num:]))
+        self.sampleIndex += samples.shape[0]
+        return count + num
+
+    def getPeriodIndex(self,start,num):
+        """
+        Returns the sample period index, counted from the start of streaming,
+        of each of the num received samples from sample index start.
+        """
+        pos = bisect.bisect_right(self.gapStarts,start)
+        offset = self.gapTotals[pos-1] if pos > 0 else 0
+        index = numpy.arange(start,start+num) + self.firstPeriod + offset
+        for i, n in self.gaps[pos:]:
+            if i >= start + num:
+                break
+            index[i-start:] += n
+        return index
+
+    def addGap(self,index,num):
+        """
+        Records num missing samples before the sample with the given index.
+        """
+        if num > 0:
+            self.gaps.append((index,num))
+            self.lostSamples += num
+            self.gapStarts.append(index)
+            self.gapTotals.append(self.lostSamples)
+
+    def decodeBytes(self,byteArray,out):
+        """
+        Decodes the uint8 array byteArray into out, resynchronising on the next
+        frame boundary if a frame's sync byte isn't zero. Returns the number
+        of samples written to out and the number of bytes consumed.
+        """
+        num = byteArray.shape[0]
+        pos = 0
+        count = 0
+        while True:
+            if self.syncLost:
+                newPos, found = self.findSync(byteArray,pos)
+                self.skippedBytes += newPos - pos
+                self.lostSkipped += newPos - pos
+                pos = newPos
+                if not found:
+                    break
+                self.syncLost = False
+                lost = int(math.ceil(self.lostSkipped/float(FRAME_SIZE)))
+                self.addGap(self.sampleIndex,lost)
+
+            numFrames = (num - pos)//FRAME_SIZE
+            if numFrames == 0:
+                break
+            sync = byteArray[pos+FRAME_SIZE-1:pos+FRAME_SIZE*numFrames:FRAME_SIZE]
+            bad = numpy.flatnonzero(sync)
+            numGood = bad[0] if bad.size else numFrames
+            if numGood > 0:
+                frames = byteArray[pos:pos+FRAME_SIZE*numGood].view(FRAME_DTYPE)
+                numOut = min(numGood, out.shape[0] - count)
+                framesToSamples(frames[:numOut],out[count:count+numOut])
+                if numOut < numGood:
+                    self.pending = numpy.concatenate((self.pending,framesToSamples(frames[numOut:])))
+                self.sampleIndex += numGood
+                self.framesDecoded += numGood
+                count += numOut
+                pos += FRAME_SIZE*numGood
+            if not bad.size:
+                break
+            self.syncErrors += 1
+            self.syncLost = True
+            self.lostSkipped = 0
+        return count, pos
+
+    def findSync(self,byteArray,start):
+        """
+        Searches byteArray from start for a frame followed by RESYNC_FRAMES-1
+        more frames, all with zero sync bytes. Returns the position and True
+        if found, otherwise the position to resume the search from when more
+        data arrives and False.
+        """
+        num = byteArray.shape[0]
+        zeros = numpy.flatnonzero(byteArray[start+FRAME_SIZE-1:] == 0) + start
+        for pos in zeros:
+            if num - pos < FRAME_SIZE*RESYNC_FRAMES:
+                return pos, False
+            if not byteArray[pos+FRAME_SIZE-1:pos+FRAME_SIZE*RESYNC_FRAMES:FRAME_SIZE].any():
+                return pos, True
+        return max(start, num - (FRAME_SIZE - 1)), False
+
+
+class PackedFrameDecoder(FrameDecoder):
+
+    frameSize = PACKET_SIZE
+
+    def __init__(self,bufferPackets=BUFFER_PACKETS):
+        super(PackedFrameDecoder,self).__init__(bufferPackets)
+
+    def reset(self):
+        super(PackedFrameDecoder,self).reset()
+        self.nextSeq = None
+        self.lastPeriod = None
+
+    def maxSamples(self,numBytes):
+        return PACKET_SAMPLES*(numBytes//PACKET_SIZE)
+
+    def maxBytes(self,numSamples):
+        return PACKET_SIZE*(numSamples//PACKET_SAMPLES + 1)
+
+    def decodeBytes(self,byteArray,out):
+        """
+        Decodes the uint8 array byteArray into out, resynchronising on the next
+        sync word starting a valid packet if a packet is corrupted. Gaps in the
+        sequence numbers are recorded. Returns the number of samples written
+        to out and the number of bytes consumed. Timestamp packets are added to
+        timestamps.
+        """
+        num = byteArray.shape[0]
+        pos = 0
+        count = 0
+        while True:
+            if self.syncLost:
+                newPos, found = self.findSync(byteArray,pos)
+                self.skippedBytes += newPos - pos
+                pos = newPos
+                if not found:
+                    break
+                self.syncLost = False
+
+            numPackets = (num - pos)//PACKET_SIZE
+            if numPackets == 0:
+                break
+            packetBytes = byteArray[pos:pos+PACKET_SIZE*numPackets].reshape((numPackets,PACKET_SIZE))
+            bad = numpy.flatnonzero(~checkPackets(packetBytes))
+            numGood = bad[0] if bad.size else numPackets
+            if numGood > 0:
+                packets = packetBytes[:numGood].view(PACKET_DTYPE)[:,0]
+                self.framesDecoded += numGood
+                isStamp = packets['count'] == PACKET_TIMESTAMP
+                if isStamp.any():
+                    self.findTimestamps(packetBytes[:numGood][isStamp])
+                    packets = packets[~isStamp]
+                if packets.shape[0] > 0:
+                    self.findGaps(packets)
+                    mask = numpy.arange(PACKET_SAMPLES) < packets['count'][:,numpy.newaxis]
+                    count = self.writeSamples(packets['data'][mask],out,count)
+                pos += PACKET_SIZE*numGood
+            if not bad.size:
+                break
+            self.syncErrors += 1
+            self.syncLost = True
+        return count, pos
+
+    def findGaps(self,packets):
+        """
+        Records gaps in the sequence numbers of the structured array of
+        packets.
+        """
+        seq = packets['seq'].astype(numpy.int64)
+        counts = packets['count'].astype(numpy.int64)
+        if self.nextSeq is None:
+            if self.lastPeriod is None:
+                self.lastPeriod = int(seq[0])
+            self.firstPeriod = self.unwrapSeq(int(seq[0]))
+            self.lastPeriod = self.firstPeriod
+        expected = numpy.empty_like(seq)
+        expected[0] = seq[0] if self.nextSeq is None else self.nextSeq
+        expected[1:] = seq[:-1] + counts[:-1]
+        missing = (seq - expected) % PACKET_SEQ_MOD
+        if missing.any():
+            index = self.sampleIndex + numpy.cumsum(counts) - counts
+            for i in numpy.flatnonzero(missing):
+                self.addGap(int(index[i]),int(missing[i]))
+        self.nextSeq = int(seq[-1] + counts[-1]) % PACKET_SEQ_MOD
+        self.lastPeriod = self.unwrapSeq(self.nextSeq)
+
+    def findTimestamps(self,stampBytes):
+        """
+        Adds the timestamps in the (M,PACKET_SIZE) uint8 array of timestamp
+        packets, stampBytes, to timestamps.
+        """
+        hostTime = time.time()
+        seq = stampBytes[:,2:4].copy().view('<u2')[:,0]
+        micros = stampBytes[:,5:9].copy().view('<u4')[:,0]
+        self.badSampleCount = int(stampBytes[-1,9]) + (int(stampBytes[-1,10]) << 8)
+        if stampBytes[-1,11] > 0:
+            self.accelRange = int(stampBytes[-1,11])
+            self.fullRes = bool(stampBytes[-1,12])
+        for s, t in zip(seq,micros):
+            if self.lastPeriod is None:
+                self.lastPeriod = int(s)
+                self.firstPeriod = int(s)
+            self.timestamps.append((self.unwrapSeq(int(s)),int(t),hostTime))
+
+    def unwrapSeq(self,seq):
+        """
+        Returns the sample period index, counted from the start of streaming,
+        for the 16 bit sequence number, seq, taking the nearest to the last
+        period decoded.
+        """
+        diff = (seq - self.lastPeriod) % PACKET_SEQ_MOD
+        if diff >= PACKET_SEQ_MOD//2:
+            diff -= PACKET_SEQ_MOD
+        return self.lastPeriod + diff
+
+    def findSync(self,byteArray,start):
+        """
+        Searches byteArray from start for a sync word starting a valid packet.
+        Returns the position and True if found, otherwise the position to
+        resume the search from when more data arrives and False.
+        """
+        num = byteArray.shape[0]
+        sync0 = PACKET_SYNC & 0xff
+        sync1 = PACKET_SYNC >> 8
+        isSync = (byteArray[start:-1] == sync0) & (byteArray[start+1:] == sync1)
+        for pos in numpy.flatnonzero(isSync) + start:
+            if num - pos < PACKET_SIZE:
+                return pos, False
+            if checkPackets(byteArray[pos:pos+PACKET_SIZE].reshape((1,PACKET_SIZE)))[0]:
+                return pos, True
+        return max(start, num - 1), False
+
+
+def framesToSamples(frames,out=None):
+    """
+    Returns the axis values of the structured array of legacy frames, frames,
+    as an (N,3) array of int16 samples. If given, the samples are written into
+    the array out. The sync bytes are assumed to have been checked.
+    """
+    if out is None:
+        out = numpy.empty((frames.shape[0],3),dtype=SAMPLE_DTYPE)
+    out[:,0] = frames['ax']
+    out[:,1] = frames['ay']
+    out[:,2] = frames['az']
+    return out
+
+
+def checkPackets(packetBytes):
+    """
+    Returns a boolean array which is True for each packet in the
+    (M,PACKET_SIZE) uint8 array, packetBytes, with a valid sync word, sample
+    count and checksum.
+    """
+    packets = packetBytes.view(PACKET_DTYPE)[:,0]
+    chk = packetBytes[:,2:-1].sum(axis=1,dtype=numpy.uint8)
+    valid = packets['sync'] == PACKET_SYNC
+    valid &= (packets['count'] <= PACKET_SAMPLES) | (packets['count'] == PACKET_TIMESTAMP)
+    valid &= chk == packets['chk']
+    return valid
+
+
+def gapIndex(num,gaps):
+    """
+    Returns the sample period index of each of num received samples allowing
+    for the missing samples in the list of gaps.
+    """
+    index = numpy.arange(num)
+    for i, n in gaps:
+        index[i:] += n
+    return index
+
+
+def fillGaps(data,gaps):
+    """
+    Returns a float copy of the (N,3) array data with a row of NaNs inserted
+    for each missing sample in the list of gaps.
+    """
+    index = gapIndex(data.shape[0],gaps)
+    size = index[-1] + 1 if index.shape[0] > 0 else 0
+    filled = numpy.empty((size,3))
+    filled[:] = numpy.nan
+    filled[index] = data
+    return filled
+
+
+def createDecoder(frameFormat):
+    """
+    Returns a decoder for the given frame format, FRAME_LEGACY or FRAME_PACKED.
+    """
+    if frameFormat == FRAME_LEGACY:
+        return FrameDecoder()
+    elif frameFormat == FRAME_PACKED:
+        return PackedFrameDecoder()
+    raise ValueError, 'unknown frame format {0}'.format(frameFormat)
@@ -0,0 +1,287 @@
+"""
+metrics.py
+
+This module defines counters, gauges and timing histograms for instrumenting
+the acquisition hot paths, the Metrics registry which holds them, and
+exporters which publish a registry as Prometheus text or statsd lines.
+
+Updating a counter or gauge is an attribute add and observing a histogram a
+bisect into a short tuple of bucket bounds, so the instrumentation can be left
+on. Values which are already counted elsewhere, e.g. by the frame decoder, are
+copied into the registry by collector functions only when a snapshot is
+taken or the metrics are exported.
+
+Example:
+
+    dev = AccelADXL345(port='/dev/ttyUSB0')
+    ...
+    print dev.getMetrics()
+    print formatPrometheus(dev.metrics,labels={'port': dev.port})
+    exporter = StatsdExporter(dev.metrics,'localhost',8125)
+    exporter.send()
+"""
+import bisect
+import socket
+import threading
+import collections
+import BaseHTTPServer
+
+LATENCY_BUCKETS = (1.0e-5, 2.5e-5, 1.0e-4, 2.5e-4, 1.0e-3, 2.5e-3, 1.0e-2, 2.5e-2, 0.1, 0.25, 1.0)
+DEFAULT_PREFIX = 'accel_adxl345'
+STATSD_PORT = 8125
+STATSD_MAX_PACKET = 1400
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+class Counter(object):
+
+    kind = 'counter'
+
+    def __init__(self,name,doc=''):
+        self.name = name
+        self.doc = doc
+        self.value = 0
+
+    def inc(self,num=1):
+        self.value += num
+
+    def getValue(self):
+        return self.value
+
+
+class Gauge(Counter):
+
+    kind = 'gauge'
+
+    def set(self,value):
+        self.value = value
+
+    def setMax(self,value):
+        """
+        Raises the gauge to value if it is higher, for high water marks.
+        """
+        if value > self.value:
+            self.value = value
+
+
+class Histogram(object):
+
+    kind = 'histogram'
+
+    def __init__(self,name,doc='',buckets=LATENCY_BUCKETS):
+        """
+        Counts observations in buckets with the given upper bounds, plus an
+        overflow bucket, and keeps their count, sum and maximum.
+        """
+        self.name = name
+        self.doc = doc
+        self.buckets = tuple(sorted(buckets))
+        self.reset()
+
+    def reset(self):
+        self.counts = [0]*(len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self,value):
+        self.counts[bisect.bisect_left(self.buckets,value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def getQuantile(self,q):
+        """
+        Returns the upper bound of the bucket holding the q quantile of the
+        observations, or the maximum if it is in the overflow bucket.
+        """
+        if self.count == 0:
+            return 0.0
+        target = q*self.count
+        total = 0
+        for bound, num in zip(self.buckets,self.counts):
+            total += num
+            if total >= target:
+                return min(bound,self.max)
+        return self.max
+
+    def getValue(self):
+        mean = self.sum/self.count if self.count else 0.0
+        return {
+                'count' : self.count,
+                'sum'   : self.sum,
+                'mean'  : mean,
+                'max'   : self.max,
+                'p50'   : self.getQuantile(0.5),
+                'p99'   : self.getQuantile(0.99),
+                }
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self.items = collections.OrderedDict()
+        self.collectors = []
+
+    def add(self,metric):
+        if metric.name in self.items:
+            raise ValueError, 'metric {0} already exists'.format(metric.name)
+        self.items[metric.name] = metric
+        return metric
+
+    def counter(self,name,doc=''):
+        return self.add(Counter(name,doc))
+
+    def gauge(self,name,doc=''):
+        return self.add(Gauge(name,doc))
+
+    def histogram(self,name,doc='',buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name,doc,buckets))
+
+    def get(self,name):
+        return self.items[name]
+
+    def addCollector(self,func):
+        """
+        Adds a function, called with no arguments, which updates metrics
+        before each snapshot or export.
+        """
+        self.collectors.append(func)
+
+    def collect(self):
+        """
+        Runs the collectors and returns the list of metrics.
+        """
+        for func in self.collectors:
+            func()
+        return self.items.values()
+
+    def snapshot(self):
+        """
+        Returns a dictionary of the current value of each metric. Histograms
+        are given as dictionaries of their count, sum, mean, max and p50 and
+        p99 bucket bounds.
+        """
+        return dict((metric.name,metric.getValue()) for metric in self.collect())
+
+
+def formatLabels(labels,extra=None):
+    items = sorted(labels.items()) if labels else []
+    if extra is not None:
+        items.append(extra)
+    if not items:
+        return ''
+    text = ','.join('{0}="{1}"'.format(k,str(v).replace('\\','\\\\').replace('"','\\"')) for k, v in items)
+    return '{' + text + '}'
+
+
+def formatPrometheus(metrics,prefix=DEFAULT_PREFIX,labels=None):
+    """
+    Returns the metrics in the Prometheus text exposition format. Every
+    sample is given the dictionary of labels, e.g. {'port': '/dev/ttyUSB0'}.
+    """
+    lines = []
+    for metric in metrics.collect():
+        name = '{0}_{1}'.format(prefix,metric.name) if prefix else metric.name
+        if metric.doc:
+            lines.append('# HELP {0} {1}'.format(name,metric.doc))
+        lines.append('# TYPE {0} {1}'.format(name,metric.kind))
+        if metric.kind == 'histogram':
+            total = 0
+            for bound, num in zip(metric.buckets,metric.counts):
+                total += num
+                lines.append('{0}_bucket{1} {2}'.format(name,formatLabels(labels,('le',repr(bound))),total))
+            lines.append('{0}_bucket{1} {2}'.format(name,formatLabels(labels,('le','+Inf')),metric.count))
+            lines.append('{0}_sum{1} {2!r}'.format(name,formatLabels(labels),metric.sum))
+            lines.append('{0}_count{1} {2}'.format(name,formatLabels(labels),metric.count))
+        else:
+            lines.append('{0}{1} {2}'.format(name,formatLabels(labels),metric.value))
+    return '\n'.join(lines) + '\n'
+
+
+class StatsdExporter(object):
+
+    def __init__(self,metrics,host='localhost',port=STATSD_PORT,prefix=DEFAULT_PREFIX):
+        """
+        Sends the metrics to the statsd server at host and port over UDP.
+        Counters are sent as the change since the last send, gauges as their
+        value and histograms as gauges of their count, mean and max.
+        """
+        self.metrics = metrics
+        self.address = (host,port)
+        self.prefix = prefix
+        self.lastValues = {}
+        self.sock = None
+
+    def format(self):
+        """
+        Returns the list of statsd lines for the current metrics and records
+        the counter values sent.
+        """
+        lines = []
+        for metric in self.metrics.collect():
+            name = '{0}.{1}'.format(self.prefix,metric.name) if self.prefix else metric.name
+            if metric.kind == 'counter':
+                delta = metric.value - self.lastValues.get(metric.name,0)
+                self.lastValues[metric.name] = metric.value
+                lines.append('{0}:{1}|c'.format(name,delta))
+            elif metric.kind == 'gauge':
+                lines.append('{0}:{1}|g'.format(name,metric.value))
+            else:
+                value = metric.getValue()
+                for key in ('count','mean','max'):
+                    lines.append('{0}.{1}:{2!r}|g'.format(name,key,value[key]))
+        return lines
+
+    def send(self):
+        """
+        Sends the metrics, packing as many lines as fit in each datagram.
+        Returns the number of datagrams sent.
+        """
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        packets = []
+        packet = ''
+        for line in self.format():
+            if packet and len(packet) + len(line) + 1 > STATSD_MAX_PACKET:
+                packets.append(packet)
+                packet = ''
+            packet = line if not packet else packet + '\n' + line
+        if packet:
+            packets.append(packet)
+        for packet in packets:
+            self.sock.sendto(packet,self.address)
+        return len(packets)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def servePrometheus(metrics,port,host='',prefix=DEFAULT_PREFIX,labels=None):
+    """
+    Serves the metrics as Prometheus text on every path of an HTTP server at
+    host and port, run in a daemon thread. Returns the server, which is
+    stopped with its shutdown method.
+    """
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            body = formatPrometheus(metrics,prefix,labels)
+            self.send_response(200)
+            self.send_header('Content-Type',PROMETHEUS_CONTENT_TYPE)
+            self.send_header('Content-Length',str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self,*args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer((host,port),Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
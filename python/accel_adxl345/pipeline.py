@@ -0,0 +1,366 @@
+"""
+pipeline.py
+
+This module defines a streaming signal processing pipeline for chunks of
+accelerometer samples. A Pipeline is a sequence of stages, each of which takes
+an (N,3) array and returns the processed (M,3) array. Stages keep their state
+between chunks, so processing a stream chunk by chunk gives the same result
+as processing all of it at once. Every stage works on whole chunks with numpy
+or scipy.signal rather than sample by sample.
+
+The times of the samples, e.g. from SampleChunk times, can be passed through
+the stages with the data. Where samples were lost, shown by a chunk which
+doesn't follow on from the last or by a break in the sample period index, the
+stream is split and no stage filters or interpolates across the break.
+
+This module requires scipy.
+
+Example:
+
+    pipeline = Pipeline(
+            ScaleStage(dev.accelScale),
+            DetrendStage(dev.getSampleRate(),timeConstant=10.0),
+            lowpassStage(50.0,dev.getSampleRate()),
+            DecimateStage(4),
+            )
+    dev.startStreaming(background=True)
+    for data, times in pipeline.iterate(dev.iterChunks(),dev.decoder):
+        ...
+"""
+import numpy
+import scipy.signal
+from sample_chunk import SampleChunk
+
+DECIMATE_TAPS_PER_PHASE = 10
+
+
+class Stage(object):
+    """
+    Base class for pipeline stages.
+    """
+
+    def process(self,data):
+        """
+        Returns the processed (M,3) array for the (N,3) array data.
+        """
+        raise NotImplementedError
+
+    def processTimed(self,data,times):
+        """
+        Returns the processed (M,3) array for the (N,3) array data and the
+        (M,) array of the times of the output samples, given times, the (N,)
+        array of the input sample times or None. Stages with an output sample
+        for each input sample keep the input times.
+        """
+        return self.process(data), times
+
+    def reset(self):
+        """
+        Clears the state carried between chunks.
+        """
+        pass
+
+    def breakStream(self):
+        """
+        Called at a break in the stream, where samples were lost. The state
+        carried between chunks is cleared.
+        """
+        self.reset()
+
+
+class Pipeline(object):
+
+    def __init__(self,*stages):
+        self.stages = list(stages)
+        self.nextIndex = None
+        self.nextPeriod = None
+
+    def process(self,data):
+        """
+        Passes the chunk, data, through each stage in turn.
+        """
+        for stage in self.stages:
+            data = stage.process(data)
+        return data
+
+    def processTimed(self,data,times):
+        """
+        Passes the chunk, data, and the times of its samples through each stage
+        in turn. Returns the processed data and times.
+        """
+        for stage in self.stages:
+            data, times = stage.processTimed(data,times)
+        return data, times
+
+    def reset(self):
+        self.nextIndex = None
+        self.nextPeriod = None
+        for stage in self.stages:
+            stage.reset()
+
+    def breakStream(self):
+        for stage in self.stages:
+            stage.breakStream()
+
+    def processChunk(self,chunk,periods=None):
+        """
+        Processes the next chunk of samples, a SampleChunk or (N,3) array, and
+        returns the processed data and the times of its samples, None if the
+        chunk has no times. If a chunk does not follow on from the last, by its
+        start index, the stages are told of the break.
+
+        Samples lost in transit are only seen as breaks if periods, the (N,)
+        array of the sample period index of each sample, is given, as for
+        TriggerEngine.process. The chunk is then split at the breaks.
+        """
+        if not isinstance(chunk,SampleChunk):
+            return self.processTimed(numpy.asarray(chunk),None)
+        if self.nextIndex is not None and chunk.start != self.nextIndex:
+            self.breakStream()
+        self.nextIndex = chunk.end
+        if periods is None or len(chunk) == 0:
+            return self.processTimed(chunk.raw,chunk.times)
+
+        periods = numpy.asarray(periods)
+        if self.nextPeriod is not None and periods[0] != self.nextPeriod:
+            self.breakStream()
+        self.nextPeriod = periods[-1] + 1
+        breaks = numpy.flatnonzero(numpy.diff(periods) != 1) + 1
+        if breaks.shape[0] == 0:
+            return self.processTimed(chunk.raw,chunk.times)
+        dataList = []
+        timesList = []
+        pos = 0
+        for index in list(breaks) + [len(chunk)]:
+            if pos > 0:
+                self.breakStream()
+            run = chunk[pos:index]
+            data, times = self.processTimed(run.raw,run.times)
+            dataList.append(data)
+            timesList.append(times)
+            pos = index
+        if chunk.times is None:
+            return numpy.concatenate(dataList), None
+        return numpy.concatenate(dataList), numpy.concatenate(timesList)
+
+    def iterate(self,chunks,decoder=None):
+        """
+        Generator yielding (data, times) pairs of the processed chunks for an
+        iterable of chunks, e.g. AccelADXL345.iterChunks. If decoder, e.g.
+        dev.decoder, is given the stream is split where samples were lost.
+        Empty results are skipped.
+        """
+        for chunk in chunks:
+            periods = None
+            if decoder is not None and isinstance(chunk,SampleChunk):
+                periods = decoder.getPeriodIndex(chunk.start,len(chunk))
+            data, times = self.processChunk(chunk,periods)
+            if data.shape[0] > 0:
+                yield data, times
+
+
+class ScaleStage(Stage):
+    """
+    Converts raw samples to floats multiplied by scale.
+    """
+
+    def __init__(self,scale):
+        self.scale = scale
+
+    def process(self,data):
+        return numpy.multiply(data,self.scale)
+
+
+class LFilterStage(Stage):
+    """
+    Filters each axis with the IIR or FIR filter with coefficients b and a,
+    as scipy.signal.lfilter. If steady is True the filter starts in the steady
+    state for the first sample rather than from zero.
+    """
+
+    def __init__(self,b,a=1.0,steady=True):
+        self.b = numpy.atleast_1d(b)
+        self.a = numpy.atleast_1d(a)
+        self.steady = steady
+        self.zi = None
+
+    def reset(self):
+        self.zi = None
+
+    def process(self,data):
+        if data.shape[0] == 0:
+            return numpy.zeros((0,3))
+        if self.zi is None:
+            zi = scipy.signal.lfilter_zi(self.b,self.a)[:,numpy.newaxis]
+            self.zi = zi*data[0] if self.steady else zi*0.0
+        out, self.zi = scipy.signal.lfilter(self.b,self.a,data,axis=0,zi=self.zi)
+        return out
+
+
+class SOSFilterStage(Stage):
+    """
+    Filters each axis with the IIR filter given as second order sections, as
+    scipy.signal.sosfilt. This is more robust than LFilterStage for high order
+    filters.
+    """
+
+    def __init__(self,sos,steady=True):
+        self.sos = numpy.atleast_2d(sos)
+        self.steady = steady
+        self.zi = None
+
+    def reset(self):
+        self.zi = None
+
+    def process(self,data):
+        if data.shape[0] == 0:
+            return numpy.zeros((0,3))
+        if self.zi is None:
+            zi = scipy.signal.sosfilt_zi(self.sos)[:,:,numpy.newaxis]
+            self.zi = zi*data[0] if self.steady else zi*0.0
+        out, self.zi = scipy.signal.sosfilt(self.sos,data,axis=0,zi=self.zi)
+        return out
+
+
+class DecimateStage(Stage):
+    """
+    Reduces the sample rate by an integer factor. Each axis is low pass
+    filtered by an FIR filter, taps, which defaults to a windowed sinc with
+    its cutoff at the new Nyquist frequency. The filter is only evaluated at
+    the retained samples, as in a polyphase decimator.
+    """
+
+    def __init__(self,factor,taps=None):
+        self.factor = int(factor)
+        if self.factor < 1:
+            raise ValueError, 'decimation factor must be >= 1'
+        if taps is None:
+            numTaps = DECIMATE_TAPS_PER_PHASE*self.factor + 1
+            taps = scipy.signal.firwin(numTaps,1.0/self.factor)
+        self.taps = numpy.asarray(taps,dtype=float)
+        self.reset()
+
+    def reset(self):
+        self.history = None
+        self.phase = 0
+
+    def process(self,data):
+        return self.processTimed(data,None)[0]
+
+    def processTimed(self,data,times):
+        numTaps = self.taps.shape[0]
+        num = data.shape[0]
+        if self.history is None:
+            # Pad the start with the first sample so there is no step
+            if num == 0:
+                return numpy.zeros((0,3)), times
+            self.history = numpy.zeros((numTaps-1,3)) + data[0]
+        buf = numpy.concatenate((self.history,data))
+
+        # Output n, in data coordinates, uses buf[n:n+numTaps]
+        positions = numpy.arange(self.phase,num,self.factor)
+        out = numpy.zeros((positions.shape[0],3))
+        for j in range(numTaps):
+            out += self.taps[numTaps-1-j]*buf[positions+j]
+
+        if positions.shape[0] > 0:
+            self.phase = positions[-1] + self.factor - num
+        else:
+            self.phase -= num
+        self.history = buf[buf.shape[0]-(numTaps-1):]
+        if times is not None:
+            times = times[positions]
+        return out, times
+
+
+class DetrendStage(Stage):
+    """
+    Removes the slowly varying offset, e.g. gravity, from each axis by
+    subtracting a running mean with the given time constant in seconds.
+    """
+
+    def __init__(self,sampleRate,timeConstant=1.0):
+        alpha = 1.0 - numpy.exp(-1.0/(timeConstant*sampleRate))
+        self.mean = LFilterStage([alpha],[1.0,alpha-1.0])
+
+    def reset(self):
+        self.mean.reset()
+
+    def process(self,data):
+        return data - self.mean.process(data)
+
+
+class ResampleStage(Stage):
+    """
+    Linearly interpolates samples onto an exact grid of times which are
+    multiples of outputDt seconds from the first sample. The sample times are
+    those passed with the data or, if none are, the samples are taken every
+    sampleDt seconds, e.g. the measured sample interval. Samples are not
+    interpolated across a break in the stream, the grid resumes at the first
+    sample after it.
+    """
+
+    def __init__(self,sampleDt,outputDt):
+        self.sampleDt = float(sampleDt)
+        self.outputDt = float(outputDt)
+        self.reset()
+
+    def reset(self):
+        self.last = None
+        self.lastTime = None
+        self.startTime = None
+        self.inputCount = 0
+        self.outputCount = 0
+
+    def breakStream(self):
+        self.last = None
+        self.lastTime = None
+
+    def process(self,data):
+        return self.processTimed(data,None)[0]
+
+    def processTimed(self,data,times):
+        num = data.shape[0]
+        if times is None:
+            times = self.sampleDt*numpy.arange(self.inputCount,self.inputCount+num)
+        self.inputCount += num
+        if num == 0:
+            return numpy.zeros((0,3)), numpy.zeros((0,))
+        if self.startTime is None:
+            self.startTime = times[0]
+        t = times - self.startTime
+        values = data
+        if self.last is None:
+            first = int(numpy.ceil(t[0]/self.outputDt))
+            self.outputCount = max(self.outputCount,first)
+        else:
+            t = numpy.concatenate(([self.lastTime],t))
+            values = numpy.concatenate((self.last,data))
+        self.last = data[-1:]
+        self.lastTime = t[-1]
+
+        numOutput = max(0,int(numpy.floor(t[-1]/self.outputDt)) + 1 - self.outputCount)
+        tOut = self.outputDt*numpy.arange(self.outputCount,self.outputCount+numOutput)
+        self.outputCount += numOutput
+        out = numpy.empty((numOutput,3))
+        for i in range(3):
+            out[:,i] = numpy.interp(tOut,t,values[:,i])
+        return out, self.startTime + tOut
+
+
+def lowpassStage(cutoff,sampleRate,order=4):
+    """
+    Returns an SOSFilterStage for a Butterworth low pass filter with the given
+    cutoff frequency and order.
+    """
+    sos = scipy.signal.butter(order,cutoff/(0.5*sampleRate),btype='lowpass',output='sos')
+    return SOSFilterStage(sos)
+
+
+def highpassStage(cutoff,sampleRate,order=4):
+    """
+    Returns an SOSFilterStage for a Butterworth high pass filter with the given
+    cutoff frequency and order.
+    """
+    sos = scipy.signal.butter(order,cutoff/(0.5*sampleRate),btype='highpass',output='sos')
+    return SOSFilterStage(sos)
@@ -0,0 +1,97 @@
+"""
+ring_buffer.py
+
+This module defines the SampleRingBuffer class, a fixed capacity buffer of raw
+int16 accelerometer samples used for open ended acquisitions. Memory use is
+set by the capacity and does not grow with the length of the acquisition. 
+"""
+import numpy
+from frame_decoder import SAMPLE_DTYPE
+
+
+class SampleRingBuffer(object):
+
+    def __init__(self,capacity):
+        if capacity <= 0:
+            raise ValueError, 'capacity must be > 0'
+        self.capacity = int(capacity)
+        self.data = numpy.zeros((self.capacity,3),dtype=SAMPLE_DTYPE)
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count,self.capacity)
+
+    def clear(self):
+        """
+        Empties the buffer.
+        """
+        self.head = 0
+        self.count = 0
+
+    def getWriteView(self):
+        """
+        Returns a view of the contiguous region of the buffer starting at the
+        write position. Samples written into the view are committed with
+        advance.
+        """
+        return self.data[self.head:]
+
+    def advance(self,num):
+        """
+        Commits num samples written into the view returned by getWriteView.
+        """
+        self.head = (self.head + num) % self.capacity
+        self.count += num
+
+    def write(self,samples):
+        """
+        Copies the (N,3) array of samples into the buffer, overwriting the
+        oldest samples if the buffer is full.
+        """
+        num = samples.shape[0]
+        if num >= self.capacity:
+            self.data[:] = samples[num-self.capacity:]
+            self.head = 0
+            self.count += num
+            return
+        n0 = min(num, self.capacity - self.head)
+        self.data[self.head:self.head+n0] = samples[:n0]
+        self.data[:num-n0] = samples[n0:]
+        self.advance(num)
+
+    def getData(self,num=None):
+        """
+        Returns a copy of the last num samples (all stored samples by default)
+        in the buffer ordered from oldest to newest.
+        """
+        segments = self.getSegments(num)
+        if len(segments) == 1:
+            return segments[0].copy()
+        return numpy.concatenate(segments)
+
+    def getScaled(self,scale,num=None):
+        """
+        Returns the last num samples multiplied by scale as a float array. The
+        raw samples are scaled straight into the output array.
+        """
+        segments = self.getSegments(num)
+        data = numpy.empty((sum(x.shape[0] for x in segments),3))
+        pos = 0
+        for x in segments:
+            numpy.multiply(x,scale,out=data[pos:pos+x.shape[0]])
+            pos += x.shape[0]
+        return data
+
+    def getSegments(self,num=None):
+        """
+        Returns views of the last num samples as a list of one or two
+        contiguous arrays ordered from oldest to newest.
+        """
+        size = len(self)
+        if num is None or num > size:
+            num = size
+        start = (self.head - num) % self.capacity
+        if start + num <= self.capacity:
+            return [self.data[start:start+num]]
+        return [self.data[start:], self.data[:self.head]]
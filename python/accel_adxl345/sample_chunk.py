@@ -0,0 +1,165 @@
+"""
+sample_chunk.py
+
+This module defines the SampleChunk class, a run of accelerometer samples held
+as the raw (N,3) int16 array from the decoder together with the index of the
+first sample since streaming started, the sample times and the acceleration
+range. Conversions to m/s^2 or g are only done when asked for and are cached,
+so a chunk which is only stored or written to a capture file costs 6 bytes per
+sample rather than the 24 of a float64 array. If the chunk has a Calibration
+the conversions apply it in place of the scale.
+
+Slicing a chunk returns a new chunk sharing the raw array, times and any
+cached conversions. Chunks can be joined with concatChunks, which returns a
+view rather than a copy when the chunks are adjacent parts of one array, e.g.
+slices of the same chunk or blocks decoded into one preallocated array.
+"""
+import numpy
+from numpy.lib.stride_tricks import as_strided
+
+STANDARD_GRAVITY = 9.80665
+
+
+class SampleChunk(object):
+
+    __slots__ = ('raw','start','times','accelRange','accelScale','calibration','_accel','_g')
+
+    def __init__(self,raw,accelScale,start=0,times=None,accelRange=None,calibration=None):
+        """
+        Wraps the (N,3) int16 array of raw samples, raw, which are converted to
+        m/s^2 by multiplying by accelScale or, if given, by the Calibration,
+        calibration. The index of the first sample is start and times, if
+        given, is the (N,) array of sample times in seconds.
+        """
+        self.raw = raw
+        self.accelScale = accelScale
+        self.start = start
+        self.times = times
+        self.accelRange = accelRange
+        self.calibration = calibration
+        self._accel = None
+        self._g = None
+
+    def __len__(self):
+        return self.raw.shape[0]
+
+    def __array__(self,dtype=None):
+        if dtype is None:
+            return self.raw
+        return self.raw.astype(dtype)
+
+    def __getitem__(self,key):
+        """
+        Slicing returns a SampleChunk sharing the data of this one, any other
+        index is applied to the raw array.
+        """
+        if not isinstance(key,slice):
+            return self.raw[key]
+        first = key.indices(self.raw.shape[0])[0]
+        chunk = SampleChunk(
+                self.raw[key],
+                self.accelScale,
+                start=self.start + first,
+                times=None if self.times is None else self.times[key],
+                accelRange=self.accelRange,
+                calibration=self.calibration,
+                )
+        if self._accel is not None:
+            chunk._accel = self._accel[key]
+        if self._g is not None:
+            chunk._g = self._g[key]
+        return chunk
+
+    def __repr__(self):
+        return 'SampleChunk(start={0}, num={1}, range={2})'.format(self.start,len(self),self.accelRange)
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    @property
+    def end(self):
+        """
+        Index of the sample following the chunk.
+        """
+        return self.start + self.raw.shape[0]
+
+    def getAccel(self):
+        """
+        Returns the samples in m/s^2 as an (N,3) float array. The array is
+        computed on the first call and must not be modified.
+        """
+        if self._accel is None:
+            if self.calibration is not None:
+                self._accel = self.calibration.apply(self.raw)
+            else:
+                self._accel = numpy.multiply(self.raw,self.accelScale)
+        return self._accel
+
+    def getG(self):
+        """
+        Returns the samples in units of standard gravity as an (N,3) float
+        array. The array is computed on the first call and must not be
+        modified.
+        """
+        if self._g is None:
+            if self.calibration is not None:
+                self._g = self.calibration.apply(self.raw,STANDARD_GRAVITY)
+            else:
+                self._g = numpy.multiply(self.raw,self.accelScale/STANDARD_GRAVITY)
+        return self._g
+
+    def clearCache(self):
+        """
+        Frees the cached conversions.
+        """
+        self._accel = None
+        self._g = None
+
+
+def joinArrays(arrays):
+    """
+    Returns the arrays joined along the first axis. If they are adjacent,
+    contiguous parts of the same memory the result is a view, otherwise a copy.
+    """
+    first = arrays[0]
+    if len(arrays) == 1:
+        return first
+    adjacent = first.flags.c_contiguous
+    end = first.__array_interface__['data'][0] + first.nbytes
+    for array in arrays[1:]:
+        if not adjacent:
+            break
+        adjacent = array.flags.c_contiguous and array.dtype == first.dtype
+        adjacent = adjacent and array.shape[1:] == first.shape[1:]
+        adjacent = adjacent and array.__array_interface__['data'][0] == end
+        adjacent = adjacent and (array.base is not None and array.base is first.base)
+        end += array.nbytes
+    if adjacent:
+        num = sum(array.shape[0] for array in arrays)
+        return as_strided(first,shape=(num,) + first.shape[1:])
+    return numpy.concatenate(arrays)
+
+
+def concatChunks(chunks):
+    """
+    Returns a SampleChunk holding the samples of the list of chunks in order.
+    The chunks must have the same range, scale and calibration. Times are kept
+    only if every chunk has them.
+    """
+    chunks = list(chunks)
+    if not chunks:
+        raise ValueError, 'no chunks to concatenate'
+    first = chunks[0]
+    for chunk in chunks[1:]:
+        if chunk.accelScale != first.accelScale or chunk.accelRange != first.accelRange:
+            raise ValueError, 'chunks have different ranges or scales'
+        if chunk.calibration is not first.calibration:
+            raise ValueError, 'chunks have different calibrations'
+    raw = joinArrays([chunk.raw for chunk in chunks])
+    times = None
+    if all(chunk.times is not None for chunk in chunks):
+        times = joinArrays([chunk.times for chunk in chunks])
+    return SampleChunk(raw,first.accelScale,start=first.start,times=times,accelRange=first.accelRange,
+            calibration=first.calibration)
+
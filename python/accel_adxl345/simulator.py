@@ -0,0 +1,599 @@
+"""
+simulator.py
+
+This module defines a software simulator of the accel_adxl345 firmware for
+testing and benchmarking the host code without hardware.
+
+The DeviceSimulator class implements the firmware's serial command set and
+streams legacy or packed frames at the configured timer period or, in
+SAMPLE_FIFO mode, the ADXL345 output data rate. Noise, bad samples (which the
+firmware drops and counts), dropped bytes, delivery jitter, an error in the
+rate of the firmware clock and periodic shocks can be added to exercise the
+decoders and triggers. The simulator can be run in two ways:
+
+    PtySimulator - serves the simulator on a pseudo terminal. The port name,
+    sim.port, can be opened by AccelADXL345 and the other clients exactly like
+    a real device. The simulator runs in a thread, or in a child process so
+    that it does not share the host's CPU time. Requires a posix system.
+
+    SimulatedPort - an in process object with the read, write and inWaiting
+    methods of a serial port, driven by the host clock. Useful for exercising
+    the decoders without a pty.
+
+Example:
+
+    sim = PtySimulator(noise=2.0,badSampleProb=0.001)
+    sim.start()
+    dev = AccelADXL345(port=sim.port,reset_sleep=False)
+    t, data = dev.getSamples(1000)
+    sim.stop()
+"""
+import os
+import time
+import select
+import threading
+import multiprocessing
+import numpy
+from frame_decoder import FRAME_DTYPE
+from frame_decoder import FRAME_LEGACY
+from frame_decoder import FRAME_PACKED
+from frame_decoder import PACKET_DTYPE
+from frame_decoder import PACKET_SIZE
+from frame_decoder import PACKET_SYNC
+from frame_decoder import PACKET_SAMPLES
+from frame_decoder import PACKET_SEQ_MOD
+from frame_decoder import PACKET_TIMESTAMP
+from frame_decoder import TIMESTAMP_INTERVAL
+from frame_decoder import SAMPLE_DTYPE
+from accel_adxl345 import CMD_ID
+from accel_adxl345 import ALLOWED_ACCEL_RANGE
+from accel_adxl345 import ALLOWED_BAUD_RATE
+from accel_adxl345 import DEFAULT_BAUD_RATE
+from accel_adxl345 import SAMPLE_TIMER
+from accel_adxl345 import SAMPLE_FIFO
+from accel_adxl345 import ODR_RATES
+from accel_adxl345 import DEFAULT_TRIGGER_PRE
+from accel_adxl345 import DEFAULT_TRIGGER_POST
+from accel_adxl345 import PEEK_DTYPE
+
+# Firmware constants, see constants.h
+DEFAULT_TIMER_PERIOD = 2000
+MIN_TIMER_PERIOD = 2000
+FAST_MIN_TIMER_PERIOD = 312
+FAST_BAUD_RATE = 115200
+MAX_TIMER_PERIOD = 100000
+DEFAULT_RANGE = 16
+DEFAULT_ODR_CODE = 10
+PACKET_FLUSH_PERIOD = 10000
+LEGACY_RECORD_SIZE = 7
+MAX_BUFFER_RECORDS = 512
+
+BASE_VALUE = (10,-20,255)
+OUTPUT_LIMIT = 2**16
+MICROS_MOD = 2**32
+POLL_DT = 0.001
+READ_SIZE = 1024
+
+# Simulated shocks: decaying oscillations lasting SHOCK_LENGTH samples
+SHOCK_LENGTH = 200
+SHOCK_DECAY = 30.0
+SHOCK_PERIOD = 8.0
+
+CMD_NAME = dict((v,k) for k, v in CMD_ID.iteritems())
+
+
+class DeviceSimulator(object):
+    """
+    Simulates the firmware's command handling and streaming. Input bytes are
+    passed to handleInput and the bytes sent by the device are collected with
+    update, which streams the samples due up to the given time.
+
+    Keyword arguments:
+
+        noise          - standard deviation, in raw counts, of gaussian noise
+                         added to each axis.
+        badSampleProb  - probability that a sample fails the firmware's check
+                         and is dropped.
+        dropByteProb   - probability that each byte sent is lost.
+        jitter         - standard deviation, in seconds, of the delay before
+                         the samples are delivered to the host.
+        resetDelay     - time, in seconds, after reset for which the device
+                         ignores commands.
+        clockError     - fractional error in the rate of the firmware clock,
+                         e.g. 5.0e-5 for a clock running 50 ppm slow. Sets the
+                         true sample interval and the drift of the timestamps.
+        bufferSize     - capacity, in samples, of the firmware sample buffer.
+                         If given, streaming data is sent no faster than the
+                         baud rate allows and samples which arrive when the
+                         buffer is full are dropped. Otherwise data is sent as
+                         soon as it is taken.
+        shockInterval  - number of sample periods between shocks, decaying
+                         oscillations added to each axis. None for no shocks.
+        shockAmplitude - initial amplitude of the shocks in raw counts.
+        seed           - seed for the random number generator.
+    """
+
+    def __init__(self,noise=0.0,badSampleProb=0.0,dropByteProb=0.0,jitter=0.0,
+            resetDelay=0.0,clockError=0.0,bufferSize=None,shockInterval=None,
+            shockAmplitude=1000,seed=None):
+        self.noise = noise
+        self.badSampleProb = badSampleProb
+        self.dropByteProb = dropByteProb
+        self.jitter = jitter
+        self.resetDelay = resetDelay
+        self.clockError = clockError
+        self.bufferSize = bufferSize
+        self.shockInterval = shockInterval
+        self.shockAmplitude = shockAmplitude
+        self.random = numpy.random.RandomState(seed)
+        self.reset()
+
+    def reset(self,now=None):
+        """
+        Returns the simulator to its power on state.
+        """
+        if now is None:
+            now = time.time()
+        self.resetTime = now
+        self.streaming = False
+        self.timerPeriod = DEFAULT_TIMER_PERIOD
+        self.sampleMode = SAMPLE_TIMER
+        self.odrCode = DEFAULT_ODR_CODE
+        self.range = DEFAULT_RANGE
+        self.fullRes = True
+        self.baudRate = DEFAULT_BAUD_RATE
+        self.frameFormat = FRAME_LEGACY
+        self.badSampleCount = 0
+        self.sampleCount = 0
+        self.samplesDue = 0
+        self.startTime = now
+        self.startMicros = 0
+        self.lineBuf = ''
+        self.output = []
+        self.outputSize = 0
+        self.txTime = now
+        self.txBudget = 0.0
+        self.pendingSamples = numpy.zeros((0,3),dtype=SAMPLE_DTYPE)
+        self.pendingSeq = numpy.zeros((0,),dtype=numpy.int64)
+        self.triggerLevel = 0
+        self.triggerPre = DEFAULT_TRIGGER_PRE
+        self.triggerPost = DEFAULT_TRIGGER_POST
+        self.clearTrigger()
+
+    def getMinTimerPeriod(self):
+        if self.baudRate < FAST_BAUD_RATE:
+            return MIN_TIMER_PERIOD
+        if self.frameFormat == FRAME_PACKED:
+            bits = (10000000*PACKET_SIZE)//PACKET_SAMPLES
+        else:
+            bits = 10000000*LEGACY_RECORD_SIZE
+        period = bits//self.baudRate
+        period += period//16
+        return max(period,FAST_MIN_TIMER_PERIOD)
+
+    def getSamplePeriod(self):
+        """
+        Returns the sample period in microseconds: the timer period, or in
+        SAMPLE_FIFO mode the period of the output data rate.
+        """
+        if self.sampleMode == SAMPLE_FIFO:
+            return 1.0e6/ODR_RATES[self.odrCode]
+        return float(self.timerPeriod)
+
+    def getSamplePeriodInt(self):
+        return int(self.getSamplePeriod())
+
+    def getBufferCapacity(self):
+        if self.bufferSize is not None:
+            return self.bufferSize
+        return MAX_BUFFER_RECORDS
+
+    def getBytesPerSample(self):
+        if self.frameFormat == FRAME_PACKED:
+            return PACKET_SIZE/float(PACKET_SAMPLES)
+        return float(LEGACY_RECORD_SIZE)
+
+    def handleInput(self,byteVals,now=None):
+        """
+        Processes bytes received from the host.
+        """
+        if now is None:
+            now = time.time()
+        if now - self.resetTime < self.resetDelay:
+            return
+        self.lineBuf += byteVals
+        while '\n' in self.lineBuf:
+            line, self.lineBuf = self.lineBuf.split('\n',1)
+            line = line.strip()
+            if not (line.startswith('[') and line.endswith(']')):
+                continue
+            try:
+                vals = [int(x) for x in line[1:-1].split(',')]
+            except ValueError:
+                continue
+            self.handleCmd(vals,now)
+
+    def handleCmd(self,vals,now):
+        name = CMD_NAME.get(vals[0])
+        arg = vals[1] if len(vals) > 1 else 0
+        stopped = not self.streaming
+
+        if name == 'stop_streaming':
+            self.streaming = False
+            self.clearPending()
+            self.clearTrigger()
+        elif name == 'start_streaming':
+            self.streaming = True
+            self.startTime = now
+            self.samplesDue = 0
+            self.sampleCount = 0
+            self.startMicros = self.random.randint(0,MICROS_MOD,dtype=numpy.int64)
+            self.txTime = now
+            self.txBudget = 0.0
+            self.clearPending()
+            self.clearTrigger()
+        elif name == 'set_timer_period':
+            if self.getMinTimerPeriod() <= arg <= MAX_TIMER_PERIOD:
+                self.timerPeriod = arg
+        elif name == 'set_range' and stopped:
+            if arg in ALLOWED_ACCEL_RANGE:
+                self.range = arg
+            self.reply('{0} {1:d}'.format(self.range,self.fullRes))
+        elif name == 'set_resolution' and stopped:
+            self.fullRes = arg != 0
+            self.reply('{0} {1:d}'.format(self.range,self.fullRes))
+        elif name == 'get_sample' and stopped:
+            self.reply(' '.join(str(x) for x in self.makeValues(1)[0]))
+        elif name == 'peek' and stopped:
+            reply = numpy.zeros((1,),dtype=PEEK_DTYPE)
+            reply['sync'] = PACKET_SYNC
+            reply['data'] = self.makeValues(1)[0]
+            replyBytes = reply.view(numpy.uint8)
+            replyBytes[-1] = replyBytes[2:-1].sum(dtype=numpy.uint8)
+            self.send(replyBytes.tostring())
+        elif name == 'get_config' and stopped:
+            self.reply('{0} {1} {2} {3} {4:d}'.format(
+                self.getSamplePeriodInt(),
+                self.range,
+                self.getMinTimerPeriod(),
+                MAX_TIMER_PERIOD,
+                self.fullRes,
+                ))
+        elif name == 'get_values' and stopped:
+            values = [self.getValue(i) for i in range(16) if arg & (1 << i)]
+            self.reply(' '.join(str(x) for x in values))
+        elif name == 'set_baud_rate' and stopped:
+            if arg in ALLOWED_BAUD_RATE:
+                self.baudRate = arg
+                if self.timerPeriod < self.getMinTimerPeriod():
+                    self.timerPeriod = self.getMinTimerPeriod()
+                self.reply(arg)
+            else:
+                self.reply(0)
+        elif name == 'set_frame_format' and stopped:
+            if arg in (FRAME_LEGACY, FRAME_PACKED):
+                self.frameFormat = arg
+                if self.timerPeriod < self.getMinTimerPeriod():
+                    self.timerPeriod = self.getMinTimerPeriod()
+        elif name == 'set_sample_mode' and stopped:
+            if arg in (SAMPLE_TIMER, SAMPLE_FIFO):
+                self.sampleMode = arg
+        elif name == 'set_odr' and stopped:
+            if arg in ODR_RATES and 1.0e6/ODR_RATES[arg] >= self.getMinTimerPeriod():
+                self.odrCode = arg
+        elif name == 'set_trigger' and stopped:
+            if len(vals) == 4 and vals[3] > 0:
+                self.triggerLevel = vals[1]
+                self.triggerPre = min(vals[2],self.getBufferCapacity()//2)
+                self.triggerPost = vals[3]
+        elif name == 'get_trigger' and stopped:
+            self.reply('{0} {1} {2}'.format(self.triggerLevel,self.triggerPre,self.triggerPost))
+        elif name is not None and name.startswith('get_') and stopped:
+            self.reply(self.getValue(vals[0]))
+
+    def getValue(self,cmdId):
+        """
+        Returns the value of a scalar get command.
+        """
+        name = CMD_NAME.get(cmdId)
+        if name == 'get_timer_period':
+            return self.getSamplePeriodInt()
+        elif name == 'get_range':
+            return self.range
+        elif name == 'get_max_timer_period':
+            return MAX_TIMER_PERIOD
+        elif name == 'get_min_timer_period':
+            return self.getMinTimerPeriod()
+        elif name == 'get_bad_sample_count':
+            return self.badSampleCount
+        elif name == 'get_sample_mode':
+            return self.sampleMode
+        elif name == 'get_odr':
+            return self.odrCode
+        return 0
+
+    def reply(self,value):
+        self.send('{0}\r\n'.format(value))
+
+    def send(self,byteVals):
+        self.output.append(byteVals)
+        self.outputSize += len(byteVals)
+
+    def clearPending(self):
+        self.pendingSamples = self.pendingSamples[:0]
+        self.pendingSeq = self.pendingSeq[:0]
+
+    def clearTrigger(self):
+        self.triggerHold = 0
+        self.heldSamples = self.pendingSamples[:0]
+        self.heldSeq = self.pendingSeq[:0]
+
+    def makeValues(self,num,seq=None):
+        """
+        Returns an (num,3) array of raw accelerometer values for the sample
+        periods seq.
+        """
+        values = numpy.empty((num,3),dtype=SAMPLE_DTYPE)
+        values[:] = BASE_VALUE
+        if self.noise > 0:
+            values += self.random.normal(0,self.noise,(num,3)).round().astype(SAMPLE_DTYPE)
+        if self.shockInterval is not None and seq is not None:
+            k = seq % self.shockInterval
+            shock = numpy.flatnonzero(k < SHOCK_LENGTH)
+            k = k[shock]
+            wave = self.shockAmplitude*numpy.exp(-k/SHOCK_DECAY)*numpy.sin(2.0*numpy.pi*(k + 0.25*SHOCK_PERIOD)/SHOCK_PERIOD)
+            values[shock] += wave.round().astype(SAMPLE_DTYPE)[:,numpy.newaxis]
+        # Full resolution values are 3.9 mg per count up to the range, 10 bit
+        # values are range/2 times coarser
+        if self.fullRes:
+            limit = 256*self.range
+        else:
+            values = (values/(0.5*self.range)).round().astype(SAMPLE_DTYPE)
+            limit = 512
+        return values.clip(-limit,limit-1)
+
+    def applyTrigger(self,samples,seq):
+        """
+        Returns the samples, and their sequence numbers, released by the
+        threshold trigger: from triggerPre before a sample with an absolute
+        value of at least triggerLevel on any axis to triggerPost from it. The
+        last triggerPre samples not released are held for the next call.
+        """
+        numHeld = self.heldSamples.shape[0]
+        samples = numpy.concatenate((self.heldSamples,samples))
+        seq = numpy.concatenate((self.heldSeq,seq))
+        num = samples.shape[0]
+        over = numpy.abs(samples[numHeld:].astype(int)) >= self.triggerLevel
+        over = numpy.flatnonzero(over.any(axis=1)) + numHeld
+        starts = numpy.concatenate(([numHeld],numpy.maximum(over - self.triggerPre,0)))
+        ends = numpy.concatenate(([numHeld + self.triggerHold],over + self.triggerPost))
+        delta = numpy.zeros((num+1,),dtype=int)
+        numpy.add.at(delta,starts,1)
+        numpy.add.at(delta,numpy.minimum(ends,num),-1)
+        released = numpy.cumsum(delta[:num]) > 0
+        self.triggerHold = max(0,ends.max() - num)
+        last = numpy.flatnonzero(released)
+        first = last[-1] + 1 if last.shape[0] > 0 else 0
+        first = max(first,num - self.triggerPre)
+        self.heldSamples = samples[first:]
+        self.heldSeq = seq[first:]
+        return samples[released], seq[released]
+
+    def update(self,now=None,backlog=0):
+        """
+        Streams the samples due by time now and returns all of the bytes sent
+        by the device since the last call. The number of bytes sent but not
+        yet read by the host is given by backlog. Samples are dropped, as when
+        the firmware's buffer is full, while the backlog is over OUTPUT_LIMIT.
+        If bufferSize is set only the bytes the serial port could have sent by
+        time now are returned.
+        """
+        if now is None:
+            now = time.time()
+        if self.streaming:
+            delay = 0.0
+            if self.jitter > 0:
+                delay = abs(self.random.normal(0,self.jitter))
+            dt = self.getSamplePeriod()*1.0e-6*(1.0 + self.clockError)
+            due = int((now - self.startTime - delay)/dt)
+            if due > self.samplesDue:
+                self.streamSamples(due - self.samplesDue,backlog)
+                self.samplesDue = due
+        byteVals = ''.join(self.output)
+        self.output = []
+        self.outputSize = 0
+        if self.bufferSize is not None:
+            byteVals = self.limitRate(byteVals,now)
+        if self.dropByteProb > 0 and byteVals:
+            byteArray = numpy.frombuffer(byteVals,dtype=numpy.uint8)
+            keep = self.random.random_sample(byteArray.shape[0]) >= self.dropByteProb
+            byteVals = byteArray[keep].tostring()
+        return byteVals
+
+    def limitRate(self,byteVals,now):
+        """
+        Returns the part of byteVals which could be sent at the baud rate since
+        the last call, keeping the rest in the output for later.
+        """
+        budget = self.txBudget + (now - self.txTime)*self.baudRate/10.0
+        self.txTime = now
+        num = min(len(byteVals),int(budget))
+        if num < len(byteVals):
+            self.txBudget = budget - num
+            self.send(byteVals[num:])
+        else:
+            self.txBudget = 0.0
+        return byteVals[:num]
+
+    def streamSamples(self,num,backlog=0):
+        """
+        Takes num samples, drops the bad ones and sends the rest.
+        """
+        seq = self.sampleCount + numpy.arange(num)
+        samples = self.makeValues(num,seq)
+        self.sampleCount += num
+        if self.frameFormat == FRAME_PACKED:
+            self.sendTimestamps(seq[seq % TIMESTAMP_INTERVAL == 0])
+        good = numpy.ones((num,),dtype=bool)
+        if self.badSampleProb > 0:
+            good = self.random.random_sample(num) >= self.badSampleProb
+        if backlog + self.outputSize > OUTPUT_LIMIT:
+            good[:] = False
+        if self.bufferSize is not None:
+            queued = int(self.outputSize/self.getBytesPerSample()) + self.pendingSamples.shape[0]
+            free = max(0,self.bufferSize - queued)
+            good[numpy.flatnonzero(good)[free:]] = False
+        self.badSampleCount += num - good.sum()
+        samples = samples[good]
+        seq = seq[good]
+        if self.triggerLevel > 0:
+            samples, seq = self.applyTrigger(samples,seq)
+        if self.frameFormat == FRAME_PACKED:
+            self.sendPackets(samples,seq)
+        else:
+            frames = numpy.zeros((samples.shape[0],),dtype=FRAME_DTYPE)
+            frames['ax'] = samples[:,0]
+            frames['ay'] = samples[:,1]
+            frames['az'] = samples[:,2]
+            self.send(frames.tostring())
+
+    def sendPackets(self,samples,seq):
+        """
+        Sends packets of consecutive samples. As in the firmware, partial
+        packets are held back unless the timer period is long.
+        """
+        samples = numpy.concatenate((self.pendingSamples,samples))
+        seq = numpy.concatenate((self.pendingSeq,seq))
+        flush = self.getSamplePeriod() >= PACKET_FLUSH_PERIOD
+        starts = []
+        pos = 0
+        while pos < seq.shape[0]:
+            if seq.shape[0] - pos < PACKET_SAMPLES and not flush:
+                break
+            run = seq[pos:pos+PACKET_SAMPLES] - seq[pos]
+            broken = numpy.flatnonzero(run != numpy.arange(run.shape[0]))
+            count = broken[0] if broken.shape[0] > 0 else run.shape[0]
+            starts.append((pos,count))
+            pos += count
+        self.pendingSamples = samples[pos:]
+        self.pendingSeq = seq[pos:]
+        if not starts:
+            return
+        packets = numpy.zeros((len(starts),),dtype=PACKET_DTYPE)
+        packets['sync'] = PACKET_SYNC
+        for i, (start, count) in enumerate(starts):
+            packets['seq'][i] = seq[start] % PACKET_SEQ_MOD
+            packets['count'][i] = count
+            packets['data'][i,:count] = samples[start:start+count]
+        packetBytes = packets.view(numpy.uint8).reshape((-1,PACKET_SIZE))
+        packetBytes[:,-1] = packetBytes[:,2:-1].sum(axis=1,dtype=numpy.uint8)
+        self.send(packetBytes.tostring())
+
+
+    def sendTimestamps(self,seq):
+        """
+        Sends a timestamp packet, with the firmware clock in microseconds and
+        the bad sample count, range and resolution, for each of the sample
+        periods, seq.
+        """
+        if seq.shape[0] == 0:
+            return
+        packets = numpy.zeros((seq.shape[0],),dtype=PACKET_DTYPE)
+        packets['sync'] = PACKET_SYNC
+        packets['seq'] = seq % PACKET_SEQ_MOD
+        packets['count'] = PACKET_TIMESTAMP
+        packetBytes = packets.view(numpy.uint8).reshape((-1,PACKET_SIZE))
+        micros = (self.startMicros + (seq*self.getSamplePeriod()).astype(numpy.int64)) % MICROS_MOD
+        packetBytes[:,5:9] = micros.astype('<u4').view(numpy.uint8).reshape((-1,4))
+        packetBytes[:,9] = self.badSampleCount & 0xff
+        packetBytes[:,10] = (self.badSampleCount >> 8) & 0xff
+        packetBytes[:,11] = self.range
+        packetBytes[:,12] = self.fullRes
+        packetBytes[:,-1] = packetBytes[:,2:-1].sum(axis=1,dtype=numpy.uint8)
+        self.send(packetBytes.tostring())
+
+
+class PtySimulator(object):
+    """
+    Serves a DeviceSimulator on a pseudo terminal. Keyword arguments are passed
+    to the DeviceSimulator.
+    """
+
+    def __init__(self,**kwarg):
+        import pty
+        import tty
+        self.sim = DeviceSimulator(**kwarg)
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.runner = None
+        self.running = threading.Event()
+
+    def start(self,process=False):
+        """
+        Starts the simulator in a thread, or in a child process if process is
+        True.
+        """
+        if process:
+            self.running = multiprocessing.Event()
+            self.runner = multiprocessing.Process(target=self.run)
+        else:
+            self.runner = threading.Thread(target=self.run)
+        self.runner.daemon = True
+        self.running.set()
+        self.sim.reset()
+        self.runner.start()
+
+    def stop(self):
+        """
+        Stops the simulator and closes the pty.
+        """
+        self.running.clear()
+        if self.runner is not None:
+            self.runner.join()
+            self.runner = None
+        os.close(self.master)
+        os.close(self.slave)
+
+    def run(self):
+        output = ''
+        while self.running.is_set():
+            readable, _, _ = select.select([self.master],[],[],POLL_DT)
+            if readable:
+                self.sim.handleInput(os.read(self.master,READ_SIZE))
+            output += self.sim.update(backlog=len(output))
+            if output:
+                _, writable, _ = select.select([],[self.master],[],0)
+                if writable:
+                    num = os.write(self.master,output)
+                    output = output[num:]
+
+
+class SimulatedPort(object):
+    """
+    An in process stand in for a serial port connected to a DeviceSimulator.
+    Keyword arguments are passed to the DeviceSimulator.
+    """
+
+    def __init__(self,**kwarg):
+        self.sim = DeviceSimulator(**kwarg)
+        self.buf = ''
+
+    def update(self):
+        self.buf += self.sim.update(backlog=len(self.buf))
+
+    def write(self,byteVals):
+        self.sim.handleInput(byteVals)
+
+    def inWaiting(self):
+        self.update()
+        return len(self.buf)
+
+    def read(self,size=1):
+        self.update()
+        byteVals, self.buf = self.buf[:size], self.buf[size:]
+        return byteVals
+
+    def flushInput(self):
+        self.update()
+        self.buf = ''
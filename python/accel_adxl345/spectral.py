@@ -0,0 +1,173 @@
+"""
+spectral.py
+
+This module defines the WelchPSD class which keeps a running Welch power
+spectral density estimate and a rolling spectrogram for each axis of a stream
+of accelerometer samples.
+
+Samples are added a chunk at a time with update. Every complete segment of
+segmentSize samples, overlapping the previous one by the given fraction, is
+windowed and transformed as soon as it is available, so the estimate is kept
+up to date as data arrives. All of the segments completed by a chunk are
+transformed together with one call to numpy.fft.rfft. The window and the
+segment buffer are allocated once.
+
+The density is scaled as scipy.signal.welch with scaling='density', i.e. in
+units^2/Hz with the one sided spectrum doubled, and by default matches it for
+the same data.
+"""
+import numpy
+from numpy.lib.stride_tricks import as_strided
+
+DEFAULT_OVERLAP = 0.5
+DEFAULT_SPECTROGRAM_SIZE = 100
+MAX_SEGMENTS = 64
+
+
+def hannWindow(size):
+    """
+    Returns the periodic Hann window of length size, as used for spectral
+    estimation by scipy.signal.get_window.
+    """
+    return 0.5 - 0.5*numpy.cos(2.0*numpy.pi*numpy.arange(size)/size)
+
+
+class WelchPSD(object):
+
+    def __init__(self,segmentSize,sampleRate,overlap=DEFAULT_OVERLAP,window=None,
+            decay=None,spectrogramSize=DEFAULT_SPECTROGRAM_SIZE):
+        """
+        Estimates the PSD of samples at sampleRate, in Hz, from segments of
+        segmentSize samples overlapping by the fraction overlap. The window
+        defaults to a Hann window. If decay is None the estimate is the mean
+        over all segments, otherwise each new segment is given weight decay in
+        an exponential average. The last spectrogramSize segment spectra are
+        kept for the spectrogram.
+        """
+        self.segmentSize = int(segmentSize)
+        self.sampleRate = float(sampleRate)
+        self.step = self.segmentSize - int(overlap*self.segmentSize)
+        if self.step < 1:
+            raise ValueError, 'overlap must be less than 1'
+        if window is None:
+            window = hannWindow(self.segmentSize)
+        self.window = numpy.asarray(window,dtype=float)[:,numpy.newaxis]
+        self.decay = decay
+        self.scale = 1.0/(self.sampleRate*(self.window**2).sum())
+        self.freq = numpy.fft.rfftfreq(self.segmentSize,1.0/self.sampleRate)
+        self.numFreq = self.freq.shape[0]
+
+        # One sided spectrum, every bin but DC and (for even sizes) Nyquist doubled
+        self.scaleFreq = numpy.zeros((self.numFreq,1)) + 2.0*self.scale
+        self.scaleFreq[0] = self.scale
+        if self.segmentSize % 2 == 0:
+            self.scaleFreq[-1] = self.scale
+
+        self.segBuf = numpy.empty((MAX_SEGMENTS,self.segmentSize,3))
+        self.spectrogram = numpy.zeros((spectrogramSize,self.numFreq,3))
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the estimate, spectrogram and any partial segment.
+        """
+        self.pending = numpy.zeros((0,3))
+        self.psd = numpy.zeros((self.numFreq,3))
+        self.numSegments = 0
+        self.numSamples = 0
+        self.specHead = 0
+
+    def update(self,data):
+        """
+        Adds the (N,3) array of samples, updating the estimate with each segment
+        they complete. Returns the number of new segments.
+        """
+        buf = numpy.concatenate((self.pending,data))
+        numNew = 0 if buf.shape[0] < self.segmentSize else (buf.shape[0] - self.segmentSize)//self.step + 1
+        self.numSamples += data.shape[0]
+        if numNew == 0:
+            self.pending = buf
+            return 0
+
+        # Overlapping segments as a view of the buffer, processed in batches
+        buf = numpy.ascontiguousarray(buf,dtype=float)
+        s0, s1 = buf.strides
+        segments = as_strided(buf,shape=(numNew,self.segmentSize,3),strides=(self.step*s0,s0,s1))
+        for i in range(0,numNew,MAX_SEGMENTS):
+            self.addSegments(segments[i:i+MAX_SEGMENTS])
+        self.pending = buf[numNew*self.step:].copy()
+        return numNew
+
+    def addSegments(self,segments):
+        num = segments.shape[0]
+        segBuf = self.segBuf[:num]
+        numpy.subtract(segments,segments.mean(axis=1)[:,numpy.newaxis,:],out=segBuf)
+        segBuf *= self.window
+        spectra = numpy.fft.rfft(segBuf,axis=1)
+        power = spectra.real**2 + spectra.imag**2
+        power *= self.scaleFreq
+
+        if self.decay is None:
+            total = self.numSegments + num
+            self.psd *= float(self.numSegments)/total
+            self.psd += power.sum(axis=0)/total
+        else:
+            for p in power:
+                if self.numSegments == 0:
+                    self.psd[:] = p
+                else:
+                    self.psd += self.decay*(p - self.psd)
+        self.numSegments += num
+
+        size = self.spectrogram.shape[0]
+        if num > size:
+            power = power[num-size:]
+        pos = numpy.arange(self.specHead,self.specHead+power.shape[0]) % size
+        self.spectrogram[pos] = power
+        self.specHead = (self.specHead + power.shape[0]) % size
+
+    def getPSD(self):
+        """
+        Returns the frequencies, in Hz, and the (numFreq,3) array of the power
+        spectral density of each axis.
+        """
+        return self.freq, self.psd.copy()
+
+    def getSpectrogram(self):
+        """
+        Returns the start times, in seconds, of the stored segments, the
+        frequencies and the (numSegments,numFreq,3) array of their spectra
+        ordered from oldest to newest.
+        """
+        size = self.spectrogram.shape[0]
+        num = min(self.numSegments,size)
+        pos = numpy.arange(self.specHead-num,self.specHead) % size
+        index = numpy.arange(self.numSegments-num,self.numSegments)
+        t = index*self.step/self.sampleRate
+        return t, self.freq, self.spectrogram[pos]
+
+    def getPeakFrequency(self,fMin=0.0,fMax=None):
+        """
+        Returns the frequency of the largest PSD value of each axis between
+        fMin and fMax.
+        """
+        mask = self.getBandMask(fMin,fMax)
+        freq = self.freq[mask]
+        return freq[self.psd[mask].argmax(axis=0)]
+
+    def getBandRMS(self,fMin=0.0,fMax=None):
+        """
+        Returns the RMS value of each axis in the band from fMin to fMax found
+        by integrating the PSD.
+        """
+        mask = self.getBandMask(fMin,fMax)
+        df = self.sampleRate/self.segmentSize
+        return numpy.sqrt(self.psd[mask].sum(axis=0)*df)
+
+    def getBandMask(self,fMin,fMax):
+        if fMax is None:
+            fMax = self.freq[-1]
+        mask = (self.freq >= fMin) & (self.freq <= fMax)
+        if not mask.any():
+            raise ValueError, 'no frequencies in band {0} to {1} Hz'.format(fMin,fMax)
+        return mask
@@ -0,0 +1,126 @@
+"""
+streaming.py
+
+This module defines the StreamReader class, a background thread which drains
+the serial port of an AccelADXL345 device while it is streaming and places the
+decoded samples, as SampleChunks with their start index and times, into a
+queue bounded by the number of samples it holds.
+
+After the first bytes of a read arrive the reader waits CHUNK_DT for more, so
+each chunk holds CHUNK_DT of samples rather than a frame or two. This keeps
+the per chunk overhead down and lets the queue cover long consumer stalls:
+DEFAULT_QUEUE_SIZE samples is over four minutes at 500 Hz and 40 s at the
+fastest rate.
+"""
+import threading
+import Queue
+
+DEFAULT_QUEUE_SIZE = 2**17
+EMPTY_WAIT_DT = 0.002
+CHUNK_DT = 0.02
+
+
+class StreamReader(threading.Thread):
+
+    def __init__(self,dev,queueSize=DEFAULT_QUEUE_SIZE):
+        """
+        Reader for the device, dev, holding up to queueSize samples in its
+        queue. Chunks which would overfill the queue are dropped and counted
+        as overruns.
+        """
+        super(StreamReader,self).__init__()
+        self.daemon = True
+        self.dev = dev
+        self.queue = Queue.Queue()
+        self.queueSize = queueSize
+        self.queuedSamples = 0
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.bytesRead = 0
+        self.samplesRead = 0
+        self.chunksRead = 0
+        self.overruns = 0
+        self.droppedSamples = 0
+
+    def run(self):
+        """
+        Reads from the device until stop is called. Blocks in read for the
+        first byte so the thread is idle when no data is arriving, then waits
+        CHUNK_DT for the rest of the chunk.
+        """
+        while not self.stopEvent.is_set():
+            numBytes = max(1,self.dev.inWaiting())
+            byteVals = self.dev.read(numBytes)
+            if not byteVals:
+                continue
+            self.stopEvent.wait(CHUNK_DT)
+            numBytes = self.dev.inWaiting()
+            if numBytes > 0:
+                byteVals += self.dev.read(numBytes)
+            self.bytesRead += len(byteVals)
+            data = self.dev.decoder.decode(byteVals)
+            if data.shape[0] == 0:
+                continue
+            start = self.dev.decoder.sampleIndex - data.shape[0]
+            chunk = self.dev.createChunk(data,start,self.dev.getTimes(start,data.shape[0]))
+            with self.lock:
+                full = self.queuedSamples + data.shape[0] > self.queueSize
+                if not full:
+                    self.queuedSamples += data.shape[0]
+            if full:
+                self.overruns += 1
+                self.droppedSamples += data.shape[0]
+                continue
+            self.queue.put(chunk)
+            self.samplesRead += data.shape[0]
+            self.chunksRead += 1
+
+    def stop(self):
+        """
+        Signals the thread to stop and waits for it to finish.
+        """
+        self.stopEvent.set()
+        if self.is_alive():
+            self.join()
+
+    def getChunk(self,timeout=None):
+        """
+        Returns the next chunk of samples from the queue. Blocks for up to
+        timeout seconds (forever if timeout is None) and returns None if no
+        chunk is available.
+        """
+        try:
+            chunk = self.queue.get(True,timeout)
+        except Queue.Empty:
+            return None
+        with self.lock:
+            self.queuedSamples -= len(chunk)
+        return chunk
+
+    def iterChunks(self,timeout=EMPTY_WAIT_DT):
+        """
+        Generator yielding chunks of samples until the reader has been stopped
+        and the queue is empty.
+        """
+        while True:
+            chunk = self.getChunk(timeout)
+            if chunk is not None:
+                yield chunk
+            elif not self.is_alive():
+                break
+
+    def getStats(self):
+        """
+        Returns a dictionary of the reader's counters.
+        """
+        return {
+                'bytes_read'      : self.bytesRead,
+                'samples_read'    : self.samplesRead,
+                'chunks_read'     : self.chunksRead,
+                'overruns'        : self.overruns,
+                'sync_errors'     : self.dev.decoder.syncErrors,
+                'skipped_bytes'   : self.dev.decoder.skippedBytes,
+                'lost_samples'    : self.dev.decoder.lostSamples,
+                'dropped_samples' : self.droppedSamples,
+                'queue_size'      : self.queuedSamples,
+                }
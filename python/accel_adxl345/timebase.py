@@ -0,0 +1,154 @@
+"""
+timebase.py
+
+This module defines the Timebase class which converts sample period indices
+into times using the timestamps sent by the firmware while streaming packed
+frames.
+
+Every TIMESTAMP_INTERVAL sample periods the firmware sends the value of its
+microsecond clock together with the sequence number of the sample period. Two
+straight lines are fitted online to these timestamps: the device clock against
+the sample period index, which gives the true sample interval as measured by
+the device clock, and the host clock, at the time each timestamp is decoded,
+against the device clock, which gives the offset and drift of the device clock
+relative to the host. Sample times then cost one multiply and add per sample.
+
+The host times include the serial and decoding latency so the fitted offset
+is late by the mean latency. The drift estimate is not affected by a constant
+latency, but jitter in the latency makes it noisy over short spans so it is
+only applied once the timestamps span MIN_DRIFT_SPAN seconds. Fits can be
+given a forgetting factor so that they follow slow changes in drift, e.g. with
+temperature, over long runs.
+"""
+import numpy
+
+MICROS_MOD = 2**32
+MIN_DRIFT_SPAN = 10.0
+
+
+class LinearFit(object):
+    """
+    Least squares fit of y = intercept + slope*x updated a point at a time. The
+    running means and co-moments are updated incrementally so the fit stays
+    accurate for large x. If forget is given each new point has this weight
+    relative to the total weight of the points before it.
+    """
+
+    def __init__(self,forget=None):
+        self.forget = forget
+        self.reset()
+
+    def reset(self):
+        self.numPoints = 0
+        self.weight = 0.0
+        self.meanX = 0.0
+        self.meanY = 0.0
+        self.cxx = 0.0
+        self.cxy = 0.0
+
+    def add(self,x,y):
+        if self.forget is not None and self.numPoints > 0:
+            decay = 1.0 - self.forget
+            self.weight *= decay
+            self.cxx *= decay
+            self.cxy *= decay
+        self.numPoints += 1
+        self.weight += 1.0
+        dx = x - self.meanX
+        self.meanX += dx/self.weight
+        self.meanY += (y - self.meanY)/self.weight
+        self.cxx += dx*(x - self.meanX)
+        self.cxy += dx*(y - self.meanY)
+
+    def isReady(self):
+        return self.numPoints >= 2 and self.cxx > 0
+
+    def getSlope(self):
+        return self.cxy/self.cxx
+
+    def getIntercept(self):
+        return self.meanY - self.getSlope()*self.meanX
+
+    def evaluate(self,x):
+        return self.meanY + self.getSlope()*(x - self.meanX)
+
+
+class Timebase(object):
+
+    def __init__(self,sampleDt,forget=None):
+        """
+        Converts sample period indices to times. The nominal sample interval,
+        sampleDt in microseconds, is used until enough timestamps have been
+        received to fit the device clock.
+        """
+        self.periodFit = LinearFit(forget)
+        self.clockFit = LinearFit(forget)
+        self.reset(sampleDt)
+
+    def reset(self,sampleDt=None):
+        """
+        Clears the fits, e.g. when streaming is restarted.
+        """
+        if sampleDt is not None:
+            self.sampleDt = float(sampleDt)
+        self.periodFit.reset()
+        self.clockFit.reset()
+        self.lastMicros = None
+        self.microsWraps = 0
+        self.hostTime0 = None
+        self.deviceSpan = 0.0
+
+    def addTimestamp(self,period,micros,hostTime):
+        """
+        Adds a timestamp: the device clock, micros, at the sample period with
+        the given index and the host time at which it was received.
+        """
+        if self.lastMicros is not None and micros < self.lastMicros:
+            self.microsWraps += 1
+        self.lastMicros = micros
+        deviceTime = 1.0e-6*(micros + self.microsWraps*MICROS_MOD)
+        if self.hostTime0 is None:
+            self.hostTime0 = hostTime
+            self.deviceTime0 = deviceTime
+        self.deviceSpan = deviceTime - self.deviceTime0
+        self.periodFit.add(period,deviceTime - self.deviceTime0)
+        self.clockFit.add(deviceTime - self.deviceTime0,hostTime - self.hostTime0)
+
+    def getNumTimestamps(self):
+        return self.periodFit.numPoints
+
+    def getSampleDt(self):
+        """
+        Returns the sample interval in microseconds of the device clock.
+        """
+        if self.periodFit.isReady():
+            return 1.0e6*self.periodFit.getSlope()
+        return self.sampleDt
+
+    def getDrift(self):
+        """
+        Returns the rate of the host clock relative to the device clock minus
+        one, e.g. 5.0e-5 if the device clock runs 50 ppm slow. Zero until the
+        timestamps span MIN_DRIFT_SPAN seconds.
+        """
+        if self.clockFit.isReady() and self.deviceSpan >= MIN_DRIFT_SPAN:
+            return self.clockFit.getSlope() - 1.0
+        return 0.0
+
+    def getTimes(self,periods):
+        """
+        Returns the times in seconds, on the host clock, of the sample periods
+        with the given indices relative to the start of streaming.
+        """
+        dtSec = 1.0e-6*self.getSampleDt()*(1.0 + self.getDrift())
+        return dtSec*numpy.asarray(periods,dtype=float)
+
+    def getHostTimes(self,periods):
+        """
+        Returns the host clock times, as from time.time, of the sample periods
+        with the given indices. Requires timestamps to have been received.
+        """
+        if not (self.periodFit.isReady() and self.clockFit.isReady()):
+            raise ValueError, 'not enough timestamps to fit host times'
+        deviceTime = self.periodFit.evaluate(numpy.asarray(periods,dtype=float))
+        return self.hostTime0 + self.clockFit.evaluate(deviceTime)
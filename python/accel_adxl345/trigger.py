@@ -0,0 +1,442 @@
+"""
+trigger.py
+
+This module defines the TriggerEngine class, which watches a stream of
+accelerometer samples for events, e.g. shocks, and returns only the windows of
+samples around them, and the triggers it uses: ThresholdTrigger, SlopeTrigger
+and BandEnergyTrigger.
+
+The engine keeps the last preTrigger raw samples in a SampleRingBuffer. When a
+trigger fires the event window is those samples, the sample at which the
+trigger fired and the samples following it up to postTrigger in all. Triggers
+firing within the window are part of the same event and the engine re-arms
+once the window is complete. Each trigger tests a whole chunk at once with
+numpy and keeps the state it needs between chunks, e.g. the previous sample
+or filter state, so processing a stream chunk by chunk gives the same events
+as processing all of it at once. Trigger levels are in m/s^2.
+
+Example:
+
+    engine = TriggerEngine(
+            [ThresholdTrigger(50.0,axis=AXIS_ANY), SlopeTrigger(2.0e4,dev.getSampleRate())],
+            preTrigger=200,
+            postTrigger=1000,
+            accelScale=dev.accelScale,
+            )
+    dev.startStreaming()
+    while True:
+        chunk = dev.readValues()
+        periods = dev.decoder.getPeriodIndex(chunk.start,len(chunk))
+        for event in engine.process(chunk,periods):
+            print event.triggerIndex, event.getNames(), event.chunk.times[0]
+"""
+import numpy
+from ring_buffer import SampleRingBuffer
+from sample_chunk import SampleChunk
+
+AXIS_X = 'x'
+AXIS_Y = 'y'
+AXIS_Z = 'z'
+AXIS_ANY = 'any'
+AXIS_MAGNITUDE = 'magnitude'
+AXIS_INDEX = {AXIS_X: 0, AXIS_Y: 1, AXIS_Z: 2}
+ALLOWED_AXIS = (AXIS_X, AXIS_Y, AXIS_Z, AXIS_ANY, AXIS_MAGNITUDE)
+
+
+def checkAxis(axis):
+    if axis not in ALLOWED_AXIS:
+        raise ValueError, 'unknown axis {0}'.format(axis)
+    return axis
+
+
+def selectAxis(data,axis):
+    """
+    Returns the column of the (N,3) array data for a single axis as an (N,1)
+    array, or data itself for AXIS_ANY and AXIS_MAGNITUDE.
+    """
+    if axis in AXIS_INDEX:
+        index = AXIS_INDEX[axis]
+        return data[:,index:index+1]
+    return data
+
+
+def sumSquares(data):
+    """
+    Returns the (N,) sum of squares of each row of the (N,K) array data.
+    """
+    return numpy.einsum('ij,ij->i',data,data)
+
+
+class Trigger(object):
+    """
+    Base class for triggers.
+    """
+
+    name = 'trigger'
+
+    def check(self,data):
+        """
+        Returns an (N,) bool array which is True for the samples of the (N,3)
+        float array data, in m/s^2, at which the trigger fires.
+        """
+        raise NotImplementedError
+
+    def reset(self):
+        """
+        Clears the state carried between chunks.
+        """
+        pass
+
+
+class ThresholdTrigger(Trigger):
+    """
+    Fires where the absolute value of the acceleration on an axis is at least
+    level. The axis is AXIS_X, AXIS_Y or AXIS_Z, AXIS_ANY for any of the three
+    or AXIS_MAGNITUDE for the vector magnitude. The offset, e.g. gravity on a
+    vertical axis or STANDARD_GRAVITY for the magnitude, is subtracted first.
+    """
+
+    name = 'threshold'
+
+    def __init__(self,level,axis=AXIS_ANY,offset=0.0):
+        self.level = float(level)
+        self.axis = checkAxis(axis)
+        self.offset = offset
+
+    def check(self,data):
+        if self.axis == AXIS_MAGNITUDE:
+            if self.offset == 0.0:
+                return sumSquares(data) >= self.level**2
+            return numpy.abs(numpy.sqrt(sumSquares(data)) - self.offset) >= self.level
+        values = selectAxis(data,self.axis)
+        if numpy.any(self.offset):
+            values = values - self.offset
+        return (numpy.abs(values) >= self.level).any(axis=1)
+
+
+class SlopeTrigger(Trigger):
+    """
+    Fires where the rate of change of the acceleration on an axis (as for
+    ThresholdTrigger) is at least level in m/s^3, i.e. on a sharp change
+    whatever the steady offset. The slope is the difference from the previous
+    sample times the sample rate in Hz.
+    """
+
+    name = 'slope'
+
+    def __init__(self,level,sampleRate,axis=AXIS_ANY):
+        self.level = float(level)
+        self.sampleRate = float(sampleRate)
+        self.axis = checkAxis(axis)
+        self.reset()
+
+    def reset(self):
+        self.last = None
+
+    def check(self,data):
+        num = data.shape[0]
+        if num == 0:
+            return numpy.zeros((0,),dtype=bool)
+        if self.axis == AXIS_MAGNITUDE:
+            values = numpy.sqrt(sumSquares(data))[:,numpy.newaxis]
+        else:
+            values = selectAxis(data,self.axis)
+        last = values[:1] if self.last is None else self.last
+        self.last = values[-1:].copy()
+        diff = numpy.diff(numpy.concatenate((last,values)),axis=0)
+        return (numpy.abs(diff) >= self.level/self.sampleRate).any(axis=1)
+
+
+class BandEnergyTrigger(Trigger):
+    """
+    Fires where the RMS acceleration in the frequency band from low to high Hz,
+    averaged over the last window samples, is at least level. The samples are
+    band pass filtered by a Butterworth filter of the given order, which
+    starts in the steady state for the first sample so a constant offset does
+    not fire it. For AXIS_ANY each axis is tested, for AXIS_MAGNITUDE the
+    energy is summed over the axes. Requires scipy.
+    """
+
+    name = 'band_energy'
+
+    def __init__(self,level,low,high,sampleRate,window,axis=AXIS_ANY,order=4):
+        import scipy.signal
+        from pipeline import SOSFilterStage
+        self.level = float(level)
+        self.window = int(window)
+        if self.window < 1:
+            raise ValueError, 'window must be >= 1'
+        self.axis = checkAxis(axis)
+        nyquist = 0.5*sampleRate
+        sos = scipy.signal.butter(order,[low/nyquist,high/nyquist],btype='bandpass',output='sos')
+        self.filter = SOSFilterStage(sos)
+        self.reset()
+
+    def reset(self):
+        self.filter.reset()
+        self.history = None
+
+    def check(self,data):
+        num = data.shape[0]
+        if num == 0:
+            return numpy.zeros((0,),dtype=bool)
+        filtered = self.filter.process(selectAxis(data,self.axis))
+        energy = filtered**2
+        if self.axis == AXIS_MAGNITUDE:
+            energy = energy.sum(axis=1)[:,numpy.newaxis]
+        if self.history is None:
+            self.history = numpy.zeros((self.window,energy.shape[1]))
+        # Moving sum over the window from the cumulative sum of the previous
+        # window samples followed by the chunk
+        energy = numpy.concatenate((self.history,energy))
+        total = numpy.cumsum(energy,axis=0)
+        moving = total[self.window:] - total[:num]
+        self.history = energy[num:]
+        return (moving >= self.window*self.level**2).any(axis=1)
+
+
+class TriggerEvent(object):
+
+    def __init__(self,chunk,triggerIndex,triggers,complete=True):
+        """
+        An event window: chunk is the SampleChunk of its samples, with start
+        the index of the first, triggerIndex the index of the sample at which
+        it was triggered and triggers the list of the triggers which fired
+        there. The window is complete unless the stream broke or was flushed
+        before postTrigger samples arrived.
+        """
+        self.chunk = chunk
+        self.triggerIndex = triggerIndex
+        self.triggers = triggers
+        self.complete = complete
+
+    def __repr__(self):
+        return 'TriggerEvent(trigger={0}, start={1}, num={2}, triggers={3})'.format(
+                self.triggerIndex,self.chunk.start,len(self.chunk),self.getNames())
+
+    def getNames(self):
+        return [trigger.name for trigger in self.triggers]
+
+    def getPreTrigger(self):
+        """
+        Returns the number of samples in the window before the trigger.
+        """
+        return self.triggerIndex - self.chunk.start
+
+
+class TriggerEngine(object):
+
+    def __init__(self,triggers,preTrigger,postTrigger,accelScale,accelRange=None):
+        """
+        Watches a stream of raw samples for any of the list of triggers firing
+        and returns event windows of up to preTrigger samples before the
+        trigger and postTrigger samples from it. Raw samples are converted to
+        m/s^2 by multiplying by accelScale for the triggers, or by the
+        calibration of the chunks if they have one.
+        """
+        if postTrigger < 1:
+            raise ValueError, 'postTrigger must be >= 1'
+        self.triggers = list(triggers)
+        if not self.triggers:
+            raise ValueError, 'no triggers'
+        self.preTrigger = int(preTrigger)
+        self.postTrigger = int(postTrigger)
+        self.accelScale = accelScale
+        self.accelRange = accelRange
+        self.calibration = None
+        self.ring = SampleRingBuffer(self.preTrigger) if self.preTrigger > 0 else None
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the pre-trigger ring, any event in progress, the triggers'
+        state and the counters.
+        """
+        for trigger in self.triggers:
+            trigger.reset()
+        if self.ring is not None:
+            self.ring.clear()
+        self.nextIndex = None
+        self.nextPeriod = None
+        self.ringTimes = numpy.zeros((0,))
+        self.eventData = None
+        self.eventTimes = None
+        self.eventStart = 0
+        self.eventTrigger = None
+        self.remaining = 0
+        self.samplesIn = 0
+        self.samplesOut = 0
+        self.numEvents = 0
+
+    def isActive(self):
+        """
+        Returns True if an event window is being collected.
+        """
+        return self.eventData is not None
+
+    def process(self,chunk,periods=None):
+        """
+        Processes the next chunk of samples, a SampleChunk or (N,3) int16 array,
+        and returns the list of TriggerEvents completed by it. If the chunk
+        has times they are kept for the event windows. If a chunk does not
+        follow on from the last, by its start index, the pre-trigger ring is
+        cleared and any event in progress is returned incomplete.
+
+        Samples lost in transit or discarded by the device trigger are only
+        seen as breaks if periods, the (N,) array of the sample period index
+        of each sample, is given, e.g. from
+        dev.decoder.getPeriodIndex(chunk.start,len(chunk)).
+        """
+        events = []
+        if not isinstance(chunk,SampleChunk):
+            raw = numpy.asarray(chunk)
+            start = 0 if self.nextIndex is None else self.nextIndex
+            chunk = SampleChunk(raw,self.accelScale,start=start,accelRange=self.accelRange,
+                    calibration=self.calibration)
+        elif self.nextIndex is not None and chunk.start != self.nextIndex:
+            self.breakStream(events)
+        self.nextIndex = chunk.end
+        self.calibration = chunk.calibration
+        self.samplesIn += len(chunk)
+        if len(chunk) == 0:
+            return events
+        if periods is None:
+            self.processRun(chunk,events)
+            return events
+
+        periods = numpy.asarray(periods)
+        if self.nextPeriod is not None and periods[0] != self.nextPeriod:
+            self.breakStream(events)
+        self.nextPeriod = periods[-1] + 1
+        breaks = numpy.flatnonzero(numpy.diff(periods) != 1) + 1
+        pos = 0
+        for index in list(breaks) + [len(chunk)]:
+            if pos > 0:
+                self.breakStream(events)
+            self.processRun(chunk[pos:index],events)
+            pos = index
+        return events
+
+    def breakStream(self,events):
+        """
+        Ends any event in progress and clears the pre-trigger ring and the
+        triggers' state at a break in the stream.
+        """
+        self.flush(events)
+        if self.ring is not None:
+            self.ring.clear()
+        self.ringTimes = numpy.zeros((0,))
+        for trigger in self.triggers:
+            trigger.reset()
+
+    def writeRing(self,raw,times):
+        """
+        Adds samples, and their times if known, to the pre-trigger ring.
+        """
+        if self.ring is None:
+            return
+        self.ring.write(raw)
+        if times is None or self.ringTimes is None:
+            self.ringTimes = None
+        else:
+            self.ringTimes = numpy.concatenate((self.ringTimes,times))[-self.preTrigger:]
+
+    def processRun(self,chunk,events):
+        """
+        Processes a SampleChunk which follows on from the last, appending the
+        events completed to the list events.
+        """
+        raw = chunk.raw
+        times = chunk.times
+        start = chunk.start
+        num = raw.shape[0]
+        accel = chunk.getAccel()
+        masks = [trigger.check(accel) for trigger in self.triggers]
+        fired = masks[0] if len(masks) == 1 else numpy.logical_or.reduce(masks)
+
+        pos = 0
+        ringPos = 0
+        while pos < num:
+            if self.eventData is not None:
+                take = min(self.remaining,num - pos)
+                self.eventData.append(raw[pos:pos+take].copy())
+                if times is None or self.eventTimes is None:
+                    self.eventTimes = None
+                else:
+                    self.eventTimes.append(times[pos:pos+take])
+                self.remaining -= take
+                pos += take
+                if self.remaining == 0:
+                    events.append(self.finishEvent(True))
+                continue
+            hits = numpy.flatnonzero(fired[pos:])
+            if hits.shape[0] == 0:
+                break
+            index = pos + hits[0]
+            self.writeRing(raw[ringPos:index],None if times is None else times[ringPos:index])
+            ringPos = index
+            if self.ring is not None:
+                pre = self.ring.getData()
+            else:
+                pre = raw[:0]
+            self.eventData = [pre]
+            self.eventTimes = None
+            if self.ring is None:
+                self.eventTimes = []
+            elif self.ringTimes is not None and self.ringTimes.shape[0] == pre.shape[0]:
+                self.eventTimes = [self.ringTimes]
+            self.eventStart = start + index - pre.shape[0]
+            self.eventTrigger = (start + index,[t for t, m in zip(self.triggers,masks) if m[index]])
+            self.remaining = self.postTrigger
+            pos = index
+        self.writeRing(raw[ringPos:],None if times is None else times[ringPos:])
+
+    def flush(self,events=None):
+        """
+        Ends any event in progress, e.g. when streaming stops, and returns the
+        list of events, holding the incomplete event if there was one.
+        """
+        if events is None:
+            events = []
+        if self.eventData is not None:
+            events.append(self.finishEvent(False))
+        return events
+
+    def finishEvent(self,complete):
+        data = numpy.concatenate(self.eventData)
+        times = None
+        if self.eventTimes is not None:
+            times = numpy.concatenate(self.eventTimes)
+        chunk = SampleChunk(data,self.accelScale,start=self.eventStart,times=times,accelRange=self.accelRange,
+                calibration=self.calibration)
+        index, triggers = self.eventTrigger
+        self.eventData = None
+        self.eventTimes = None
+        self.eventTrigger = None
+        self.remaining = 0
+        self.samplesOut += data.shape[0]
+        self.numEvents += 1
+        return TriggerEvent(chunk,index,triggers,complete)
+
+    def iterate(self,chunks):
+        """
+        Generator yielding the events for an iterable of chunks, e.g.
+        AccelADXL345.iterChunks. Any event in progress at the end is yielded
+        incomplete.
+        """
+        for chunk in chunks:
+            for event in self.process(chunk):
+                yield event
+        for event in self.flush():
+            yield event
+
+    def getStats(self):
+        """
+        Returns a dictionary of the samples processed, events and samples in
+        event windows.
+        """
+        return {
+                'samples_in'  : self.samplesIn,
+                'samples_out' : self.samplesOut,
+                'events'      : self.numEvents,
+                }
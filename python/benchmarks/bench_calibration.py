@@ -0,0 +1,95 @@
+"""
+bench_calibration.py - checks the calibration fit against a simulated sensor
+with known offsets, scale errors and misalignment, for 6 orientations (offset
+and scale only) and for more orientations with the misalignment, and measures
+the cost per chunk of applying a calibration compared with the nominal scale.
+
+usage: python bench_calibration.py [noise] [chunk_size]
+"""
+import sys
+import time
+import numpy
+from accel_adxl345 import ACCEL_SCALE
+from accel_adxl345.sample_chunk import SampleChunk
+from accel_adxl345.sample_chunk import STANDARD_GRAVITY
+from accel_adxl345.calibration import CalibrationFitter
+
+NUM_SAMPLES = 1000
+NUM_TEST = 1000
+NUM_REPEAT = 2000
+SIX_ORIENTATIONS = ((1,0,0),(-1,0,0),(0,1,0),(0,-1,0),(0,0,1),(0,0,-1))
+
+
+def createSensor(random):
+    """
+    Returns the matrix and offset of a simulated sensor with 3% scale errors,
+    1% misalignment and offsets of 10 counts.
+    """
+    matrix = numpy.diag(ACCEL_SCALE*(1.0 + random.normal(0,0.03,3)))
+    matrix[numpy.triu_indices(3,1)] = ACCEL_SCALE*random.normal(0,0.01,3)
+    return matrix, random.normal(0,10.0,3)
+
+
+def capture(matrix,offset,direction,num,noise,random):
+    accel = STANDARD_GRAVITY*numpy.asarray(direction,dtype=float)/numpy.linalg.norm(direction)
+    raw = numpy.dot(numpy.linalg.inv(matrix),accel) + offset
+    return (raw + random.normal(0,noise,(num,3))).round().astype(numpy.int16)
+
+
+def gravityError(matrix,offset,scale,calibration,noise,random):
+    """
+    Returns the RMS error in m/s^2 of the magnitude of gravity in random
+    orientations, averaged over NUM_SAMPLES samples, with and without the
+    calibration.
+    """
+    calibrated = numpy.zeros((NUM_TEST,))
+    nominal = numpy.zeros((NUM_TEST,))
+    for i in range(NUM_TEST):
+        raw = capture(matrix,offset,random.normal(size=3),NUM_SAMPLES,noise,random).mean(axis=0)
+        calibrated[i] = numpy.linalg.norm(calibration.apply(raw[numpy.newaxis]))
+        nominal[i] = numpy.linalg.norm(scale*raw)
+    rms = lambda x: numpy.sqrt(((x - STANDARD_GRAVITY)**2).mean())
+    return rms(calibrated), rms(nominal)
+
+
+if __name__ == '__main__':
+
+    noise = 2.0
+    chunkSize = 160
+    if len(sys.argv) > 1:
+        noise = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        chunkSize = int(sys.argv[2])
+
+    random = numpy.random.RandomState(0)
+    matrix, offset = createSensor(random)
+    print 'orientations   misalignment   residual   matrix error (%)   offset error   gravity error   nominal'
+    for num in (6, 12, 24):
+        fitter = CalibrationFitter()
+        directions = list(SIX_ORIENTATIONS) + [random.normal(size=3) for i in range(num-6)]
+        for direction in directions:
+            fitter.addCapture(capture(matrix,offset,direction,NUM_SAMPLES,noise,random))
+        calibration = fitter.fit(ACCEL_SCALE)
+        misalignment = num >= 9
+        if misalignment:
+            matrixError = numpy.abs(calibration.matrix - matrix).max()
+        else:
+            matrixError = numpy.abs(numpy.diag(calibration.matrix) - numpy.diag(matrix)).max()
+        offsetError = numpy.abs(calibration.offset - offset).max()
+        calibrated, nominal = gravityError(matrix,offset,ACCEL_SCALE,calibration,noise,random)
+        print ' %12d   %12s   %8.5f   %16.3f   %12.3f   %13.4f   %7.4f'%(num,misalignment,calibration.residual,
+                100.0*matrixError/ACCEL_SCALE,offsetError,calibrated,nominal)
+
+    raw = random.normal(0,200,(chunkSize,3)).astype(numpy.int16)
+    out = numpy.empty((chunkSize,3))
+    cases = (
+            ('nominal scale', lambda: SampleChunk(raw,ACCEL_SCALE).getAccel()),
+            ('calibrated', lambda: SampleChunk(raw,ACCEL_SCALE,calibration=calibration).getAccel()),
+            ('calibrated, out', lambda: calibration.apply(raw,out=out)),
+            )
+    print 'chunk of %d samples    time (us)'%(chunkSize,)
+    for name, func in cases:
+        t0 = time.time()
+        for i in range(NUM_REPEAT):
+            func()
+        print '  %-20s %9.2f'%(name,1.0e6*(time.time() - t0)/NUM_REPEAT)
@@ -0,0 +1,63 @@
+"""
+bench_capture.py - compares saving a capture as text with savetxt, as the GUI
+did, against writing it in chunks to a binary capture file. Reports the file
+sizes and the time to write and read back each one, and checks that the
+memory mapped capture matches the original samples.
+
+usage: python bench_capture.py [num_samples]
+"""
+import os
+import sys
+import time
+import tempfile
+import numpy
+from accel_adxl345 import CaptureWriter, CaptureFile, ACCEL_SCALE
+
+CHUNK_SIZE = 500
+SAMPLE_DT = 2000.0
+
+
+def main(num):
+    raw = numpy.random.randint(-512,512,(num,3)).astype(numpy.int16)
+    tmpDir = tempfile.mkdtemp()
+    txtFilename = os.path.join(tmpDir,'capture.txt')
+    capFilename = os.path.join(tmpDir,'capture.adxl')
+
+    t0 = time.time()
+    t = SAMPLE_DT*1.0e-6*numpy.arange(num).reshape((num,1))
+    numpy.savetxt(txtFilename,numpy.concatenate((t,ACCEL_SCALE*raw),axis=1))
+    txtWrite = time.time() - t0
+    t0 = time.time()
+    numpy.loadtxt(txtFilename)
+    txtRead = time.time() - t0
+
+    t0 = time.time()
+    with CaptureWriter(capFilename,16,ACCEL_SCALE,SAMPLE_DT,'bench') as capture:
+        for i in range(0,num,CHUNK_SIZE):
+            capture.write(raw[i:i+CHUNK_SIZE])
+    capWrite = time.time() - t0
+    t0 = time.time()
+    capFile = CaptureFile(capFilename)
+    capRead = time.time() - t0
+
+    assert len(capFile) == num
+    assert (capFile.data == raw).all()
+    assert capFile.deviceId == 'bench'
+
+    print 'samples:  {0}'.format(num)
+    print 'text:     {0:8.1f} kB  write {1:.3f} s  read {2:.3f} s'.format(
+            os.path.getsize(txtFilename)/1024.0, txtWrite, txtRead)
+    print 'capture:  {0:8.1f} kB  write {1:.3f} s  open {2:.3f} s'.format(
+            os.path.getsize(capFilename)/1024.0, capWrite, capRead)
+
+    del capFile
+    os.remove(txtFilename)
+    os.remove(capFilename)
+    os.rmdir(tmpDir)
+
+
+if __name__ == '__main__':
+    num = 100000
+    if len(sys.argv) > 1:
+        num = int(sys.argv[1])
+    main(num)
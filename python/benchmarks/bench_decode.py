@@ -0,0 +1,76 @@
+"""
+bench_decode.py - checks that the vectorized frame decoder produces exactly
+the same samples as the original per-sample struct loop and compares the time
+taken by each.
+
+usage: python bench_decode.py [recorded_stream.bin]
+
+If a file is given it should contain raw bytes recorded from the device while
+streaming, otherwise a random stream is generated.
+"""
+import sys
+import time
+import struct
+import numpy
+from accel_adxl345.frame_decoder import FrameDecoder
+
+NUM_FRAMES = 200000
+MAX_READ_SIZE = 400
+
+
+def legacyDecode(byteVals):
+    """
+    Original readValues loop, reading 7 bytes at a time from the stream
+    """
+    data = []
+    pos = 0
+    while len(byteVals) - pos >= 7:
+        frame = byteVals[pos:pos+7]
+        pos += 7
+        ax = struct.unpack('<h',frame[0:2])[0]
+        ay = struct.unpack('<h',frame[2:4])[0]
+        az = struct.unpack('<h',frame[4:6])[0]
+        chk = ord(frame[6])
+        if not chk == 0:
+            raise IOError, 'streaming data is not in sync.'
+        data.append([ax,ay,az])
+    return data
+
+
+def randomStream(numFrames):
+    frames = numpy.zeros((numFrames,4),dtype='<i2')
+    frames[:,:3] = numpy.random.randint(-4096,4096,(numFrames,3))
+    frames = frames.tostring()
+    # Drop last byte of each 8 byte record to get 7 byte frames
+    frames = numpy.frombuffer(frames,dtype='u1').reshape((numFrames,8))
+    return frames[:,:7].tostring()
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        stream = open(sys.argv[1],'rb').read()
+    else:
+        stream = randomStream(NUM_FRAMES)
+
+    # Split stream into reads of random size to exercise partial frames 
+    sizes = numpy.random.randint(0,MAX_READ_SIZE,len(stream)//(MAX_READ_SIZE//2)+1)
+    bounds = numpy.concatenate(([0],numpy.cumsum(sizes)))
+    bounds = bounds[bounds < len(stream)].tolist() + [len(stream)]
+    reads = [stream[i:j] for i,j in zip(bounds[:-1],bounds[1:])]
+
+    t0 = time.time()
+    legacy = numpy.array(legacyDecode(stream),dtype=numpy.int16).reshape((-1,3))
+    legacyTime = time.time() - t0
+
+    decoder = FrameDecoder()
+    t0 = time.time()
+    chunks = [decoder.decode(x) for x in reads]
+    vectorTime = time.time() - t0
+    vector = numpy.concatenate(chunks)
+
+    assert vector.shape == legacy.shape, 'shape mismatch'
+    assert vector.tostring() == legacy.tostring(), 'samples differ'
+    print 'decoded %d samples, outputs identical'%(vector.shape[0],)
+    print 'legacy loop:  %1.3f s'%(legacyTime,)
+    print 'vectorized:   %1.3f s (%d reads)'%(vectorTime,len(reads))
@@ -0,0 +1,70 @@
+"""
+bench_firmware_rate.py - checks that the firmware can stream at its minimum
+timer period without dropping samples at each of the fast baud rates. The
+simulator models the firmware sample buffer and sends the streaming data no
+faster than the baud rate, so a sample rate the serial link cannot sustain
+fills the buffer and samples are dropped. Runs in simulated time. As a
+control, each case is also run with the timer period 10% below the time the
+link takes to send a sample, where drops are expected.
+
+usage: python bench_firmware_rate.py [duration] [buffer_size]
+"""
+import sys
+from accel_adxl345.frame_decoder import FRAME_LEGACY
+from accel_adxl345.frame_decoder import FRAME_PACKED
+from accel_adxl345.frame_decoder import createDecoder
+from accel_adxl345.simulator import DeviceSimulator
+from accel_adxl345.simulator import FAST_BAUD_RATE
+from accel_adxl345.accel_adxl345 import ALLOWED_BAUD_RATE
+
+# Estimated buffer capacity in samples from the free RAM of an ATmega328
+BUFFER_SIZE = 120
+POLL_DT = 0.001
+FORMAT_NAME = {FRAME_LEGACY: 'legacy', FRAME_PACKED: 'packed'}
+
+
+def run(baudRate,frameFormat,timerPeriod,duration,bufferSize):
+    """
+    Streams for duration simulated seconds and returns the number of samples
+    taken, dropped by the firmware and decoded by the host.
+    """
+    sim = DeviceSimulator(bufferSize=bufferSize,seed=0)
+    sim.baudRate = baudRate
+    sim.frameFormat = frameFormat
+    sim.timerPeriod = timerPeriod
+    sim.handleCmd([1],0.0)
+    decoder = createDecoder(frameFormat)
+    count = 0
+    now = 0.0
+    while now < duration:
+        now += POLL_DT
+        count += decoder.decode(sim.update(now)).shape[0]
+    return sim.sampleCount, sim.badSampleCount, count
+
+
+if __name__ == '__main__':
+
+    duration = 20.0
+    bufferSize = BUFFER_SIZE
+    if len(sys.argv) > 1:
+        duration = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        bufferSize = int(sys.argv[2])
+
+    failed = False
+    print '    baud   format   period (us)   rate (Hz)   taken   dropped   control dropped'
+    for baudRate in [x for x in ALLOWED_BAUD_RATE if x >= FAST_BAUD_RATE]:
+        for frameFormat in (FRAME_LEGACY, FRAME_PACKED):
+            sim = DeviceSimulator()
+            sim.baudRate = baudRate
+            sim.frameFormat = frameFormat
+            period = sim.getMinTimerPeriod()
+            linkPeriod = 1.0e6*sim.getBytesPerSample()*10/baudRate
+            taken, dropped, decoded = run(baudRate,frameFormat,period,duration,bufferSize)
+            _, controlDropped, _ = run(baudRate,frameFormat,int(0.9*linkPeriod),duration,bufferSize)
+            print ' %7d   %6s   %11d   %9.1f   %5d   %7d   %15d'%(baudRate,FORMAT_NAME[frameFormat],
+                    period,1.0e6/period,taken,dropped,controlDropped)
+            if dropped > 0 or controlDropped == 0:
+                failed = True
+    assert not failed, 'samples dropped at the minimum timer period'
+    print 'no samples dropped at the minimum timer period'
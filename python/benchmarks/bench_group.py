@@ -0,0 +1,49 @@
+"""
+bench_group.py - measures the throughput of a DeviceGroup reading from an
+increasing number of simulated devices, each streaming at its maximum rate.
+The simulated devices run in child processes so the cpu time reported is
+that of the host code alone.
+
+usage: python bench_group.py [max_devices] [duration]
+"""
+import sys
+import time
+from accel_adxl345.device_group import DeviceGroup
+from accel_adxl345.simulator import PtySimulator
+
+RESET_DELAY = 0.1
+
+if __name__ == '__main__':
+
+    maxDevices = 12
+    duration = 2.0
+    if len(sys.argv) > 1:
+        maxDevices = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        duration = float(sys.argv[2])
+
+    numList = [n for n in (1,2,4,8,12,16,24) if n <= maxDevices]
+    print ' devices   connect (s)   skew (us)   samples/s   cpu/sample (us)'
+    for num in numList:
+        fakes = [PtySimulator() for i in range(num)]
+        for fake in fakes:
+            fake.start(process=True)
+
+        t0 = time.time()
+        group = DeviceGroup([fake.port for fake in fakes],reset_delay=RESET_DELAY)
+        group.connect()
+        connectTime = time.time() - t0
+
+        count = 0
+        group.startStreaming()
+        c0 = time.clock()
+        for port, chunk in group.stream(duration):
+            count += chunk.shape[0]
+        cpu = time.clock() - c0
+        skew = group.getSkew()
+        group.stopStreaming()
+        group.close()
+        for fake in fakes:
+            fake.stop()
+
+        print ' %7d   %11.3f   %9.1f   %9.0f   %15.2f'%(num,connectTime,1.0e6*skew,count/duration,1.0e6*cpu/max(count,1))
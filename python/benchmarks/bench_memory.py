@@ -0,0 +1,113 @@
+"""
+bench_memory.py - reports the peak resident memory while streaming a long
+acquisition into a SampleRingBuffer and, for comparison, while accumulating
+all of the samples as a list of SampleChunks holding the raw int16 data and
+in a python list as the original getSamples did. Peak memory only grows, so
+the approaches are run in order of increasing memory use.
+
+The data comes from a fake port which produces 7 byte frames at the sample
+rate in simulated time so a 10 minute capture runs in a few seconds.
+
+usage: python bench_memory.py [duration_min] [sample_rate]
+"""
+import sys
+import resource
+import numpy
+from accel_adxl345.frame_decoder import FrameDecoder, FRAME_SIZE
+from accel_adxl345 import SampleRingBuffer
+from accel_adxl345 import SampleChunk
+from accel_adxl345 import ACCEL_SCALE
+
+POLL_DT = 0.02
+RING_CAPACITY = 10000
+
+
+class FakePort(object):
+    """
+    Produces streaming frames at sampleRate in simulated time. Each call to
+    tick advances the clock by POLL_DT.
+    """
+
+    def __init__(self,sampleRate):
+        self.sampleRate = sampleRate
+        self.t = 0.0
+        self.sent = 0
+        self.waiting = 0
+        block = numpy.zeros((1000,4),dtype='<i2')
+        block[:,:3] = numpy.random.randint(-512,512,(1000,3))
+        block = numpy.frombuffer(block.tostring(),dtype='u1').reshape((1000,8))
+        self.block = block[:,:FRAME_SIZE].tostring()*2
+
+    def tick(self):
+        self.t += POLL_DT
+        total = int(self.t*self.sampleRate)*FRAME_SIZE
+        self.waiting = total - self.sent
+
+    def inWaiting(self):
+        return self.waiting
+
+    def read(self,size):
+        pos = self.sent % (len(self.block)//2)
+        size = min(size,self.waiting)
+        self.sent += size
+        self.waiting -= size
+        return self.block[pos:pos+size]
+
+    def readinto(self,b):
+        byteVals = self.read(len(b))
+        b[:len(byteVals)] = byteVals
+        return len(byteVals)
+
+
+def maxRSS():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+
+if __name__ == '__main__':
+
+    durationMin = 10.0
+    sampleRate = 500.0
+    if len(sys.argv) > 1:
+        durationMin = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        sampleRate = float(sys.argv[2])
+
+    print 'ring buffer, capacity %d'%(RING_CAPACITY,)
+    port = FakePort(sampleRate)
+    decoder = FrameDecoder()
+    ring = SampleRingBuffer(RING_CAPACITY)
+    minute = 1
+    while port.t < 60*durationMin:
+        port.tick()
+        decoder.readIntoRing(port,ring)
+        if port.t >= 60*minute:
+            print '  t = %2d min, samples = %8d, peak RSS = %1.1f MB'%(minute,ring.count,maxRSS())
+            minute += 1
+
+    print 'list of SampleChunks'
+    port = FakePort(sampleRate)
+    decoder = FrameDecoder()
+    chunks = []
+    count = 0
+    minute = 1
+    while port.t < 60*durationMin:
+        port.tick()
+        data = decoder.decode(port.read(port.inWaiting()))
+        chunks.append(SampleChunk(data,ACCEL_SCALE,start=count))
+        count += data.shape[0]
+        if port.t >= 60*minute:
+            print '  t = %2d min, samples = %8d, peak RSS = %1.1f MB'%(minute,count,maxRSS())
+            minute += 1
+    chunks = None
+
+    print 'python list (original getSamples)'
+    port = FakePort(sampleRate)
+    decoder = FrameDecoder()
+    data = []
+    minute = 1
+    while port.t < 60*durationMin:
+        port.tick()
+        data.extend(decoder.decode(port.read(port.inWaiting())).tolist())
+        if port.t >= 60*minute:
+            print '  t = %2d min, samples = %8d, peak RSS = %1.1f MB'%(minute,len(data),maxRSS())
+            minute += 1
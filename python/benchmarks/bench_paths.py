@@ -0,0 +1,156 @@
+"""
+bench_paths.py - benchmarks each of the host acquisition paths against the
+firmware simulator streaming at its maximum sample rate. For each path it
+reports the sustained sample rate, the host cpu time per sample and the time
+taken to decode each block of bytes read. The sample rate is averaged over
+the whole call, including starting and stopping streaming.
+
+The simulator runs in a child process on a pty so the cpu time reported is
+that of the host code alone, including any reader threads.
+
+usage: python bench_paths.py [duration] [frame_format] [noise] [bad_sample_prob]
+"""
+import sys
+import time
+import resource
+import numpy
+from accel_adxl345 import AccelADXL345
+from accel_adxl345 import AsyncAccelADXL345
+from accel_adxl345 import SampleRingBuffer
+from accel_adxl345.frame_decoder import FRAME_LEGACY
+from accel_adxl345.simulator import PtySimulator
+
+BAUD_RATE = 1000000
+RING_CAPACITY = 10000
+
+
+def cpuTime():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def timeDecoder(decoder):
+    """
+    Wraps the decoder's decodeBytes method to record the time of each call.
+    Returns the list the times are appended to.
+    """
+    times = []
+    decodeBytes = decoder.decodeBytes
+    def timedDecodeBytes(*args):
+        t0 = time.time()
+        value = decodeBytes(*args)
+        times.append(time.time() - t0)
+        return value
+    decoder.decodeBytes = timedDecodeBytes
+    return times
+
+
+def getSamplesPath(dev,duration):
+    N = int(duration*1.0e6/dev.sampleDt)
+    t, data = dev.getSamples(N,raw=True)
+    return data.shape[0]
+
+
+def pollPath(dev,duration):
+    count = 0
+    dev.emptyBuffer()
+    dev.startStreaming()
+    t0 = time.time()
+    while time.time() - t0 < duration:
+        if dev.inWaiting() > 0:
+            count += dev.readValues().shape[0]
+    dev.stopStreaming()
+    dev.emptyBuffer()
+    return count
+
+
+def ringPath(dev,duration):
+    ring = SampleRingBuffer(RING_CAPACITY)
+    return dev.streamToRing(ring,duration)
+
+
+def backgroundPath(dev,duration):
+    count = 0
+    dev.emptyBuffer()
+    dev.startStreaming(background=True)
+    t0 = time.time()
+    while time.time() - t0 < duration:
+        chunk = dev.getChunk(timeout=0.1)
+        if chunk is not None:
+            count += chunk.shape[0]
+    dev.stopStreaming()
+    dev.emptyBuffer()
+    return count
+
+
+def asyncPath(dev,duration):
+    count = 0
+    dev.startStreaming()
+    for chunk in dev.stream(duration):
+        count += chunk.shape[0]
+    dev.loop.runUntilComplete(dev.stopStreaming())
+    return count
+
+
+def runPath(name,func,frameFormat,duration,simKwarg):
+    sim = PtySimulator(**simKwarg)
+    sim.start(process=True)
+    try:
+        if func is asyncPath:
+            dev = AsyncAccelADXL345(port=sim.port,reset_delay=0.0)
+            dev.loop.runUntilComplete(dev.connect())
+        else:
+            dev = AccelADXL345(
+                    port=sim.port,
+                    reset_sleep=False,
+                    negotiate_baudrate=BAUD_RATE,
+                    frame_format=frameFormat,
+                    )
+        dev.setSampleDt(dev.minSampleDt)
+        times = timeDecoder(dev.decoder)
+        c0 = cpuTime()
+        t0 = time.time()
+        count = func(dev,duration)
+        elapsed = time.time() - t0
+        cpu = cpuTime() - c0
+        dev.close()
+    finally:
+        sim.stop()
+    times = 1.0e6*numpy.array(times or [0.0])
+    print '  %-12s %9.0f %15.2f %12.1f %12.1f'%(
+            name,
+            count/elapsed,
+            1.0e6*cpu/max(count,1),
+            times.mean(),
+            numpy.percentile(times,99),
+            )
+
+
+if __name__ == '__main__':
+
+    duration = 2.0
+    frameFormat = FRAME_LEGACY
+    simKwarg = {'noise': 2.0}
+    if len(sys.argv) > 1:
+        duration = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        frameFormat = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        simKwarg['noise'] = float(sys.argv[3])
+    if len(sys.argv) > 4:
+        simKwarg['badSampleProb'] = float(sys.argv[4])
+
+    paths = [
+            ('getSamples', getSamplesPath),
+            ('poll', pollPath),
+            ('ring', ringPath),
+            ('background', backgroundPath),
+            ]
+    if frameFormat == FRAME_LEGACY:
+        # The async client only supports the legacy format at the default baud
+        # rate, so its sample rate is lower than the other paths.
+        paths.append(('async', asyncPath))
+
+    print '  path         samples/s  cpu/sample (us)  decode (us)  p99 (us)'
+    for name, func in paths:
+        runPath(name,func,frameFormat,duration,simKwarg)
@@ -0,0 +1,64 @@
+"""
+bench_peek.py - compares the round trip latency of polling single samples
+with the line parsed get_sample command and with the binary peek command,
+returning a tuple or filling a reused array. Reports the mean, p50 and p99
+round trip times and the polling rate.
+
+usage: python bench_peek.py [port]
+
+If no port is given a simulated device on a pty is used. Its replies are sent
+no faster than the default baud rate allows, but the times otherwise mostly
+reflect host overhead rather than the firmware.
+"""
+import sys
+import time
+import numpy
+from accel_adxl345 import AccelADXL345
+
+NUM_REPEAT = 500
+
+
+def getSampleLine(dev):
+    """
+    The get_sample command as peekValue used to send it.
+    """
+    dev.sendCmd(dev.formatCmd('get_sample'))
+    return [x*dev.accelScale for x in dev.readFloat()]
+
+
+def timeCalls(func):
+    times = numpy.zeros((NUM_REPEAT,))
+    for i in range(NUM_REPEAT):
+        t0 = time.time()
+        func()
+        times[i] = time.time() - t0
+    return 1.0e3*times
+
+
+if __name__ == '__main__':
+
+    sim = None
+    if len(sys.argv) > 1:
+        port = sys.argv[1]
+    else:
+        from accel_adxl345.simulator import PtySimulator
+        sim = PtySimulator(bufferSize=120)
+        sim.start()
+        port = sim.port
+    dev = AccelADXL345(port=port)
+    out = numpy.zeros((3,),dtype=numpy.int16)
+
+    cases = (
+            ('get_sample', lambda: getSampleLine(dev)),
+            ('peekSample', lambda: dev.peekSample()),
+            ('peekSample out', lambda: dev.peekSample(out)),
+            ('peekValue', lambda: dev.peekValue()),
+            )
+    print '                   mean (ms)   p50 (ms)   p99 (ms)   rate (Hz)'
+    for name, func in cases:
+        times = timeCalls(func)
+        print '  %-14s %10.3f %10.3f %10.3f %11.1f'%(name,times.mean(),numpy.percentile(times,50),
+                numpy.percentile(times,99),1.0e3/times.mean())
+    dev.close()
+    if sim is not None:
+        sim.stop()
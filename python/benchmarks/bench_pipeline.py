@@ -0,0 +1,58 @@
+"""
+bench_pipeline.py - measures the processing rate of a typical streaming
+pipeline (scale, detrend, low pass filter, decimate and resample) fed with
+chunks of samples at the maximum device sample rate. Reports how many times
+faster than real time one device is processed and so how many devices one
+core could filter. Also checks that the chunked output matches processing
+all of the data at once.
+
+usage: python bench_pipeline.py [duration] [chunk_dt]
+"""
+import sys
+import time
+import numpy
+from accel_adxl345 import ACCEL_SCALE
+from accel_adxl345.pipeline import Pipeline, ScaleStage, DetrendStage
+from accel_adxl345.pipeline import lowpassStage, DecimateStage, ResampleStage
+
+SAMPLE_DT = 312.0e-6
+MEASURED_DT = 312.4e-6
+
+
+def createPipeline():
+    sampleRate = 1.0/MEASURED_DT
+    return Pipeline(
+            ScaleStage(ACCEL_SCALE),
+            DetrendStage(sampleRate,timeConstant=5.0),
+            lowpassStage(200.0,sampleRate),
+            DecimateStage(4),
+            ResampleStage(4*MEASURED_DT,4*SAMPLE_DT),
+            )
+
+
+if __name__ == '__main__':
+
+    duration = 60.0
+    chunkDt = 0.05
+    if len(sys.argv) > 1:
+        duration = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        chunkDt = float(sys.argv[2])
+
+    num = int(duration/SAMPLE_DT)
+    chunkSize = max(1,int(chunkDt/SAMPLE_DT))
+    raw = numpy.random.randint(-512,512,(num,3)).astype(numpy.int16)
+
+    pipeline = createPipeline()
+    t0 = time.time()
+    chunks = [pipeline.process(raw[i:i+chunkSize]) for i in range(0,num,chunkSize)]
+    elapsed = time.time() - t0
+    chunked = numpy.concatenate(chunks)
+
+    whole = createPipeline().process(raw)
+    assert whole.shape == chunked.shape and numpy.allclose(whole,chunked), 'chunked output differs'
+
+    print 'samples:          {0} in chunks of {1}'.format(num,chunkSize)
+    print 'time:             {0:.3f} s'.format(elapsed)
+    print 'samples/s:        {0:.0f}'.format(num/elapsed)
+    print 'x real time:      {0:.1f}'.format(duration/elapsed)
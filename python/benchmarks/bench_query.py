@@ -0,0 +1,87 @@
+"""
+bench_query.py - compares the latency of reading several device values with
+sequential get commands, pipelined commands and a single combined get_values
+command, and of changing the range with set_range followed by get_range
+against reading the range and resolution from the set_range reply.
+
+usage: python bench_query.py [port]
+
+If no port is given a simulated device on a pty is used, in which case the times
+mostly reflect host overhead rather than the serial link.
+"""
+import sys
+import time
+import numpy
+from accel_adxl345 import AccelADXL345
+
+NUM_REPEAT = 200
+NAMES = ['get_range', 'get_timer_period', 'get_bad_sample_count']
+
+
+def sequential(dev):
+    return [dev.getRange(), dev.getSampleDt(), dev.getBadSampleCount()]
+
+
+def pipelined(dev):
+    dev.combinedQuery = False
+    try:
+        return dev.query(NAMES)
+    finally:
+        dev.combinedQuery = True
+
+
+def combined(dev):
+    return dev.query(NAMES)
+
+
+def setRangeReadBack(dev,value):
+    """
+    Changes the range and reads it back, as setRange did before the firmware
+    replied to set_range.
+    """
+    dev.sendCmd(dev.formatCmd('set_range',value))
+    dev.readValue()
+    return dev.getRange()
+
+
+def setRangeReply(dev,value):
+    dev.setRange(value)
+    return dev.accelRange
+
+
+def timeCalls(func,dev,*args):
+    times = numpy.zeros((NUM_REPEAT,))
+    for i in range(NUM_REPEAT):
+        t0 = time.time()
+        func(dev,*[x[i%len(x)] for x in args])
+        times[i] = time.time() - t0
+    return 1.0e3*times
+
+
+if __name__ == '__main__':
+
+    sim = None
+    if len(sys.argv) > 1:
+        port = sys.argv[1]
+    else:
+        from accel_adxl345.simulator import PtySimulator
+        sim = PtySimulator()
+        sim.start()
+        port = sim.port
+    dev = AccelADXL345(port=port)
+
+    assert sequential(dev) == pipelined(dev) == combined(dev), 'values differ'
+
+    print '                 mean (ms)   p50 (ms)   p99 (ms)'
+    for name, func in (('sequential',sequential),('pipelined',pipelined),('combined',combined)):
+        times = timeCalls(func,dev)
+        print '  %-12s %10.3f %10.3f %10.3f'%(name,times.mean(),numpy.percentile(times,50),numpy.percentile(times,99))
+
+    ranges = dev.getAllowedAccelRange()
+    assert [setRangeReadBack(dev,x) for x in ranges] == [setRangeReply(dev,x) for x in ranges], 'ranges differ'
+    for name, func in (('read back',setRangeReadBack),('set reply',setRangeReply)):
+        times = timeCalls(func,dev,ranges)
+        print '  %-12s %10.3f %10.3f %10.3f'%(name,times.mean(),numpy.percentile(times,50),numpy.percentile(times,99))
+    dev.close()
+    if sim is not None:
+        sim.stop()
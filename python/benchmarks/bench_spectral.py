@@ -0,0 +1,65 @@
+"""
+bench_spectral.py - measures the time taken to keep a running Welch PSD and
+spectrogram up to date for several devices streaming at the maximum sample
+rate, fed with chunks as the acquisition paths deliver them. Reports how many
+times faster than real time the updates run for each number of devices. If
+scipy is installed the final PSD is also checked against scipy.signal.welch.
+
+usage: python bench_spectral.py [duration] [segment_size] [max_devices]
+"""
+import sys
+import time
+import numpy
+from accel_adxl345 import ACCEL_SCALE
+from accel_adxl345.spectral import WelchPSD
+
+SAMPLE_RATE = 1.0e6/312
+CHUNK_DT = 0.05
+
+
+def check(data,segmentSize):
+    try:
+        import scipy.signal
+    except ImportError:
+        print 'scipy not installed, skipping check'
+        return
+    psd = WelchPSD(segmentSize,SAMPLE_RATE)
+    chunkSize = int(CHUNK_DT*SAMPLE_RATE)
+    for i in range(0,data.shape[0],chunkSize):
+        psd.update(data[i:i+chunkSize])
+    f, p = psd.getPSD()
+    fRef, pRef = scipy.signal.welch(data,SAMPLE_RATE,nperseg=segmentSize,axis=0)
+    assert numpy.allclose(p,pRef), 'psd differs from scipy.signal.welch'
+    print 'psd matches scipy.signal.welch'
+
+
+if __name__ == '__main__':
+
+    duration = 60.0
+    segmentSize = 1024
+    maxDevices = 16
+    if len(sys.argv) > 1:
+        duration = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        segmentSize = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        maxDevices = int(sys.argv[3])
+
+    num = int(duration*SAMPLE_RATE)
+    chunkSize = int(CHUNK_DT*SAMPLE_RATE)
+    t = numpy.arange(num)/SAMPLE_RATE
+    data = numpy.random.randn(num,3)
+    data[:,0] += 2.0*numpy.sin(2*numpy.pi*120.0*t)
+    data *= ACCEL_SCALE
+    check(data[:int(5*SAMPLE_RATE)],segmentSize)
+
+    print ' devices   time (s)   x real time   peak (Hz)'
+    for numDevices in [n for n in (1,2,4,8,16,32) if n <= maxDevices]:
+        psds = [WelchPSD(segmentSize,SAMPLE_RATE) for i in range(numDevices)]
+        t0 = time.time()
+        for i in range(0,num,chunkSize):
+            chunk = data[i:i+chunkSize]
+            for psd in psds:
+                psd.update(chunk)
+        elapsed = time.time() - t0
+        print ' %7d   %8.3f   %11.1f   %9.1f'%(numDevices,elapsed,duration/elapsed,psds[0].getPeakFrequency()[0])
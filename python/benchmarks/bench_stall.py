@@ -0,0 +1,68 @@
+"""
+bench_stall.py - checks that the background reader survives the consumer
+stalling, e.g. a busy UI thread. Streams from the firmware simulator with the
+background reader, stops reading chunks for stall seconds, then drains the
+queue and checks that no samples were dropped and the sample indices are
+contiguous. Reports the number of chunks and samples per chunk.
+
+usage: python bench_stall.py [stall] [sample_rate]
+"""
+import sys
+import time
+from accel_adxl345 import AccelADXL345
+from accel_adxl345 import concatChunks
+from accel_adxl345.frame_decoder import FRAME_LEGACY
+from accel_adxl345.frame_decoder import FRAME_PACKED
+from accel_adxl345.simulator import PtySimulator
+
+BAUD_RATE = 1000000
+
+
+def runStall(frameFormat,sampleRate,stall):
+    sim = PtySimulator(noise=2.0)
+    sim.start(process=True)
+    try:
+        dev = AccelADXL345(
+                port=sim.port,
+                reset_sleep=False,
+                negotiate_baudrate=BAUD_RATE,
+                frame_format=frameFormat,
+                )
+        dev.setSampleRate(sampleRate)
+        dev.emptyBuffer()
+        dev.startStreaming(background=True)
+        time.sleep(stall)
+        dev.stopStreaming()
+        chunks = list(dev.iterChunks())
+        stats = dev.getStreamStats()
+        dev.emptyBuffer()
+        dev.close()
+    finally:
+        sim.stop()
+    chunk = concatChunks(chunks)
+    contiguous = all(b.start == a.end for a, b in zip(chunks[:-1],chunks[1:]))
+    print '  %-7s %11.0f %9d %8d %12.1f %9d'%(
+            'packed' if frameFormat == FRAME_PACKED else 'legacy',
+            dev.getSampleRate(),
+            len(chunk),
+            len(chunks),
+            len(chunk)/float(max(len(chunks),1)),
+            stats['dropped_samples'],
+            )
+    assert stats['dropped_samples'] == 0, 'samples dropped during the stall'
+    assert contiguous, 'chunks are not contiguous'
+
+
+if __name__ == '__main__':
+
+    stall = 6.0
+    sampleRate = None
+    if len(sys.argv) > 1:
+        stall = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        sampleRate = float(sys.argv[2])
+
+    print 'consumer stalled for %.1f s'%(stall,)
+    print '  format  rate (Hz)   samples   chunks   samples/chunk   dropped'
+    runStall(FRAME_LEGACY,sampleRate or 500.0,stall)
+    runStall(FRAME_PACKED,sampleRate or 3200.0,stall)
@@ -0,0 +1,78 @@
+"""
+bench_timebase.py - simulates a long packed frame stream from a device whose
+clock runs slow or fast, with bad samples and random delivery latency, and
+checks the drift and sample times found by Timebase from the firmware
+timestamps against the true values. The stream is generated and decoded in
+simulated time so hours of data take seconds. Also reports the time taken to
+compute the sample times of each chunk.
+
+usage: python bench_timebase.py [hours] [clock_error_ppm] [timer_period]
+"""
+import sys
+import time
+import numpy
+from accel_adxl345.frame_decoder import FRAME_PACKED
+from accel_adxl345.frame_decoder import PackedFrameDecoder
+from accel_adxl345.simulator import DeviceSimulator
+from accel_adxl345.timebase import Timebase
+
+CHUNK_DT = 0.05
+LATENCY = 0.002
+LATENCY_JITTER = 0.004
+BAD_SAMPLE_PROB = 0.001
+
+
+if __name__ == '__main__':
+
+    hours = 2.0
+    clockError = 50.0e-6
+    timerPeriod = 2000
+    if len(sys.argv) > 1:
+        hours = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        clockError = float(sys.argv[2])*1.0e-6
+    if len(sys.argv) > 3:
+        timerPeriod = int(sys.argv[3])
+
+    sim = DeviceSimulator(badSampleProb=BAD_SAMPLE_PROB,clockError=clockError,seed=0)
+    sim.frameFormat = FRAME_PACKED
+    sim.timerPeriod = timerPeriod
+    sim.handleCmd([1],0.0)
+    decoder = PackedFrameDecoder()
+    timebase = Timebase(timerPeriod)
+    random = numpy.random.RandomState(1)
+
+    duration = 3600.0*hours
+    trueDt = timerPeriod*1.0e-6*(1.0 + clockError)
+    numSamples = 0
+    maxError = 0.0
+    timesElapsed = 0.0
+    now = 0.0
+    while now < duration:
+        now += CHUNK_DT
+        data = decoder.decode(sim.update(now))
+        hostTime = now + LATENCY + LATENCY_JITTER*random.random_sample()
+        for period, micros, _ in decoder.timestamps:
+            timebase.addTimestamp(period,micros,hostTime)
+        decoder.timestamps = []
+
+        t0 = time.time()
+        periods = decoder.getPeriodIndex(numSamples,data.shape[0])
+        t = timebase.getTimes(periods)
+        timesElapsed += time.time() - t0
+        numSamples += data.shape[0]
+        if now > 60.0 and t.shape[0] > 0:
+            maxError = max(maxError,abs(t - trueDt*periods).max())
+
+    drift = timebase.getDrift()
+    print 'simulated time:      %.1f hours'%(hours,)
+    print 'samples:             %d (%d lost)'%(numSamples,decoder.lostSamples)
+    print 'timestamps:          %d'%(timebase.getNumTimestamps(),)
+    print 'clock error:         %.3f ppm'%(1.0e6*clockError,)
+    print 'estimated drift:     %.3f ppm'%(1.0e6*drift,)
+    print 'measured sample dt:  %.6f us'%(timebase.getSampleDt(),)
+    print 'nominal time error:  %.3f s'%(abs(clockError)*duration,)
+    print 'max time error:      %.6f s (after 60 s)'%(maxError,)
+    print 'times per chunk:     %.1f us'%(1.0e6*timesElapsed*CHUNK_DT/duration,)
+    assert abs(drift - clockError) < 1.0e-6, 'drift estimate off by more than 1 ppm'
+    assert maxError < 0.01, 'sample times off by more than 10 ms'
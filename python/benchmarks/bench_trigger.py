@@ -0,0 +1,112 @@
+"""
+bench_trigger.py - measures the time taken by the trigger engine to watch
+several devices streaming at the maximum sample rate with threshold, slope
+and band energy triggers, fed with chunks as the acquisition paths deliver
+them, and reports how many times faster than real time it runs. Then compares
+the serial load of streaming everything with that of the firmware threshold
+trigger, using the device simulator in simulated time, and checks that both
+give the same events. The band energy trigger requires scipy.
+
+usage: python bench_trigger.py [duration] [max_devices]
+"""
+import sys
+import time
+import numpy
+from accel_adxl345 import ACCEL_SCALE
+from accel_adxl345 import CMD_ID
+from accel_adxl345.frame_decoder import FRAME_PACKED
+from accel_adxl345.frame_decoder import createDecoder
+from accel_adxl345.sample_chunk import SampleChunk
+from accel_adxl345.simulator import DeviceSimulator
+from accel_adxl345.trigger import TriggerEngine
+from accel_adxl345.trigger import ThresholdTrigger
+from accel_adxl345.trigger import SlopeTrigger
+from accel_adxl345.trigger import BandEnergyTrigger
+
+SAMPLE_RATE = 1.0e6/312
+CHUNK_DT = 0.05
+PRE_TRIGGER = 256
+POST_TRIGGER = 1024
+LEVEL = 30.0
+SHOCK_INTERVAL = 5000
+SHOCK_AMPLITUDE = 1500
+POLL_DT = 0.01
+
+
+def createTriggers():
+    triggers = [ThresholdTrigger(LEVEL), SlopeTrigger(2.0e5,SAMPLE_RATE)]
+    try:
+        triggers.append(BandEnergyTrigger(5.0,200.0,600.0,SAMPLE_RATE,64))
+    except ImportError:
+        pass
+    return triggers
+
+
+def streamEvents(deviceTrigger,duration):
+    """
+    Streams from the simulator for duration simulated seconds through a
+    trigger engine. Returns the bytes sent and the (trigger index in sample
+    periods, window length) of each event.
+    """
+    sim = DeviceSimulator(noise=2.0,shockInterval=SHOCK_INTERVAL,shockAmplitude=SHOCK_AMPLITUDE,seed=0)
+    sim.baudRate = 1000000
+    sim.frameFormat = FRAME_PACKED
+    sim.timerPeriod = int(1.0e6/SAMPLE_RATE)
+    if deviceTrigger:
+        level = int(numpy.ceil(LEVEL/ACCEL_SCALE))
+        sim.handleCmd([CMD_ID['set_trigger'],level,PRE_TRIGGER,POST_TRIGGER],0.0)
+    sim.handleCmd([CMD_ID['start_streaming']],0.0)
+    decoder = createDecoder(FRAME_PACKED)
+    engine = TriggerEngine([ThresholdTrigger(LEVEL)],PRE_TRIGGER,POST_TRIGGER,ACCEL_SCALE)
+    numBytes = 0
+    events = []
+    now = 0.0
+    while now < duration:
+        now += POLL_DT
+        byteVals = sim.update(now)
+        numBytes += len(byteVals)
+        data = decoder.decode(byteVals)
+        start = decoder.sampleIndex - data.shape[0]
+        periods = decoder.getPeriodIndex(start,data.shape[0])
+        for event in engine.process(SampleChunk(data,ACCEL_SCALE,start=start),periods):
+            events.append((int(decoder.getPeriodIndex(event.triggerIndex,1)[0]),len(event.chunk)))
+    return numBytes, events
+
+
+if __name__ == '__main__':
+
+    duration = 60.0
+    maxDevices = 32
+    if len(sys.argv) > 1:
+        duration = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        maxDevices = int(sys.argv[2])
+
+    num = int(duration*SAMPLE_RATE)
+    chunkSize = int(CHUNK_DT*SAMPLE_RATE)
+    raw = numpy.random.normal(0,3,(num,3)).round().astype('<i2')
+    raw[:,2] += 256
+    k = numpy.arange(200)
+    shock = (SHOCK_AMPLITUDE*numpy.exp(-k/30.0)*numpy.sin(2*numpy.pi*k/8.0)).astype('<i2')
+    for start in range(SHOCK_INTERVAL,num-k.shape[0],SHOCK_INTERVAL):
+        raw[start:start+k.shape[0],0] += shock
+    chunks = [SampleChunk(raw[i:i+chunkSize],ACCEL_SCALE,start=i) for i in range(0,num,chunkSize)]
+
+    print 'triggers: {0}'.format(', '.join(t.name for t in createTriggers()))
+    print ' devices   time (s)   x real time   events'
+    for numDevices in [n for n in (1,2,4,8,16,32,64) if n <= maxDevices]:
+        engines = [TriggerEngine(createTriggers(),PRE_TRIGGER,POST_TRIGGER,ACCEL_SCALE) for i in range(numDevices)]
+        t0 = time.time()
+        for chunk in chunks:
+            for engine in engines:
+                chunk.clearCache()
+                engine.process(chunk)
+        elapsed = time.time() - t0
+        print ' %7d   %8.3f   %11.1f   %6d'%(numDevices,elapsed,duration/elapsed,engines[0].numEvents)
+
+    hostBytes, hostEvents = streamEvents(False,duration)
+    deviceBytes, deviceEvents = streamEvents(True,duration)
+    print 'serial bytes, host trigger:     %d'%(hostBytes,)
+    print 'serial bytes, firmware trigger: %d (%.1f%%)'%(deviceBytes,100.0*deviceBytes/hostBytes)
+    assert hostEvents == deviceEvents, 'firmware trigger events differ'
+    print 'firmware trigger gives the same %d events'%(len(deviceEvents),)
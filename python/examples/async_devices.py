@@ -0,0 +1,23 @@
+"""
+async_devices.py - demonstrates configuring and streaming from several 
+devices from a single thread with AsyncAccelADXL345 and DeviceLoop. 
+"""
+from accel_adxl345 import AsyncAccelADXL345, DeviceLoop
+
+ports = ['/dev/ttyUSB0', '/dev/ttyUSB1']
+
+loop = DeviceLoop()
+devs = [AsyncAccelADXL345(port=port,loop=loop) for port in ports]
+loop.runUntilComplete([dev.connect() for dev in devs])
+for dev in devs:
+    print dev.port, 'dt:', dev.sampleDt, 'range:', dev.accelRange
+
+print loop.runUntilComplete([dev.peekValue() for dev in devs])
+
+count = dict((dev.port,0) for dev in devs)
+for dev in devs:
+    dev.startStreaming()
+for dev, chunk in loop.stream(duration=5.0):
+    count[dev.port] += chunk.shape[0]
+loop.runUntilComplete([dev.stopStreaming() for dev in devs])
+print count
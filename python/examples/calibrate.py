@@ -0,0 +1,43 @@
+"""
+calibrate.py - fits a calibration of the offset, scale and misalignment of
+each axis from static captures with the device held still in several
+orientations, e.g. resting on each face and edge of a box, and stores it for
+the device and current range. Later AccelADXL345 instances opened with the
+same calibration_file apply it to all samples.
+
+usage: python calibrate.py [port] [num_orientations]
+"""
+import sys
+from accel_adxl345 import AccelADXL345
+from accel_adxl345.calibration import CalibrationFitter
+
+CALIBRATION_FILE = '~/.accel_adxl345_calibration.json'
+NUM_SAMPLES = 1000
+MAX_STD = 20.0
+
+port = '/dev/ttyUSB0'
+numOrientations = 12
+if len(sys.argv) > 1:
+    port = sys.argv[1]
+if len(sys.argv) > 2:
+    numOrientations = int(sys.argv[2])
+
+dev = AccelADXL345(port=port,calibration_file=CALIBRATION_FILE)
+dev.setSampleRate(500)
+print 'calibrating {0} at range {1}'.format(dev.cacheKey,dev.accelRange)
+
+fitter = CalibrationFitter(maxStd=MAX_STD)
+while len(fitter) < numOrientations:
+    raw_input('orientation {0} of {1}: hold the device still and press enter'.format(len(fitter)+1,numOrientations))
+    try:
+        print 'mean:', fitter.addCapture(dev.getSampleChunk(NUM_SAMPLES).raw)
+    except ValueError, e:
+        print '{0}, try again'.format(e)
+
+calibration = fitter.fit(dev.accelScale)
+print calibration
+print 'matrix:'
+print calibration.matrix
+dev.setCalibration(calibration)
+print 'saved to', CALIBRATION_FILE
+dev.close()
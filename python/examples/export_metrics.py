@@ -0,0 +1,43 @@
+"""
+export_metrics.py - streams from the device simulator and publishes the
+device metrics as Prometheus text on http://localhost:9345/metrics and as
+statsd lines to a local UDP port, printing what is received. No hardware or
+metrics server is needed.
+"""
+import time
+import socket
+import urllib2
+from accel_adxl345 import AccelADXL345
+from accel_adxl345.frame_decoder import FRAME_PACKED
+from accel_adxl345.metrics import StatsdExporter, servePrometheus
+from accel_adxl345.simulator import PtySimulator
+
+PROMETHEUS_PORT = 9345
+
+sim = PtySimulator(badSampleProb=0.001,dropByteProb=1.0e-4)
+sim.start()
+dev = AccelADXL345(port=sim.port,reset_sleep=False,frame_format=FRAME_PACKED)
+server = servePrometheus(dev.metrics,PROMETHEUS_PORT,labels={'port': dev.port})
+
+statsdSock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+statsdSock.bind(('127.0.0.1',0))
+statsdSock.settimeout(1.0)
+exporter = StatsdExporter(dev.metrics,'127.0.0.1',statsdSock.getsockname()[1])
+
+dev.emptyBuffer()
+dev.startStreaming()
+t0 = time.time()
+while time.time() - t0 < 3.0:
+    dev.readValues()
+    time.sleep(0.01)
+dev.stopStreaming()
+dev.emptyBuffer()
+dev.getBadSampleCount()
+
+print urllib2.urlopen('http://localhost:{0}/metrics'.format(PROMETHEUS_PORT)).read()
+exporter.send()
+print statsdSock.recv(4096)
+
+server.shutdown()
+dev.close()
+sim.stop()
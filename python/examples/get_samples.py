@@ -15,13 +15,14 @@ print 'acquiring samples'
 sys.stdout.flush()
 t,data = dev.getSamples(500,verbose=True)
 
-# Compute mean and get magnitude of vector
+# Magnitude of the mean, which is gravity if the device is still. Run
+# calibrate.py and pass calibration_file to AccelADXL345 to correct for the
+# offset, scale and misalignment of each axis.
 if 0:
     mean = data.mean(axis=0)
     mean_mag = pylab.sqrt(mean[0]**2 + mean[1]**2 + mean[2]**2)
-    scale_factor = 9.81/mean_mag
     print 'magnitude of mean:', mean_mag
-    print 'scale factor:', scale_factor
+    print dev.getCalibration()
 
 pylab.subplot(311)
 pylab.plot(t,data[:,0])
@@ -1,7 +1,10 @@
 """
-peek.py - demonstrates how to grab single readings from the accelerometer
+peek.py - demonstrates how to grab single readings from the accelerometer.
+peekSample returns raw values with the binary peek command and can fill a
+reused array, peekValue returns them in m/s^2.
 """
 import time
+import numpy
 from accel_adxl345 import AccelADXL345
 
 port = '/dev/ttyUSB0'
@@ -14,10 +17,20 @@ if 0:
 if 0:
     for i in range(0,100):
         print dev.peekValue()
-if 1:
+if 0:
     t0 = time.time()
     while 1:
         vals = dev.peekValue()
         print '%1.2f, %1.2f, %1.2f'%(vals[0], vals[1], vals[2])
 
+if 1:
+    raw = numpy.zeros((3,),dtype=numpy.int16)
+    count = 0
+    t0 = time.time()
+    while 1:
+        dev.peekSample(raw)
+        count += 1
+        if count % 100 == 0:
+            print raw, '%1.1f Hz'%(count/(time.time() - t0),)
+
 
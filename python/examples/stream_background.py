@@ -0,0 +1,22 @@
+"""
+stream_background.py - demonstrates streaming with the background reader 
+thread. 
+"""
+import time
+from accel_adxl345 import AccelADXL345
+from accel_adxl345 import concatChunks
+
+port = '/dev/ttyUSB0'
+dev = AccelADXL345(port=port)
+dev.setSampleRate(500)
+
+dev.emptyBuffer()
+dev.startStreaming(background=True)
+time.sleep(5.0)
+dev.stopStreaming()
+
+chunk = concatChunks(list(dev.iterChunks()))
+dev.emptyBuffer()
+print 'samples:', len(chunk)
+print 'duration:', chunk.times[-1] - chunk.times[0]
+print dev.getStreamStats()
@@ -0,0 +1,29 @@
+"""
+stream_filtered.py - demonstrates filtering and decimating samples as they
+are streamed using a processing pipeline. Requires scipy.
+"""
+import time
+from accel_adxl345 import AccelADXL345
+from accel_adxl345.pipeline import Pipeline, ScaleStage, DetrendStage
+from accel_adxl345.pipeline import lowpassStage, DecimateStage
+
+port = '/dev/ttyUSB0'
+dev = AccelADXL345(port=port)
+dev.setSampleRate(500)
+sampleRate = dev.getSampleRate()
+
+pipeline = Pipeline(
+        ScaleStage(dev.accelScale),
+        DetrendStage(sampleRate,timeConstant=5.0),
+        lowpassStage(50.0,sampleRate),
+        DecimateStage(2),
+        )
+
+dev.emptyBuffer()
+dev.startStreaming(background=True)
+t0 = time.time()
+for data, times in pipeline.iterate(dev.iterChunks(),dev.decoder):
+    print data.shape[0], times[0], data.std(axis=0)
+    if time.time() - t0 > 5.0:
+        dev.stopStreaming()
+dev.emptyBuffer()
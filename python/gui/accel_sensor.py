@@ -11,19 +11,31 @@ import sys
 import platform
 import os
 import os.path
+import shutil
+import tempfile
 import pylab
 from PyQt4 import QtCore
 from PyQt4 import QtGui
 from accel_sensor_ui import Ui_AccelSensorMainWindow 
+from strip_chart import StripChart
+from acquisition_worker import AcquisitionWorker
 from accel_adxl345 import AccelADXL345
+from accel_adxl345 import concatChunks
+from accel_adxl345.capture_file import CAPTURE_EXT
 
-TIMER_INTERVAL_MS = 0.001
-MIN_INWAITING_SIZE = 15
+LIVE_FRAME_MS = 50
+PROGRESS_DT = 0.1
+RECORD_MAX_BYTES = 100*2**20
+RECORD_MAX_DURATION = 3600.0
+GRAVITY = 9.81
 
 # Default parameters
 DEFAULT_DURATION = 1.0
 DEFAULT_SAMPLE_RATE = 500.0
-DEFAULT_SAVE_FILE = 'sensor_data.txt'
+DEFAULT_SAVE_FILE = 'sensor_data' + CAPTURE_EXT
+TEXT_EXT = '.txt'
+CAPTURE_FILTER = 'Capture files (*{0})'.format(CAPTURE_EXT)
+TEXT_FILTER = 'Text files (*{0})'.format(TEXT_EXT)
 
 # Validator parameters
 DURATION_MIN = 0.01 
@@ -59,11 +71,11 @@ class Sensor_MainWindow(QtGui.QMainWindow, Ui_AccelSensorMainWindow):
 
     def setupTimer(self):
         """
-        Setup timer object
+        Setup timer object for redrawing the live plot
         """
-        self.timer = QtCore.QTimer()
-        self.timer.setInterval(TIMER_INTERVAL_MS)
-        self.timer.timeout.connect(self.timer_Callback)
+        self.plotTimer = QtCore.QTimer()
+        self.plotTimer.setInterval(LIVE_FRAME_MS)
+        self.plotTimer.timeout.connect(self.plotTimer_Callback)
 
     def initialize(self):
         """
@@ -71,10 +83,18 @@ class Sensor_MainWindow(QtGui.QMainWindow, Ui_AccelSensorMainWindow):
         """
 
         self.data = None 
+        self.numAcquired = 0
         self.t = None 
+        self.capture = None
+        self.captureFilename = None
+        self.live = False
+        self.stripChart = None
+        self.recordCapture = None
         self.connected = False
         self.started = False
-        self.timer = None
+        self.worker = None
+        self.lastProgressTime = 0.0
+        self.plotTimer = None
         self.dev = None
         self.maxSampleRate = None
         self.minSampleRate = None
@@ -148,6 +168,8 @@ class Sensor_MainWindow(QtGui.QMainWindow, Ui_AccelSensorMainWindow):
         """
         Changes device range setting based on combobox value
         """
+        if self.started:
+            return
         newRange = self.getRange()
         self.dev.setRange(newRange)
 
@@ -166,6 +188,8 @@ class Sensor_MainWindow(QtGui.QMainWindow, Ui_AccelSensorMainWindow):
         """
         Changes the device sample rate setting based on the lineedit value.
         """
+        if self.started:
+            return
         # Get sample rate string and convert to float
         sampleRateStr = self.sampleRateLineEdit.text()
         self.sampleRate = float(sampleRateStr)
@@ -233,14 +257,28 @@ class Sensor_MainWindow(QtGui.QMainWindow, Ui_AccelSensorMainWindow):
 
     def save_Callback(self):
         """
-        Save acquired data
+        Save acquired data. Files with the capture file extension are copied
+        from the binary capture recorded during acquisition, otherwise the
+        data is saved as text. Live and record sessions have no capture to
+        copy, so only text is offered.
         """
-        filepath = os.path.join(self.lastSaveDir,self.lastSaveFile)
-        filename = QtGui.QFileDialog.getSaveFileName(None,'Select log file',filepath)
+        base = os.path.splitext(self.lastSaveFile)[0]
+        if self.captureFilename is not None:
+            filepath = os.path.join(self.lastSaveDir,base + CAPTURE_EXT)
+            filters = ';;'.join((CAPTURE_FILTER,TEXT_FILTER))
+        else:
+            filepath = os.path.join(self.lastSaveDir,base + TEXT_EXT)
+            filters = TEXT_FILTER
+        filename = QtGui.QFileDialog.getSaveFileName(None,'Select log file',filepath,filters)
         filename = str(filename)
         if filename:
-            data = pylab.concatenate((self.t,self.data),axis=1)
-            pylab.savetxt(filename,data)
+            if filename.endswith(CAPTURE_EXT) and self.captureFilename is not None:
+                shutil.copyfile(self.captureFilename,filename)
+            else:
+                if filename.endswith(CAPTURE_EXT):
+                    filename = os.path.splitext(filename)[0] + TEXT_EXT
+                data = pylab.concatenate((self.t,self.data),axis=1)
+                pylab.savetxt(filename,data)
             self.lastSaveDir =  os.path.split(filename)[0]
             self.lastSaveFile = os.path.split(filename)[1]
 
@@ -254,64 +292,148 @@ class Sensor_MainWindow(QtGui.QMainWindow, Ui_AccelSensorMainWindow):
             self.stopDataStreaming()
         self.setStartStopText()
 
-    def timer_Callback(self):
+    def chunk_Callback(self,newData):
         """
-        Callback for timer events. Grabs available values from the device until sufficient
-        samples have been acquired then plots the data.
+        Callback for chunks of samples from the acquisition worker. The status
+        is updated at most every PROGRESS_DT seconds.
         """
-        # Read the available samples from the device
-        while self.dev.inWaiting() > MIN_INWAITING_SIZE and len(self.data) < self.numSamples:
-            try:
-                newData = self.dev.readValues()
-            except IOError, e:
-                self.stopDataStreaming(plot=False)
-                break
-                
-            self.data.extend(newData)
-            percent = min([100,100*len(self.data)/float(self.numSamples)])
+        if not self.started:
+            return
+
+        if self.live:
+            # Live mode runs until stopped, keeping only the plotted window
+            self.stripChart.write(newData.raw)
+            self.numAcquired += len(newData)
+            return
+
+        self.data.append(newData)
+        self.numAcquired += len(newData)
+        if time.time() - self.lastProgressTime >= PROGRESS_DT:
+            self.lastProgressTime = time.time()
+            percent = min([100,100*self.numAcquired/float(self.numSamples)])
             percentStr = '%1.0f'%(percent,) + '%'
             self.statusLabel.setText('Status: acquiring samples %s'%(percentStr,))
-            self.statusLabel.repaint()
-        
-        # Check if enough samples have been acquired
-        if len(self.data) >= self.numSamples:
-            self.statusLabel.repaint()
+
+    def acquisitionError_Callback(self,message):
+        """
+        Callback for errors in the acquisition worker.
+        """
+        if self.started:
+            self.stopDataStreaming(plot=False)
+            self.statusLabel.setText('Status: %s'%(message,))
+
+    def acquisitionDone_Callback(self):
+        """
+        Callback for the acquisition worker finishing, either after acquiring 
+        the requested number of samples or after being stopped.
+        """
+        if self.started:
             self.stopDataStreaming()
 
+    def plotTimer_Callback(self):
+        """
+        Callback for plot timer events in live mode. Redraws the strip chart.
+        """
+        self.stripChart.update()
+        if self.recordCapture is None:
+            self.statusLabel.setText('Status: streaming %d samples'%(self.numAcquired,))
+        else:
+            filename = os.path.split(str(self.recordCapture.filename))[1]
+            self.statusLabel.setText('Status: recording %d samples to %s'%(self.numAcquired,filename))
+
     def startDataStreaming(self):
         """
-        Start data streaming from the device.
+        Start data streaming from the device. In live mode streaming continues
+        until stopped and the last duration seconds are plotted as they arrive.
+        Record mode is live mode with all of the samples written to a series of
+        capture files.
         """
+        if self.recordCheckBox.isChecked():
+            self.recordCapture = self.openRecordCapture()
+            if self.recordCapture is None:
+                return
         self.started = True
+        self.live = self.liveCheckBox.isChecked() or self.recordCapture is not None
         self.data = [] 
+        self.numAcquired = 0
         self.t = None
-        self.dev.emptyBuffer()
-        self.dev.startStreaming()
-        self.timer.start()
+        if self.live:
+            self.removeCapture()
+            capture = self.recordCapture
+            self.stripChart = StripChart(
+                    self.mpl.canvas,
+                    self.axes,
+                    self.plots,
+                    self.duration,
+                    self.actualSampleDt,
+                    self.dev.accelScale,
+                    )
+            self.stripChart.start(GRAVITY*self.getRange())
+            self.plotTimer.start()
+        else:
+            self.openCapture()
+            capture = self.capture
+
+        # Acquire samples in a worker thread, in live mode until stopped
+        numSamples = None if self.live else self.numSamples
+        self.worker = AcquisitionWorker(self.dev,numSamples,capture)
+        self.worker.chunkReady.connect(self.chunk_Callback)
+        self.worker.error.connect(self.acquisitionError_Callback)
+        self.worker.done.connect(self.acquisitionDone_Callback)
+        self.lastProgressTime = 0.0
+        self.worker.start()
+        self.enableDisableWidgets()
 
     def stopDataStreaming(self,plot=True):
         """
         Stops data streaming from device
         """
-        self.timer.stop()
-        # Stop streaming, empty buffer, etc
-        self.dev.stopStreaming()
-        self.dev.emptyBuffer()
+        if not self.started:
+            return
+        # Stop the worker, which stops streaming and empties the buffer
+        self.worker.stop()
+        self.worker.wait()
+        times = self.worker.times
+        self.worker = None
+        if self.live:
+            # Keep the samples in the strip chart window for plotting and saving
+            self.plotTimer.stop()
+            self.stripChart.stop()
+            self.data = [self.dev.createChunk(self.stripChart.ring.getData())]
+            self.numAcquired = len(self.data[0])
+            self.stripChart = None
+        else:
+            self.capture.close()
         self.started = False
-        self.statusLabel.setText('Status: connected')
-        self.setStartStopText()
-        self.enableDisableWidgets()
+        if self.recordCapture is not None:
+            self.recordCapture.close()
+            self.statusLabel.setText('Status: recorded %d samples to %d files'%(
+                self.recordCapture.numSamples, len(self.recordCapture.filenames)))
+            self.recordCapture = None
+        else:
+            self.statusLabel.setText('Status: connected')
 
-        if plot and len(self.data) > 0:
+        if self.numAcquired > 0:
             # Reduce size of data if necessary data and create time array 
-            N = len(self.data)
+            N = self.numAcquired
             if N > self.numSamples:
                 N = self.numSamples
-                self.data = self.data[0:N]
-            self.data = self.dev.accelScale*pylab.array(self.data)
-            self.t = self.actualSampleDt*pylab.arange(0,N)
+            chunk = concatChunks(self.data)[0:N]
+            if times is not None and times.shape[0] >= N:
+                chunk.times = times[0:N]
+            self.data = chunk.getAccel()
+            if chunk.times is not None:
+                self.t = chunk.times
+            else:
+                self.t = self.actualSampleDt*pylab.arange(0,N)
             self.t = self.t.reshape((self.t.shape[0],1))
+        else:
+            # Nothing to save
+            self.data = None
+        self.setStartStopText()
+        self.enableDisableWidgets()
 
+        if plot and self.data is not None:
             # Plot data
             for i in range(0,3):
                 # Set data and make visible 
@@ -330,11 +452,53 @@ class Sensor_MainWindow(QtGui.QMainWindow, Ui_AccelSensorMainWindow):
 
             self.mpl.canvas.fig.canvas.draw()
             #print '# bad samples:', self.dev.getBadSampleCount()
-        else:
-            pass
             
 
 
+    def openRecordCapture(self):
+        """
+        Asks for the name of the capture files for record mode and returns a 
+        rotating capture writer, or None if cancelled.
+        """
+        filepath = os.path.join(self.lastSaveDir,self.lastSaveFile)
+        filename = QtGui.QFileDialog.getSaveFileName(None,'Select record file',filepath)
+        filename = str(filename)
+        if not filename:
+            return None
+        self.lastSaveDir =  os.path.split(filename)[0]
+        self.lastSaveFile = os.path.split(filename)[1]
+        return self.dev.createRotatingCapture(
+                filename,
+                maxBytes=RECORD_MAX_BYTES,
+                maxDuration=RECORD_MAX_DURATION,
+                )
+
+    def openCapture(self):
+        """
+        Opens a temporary capture file for recording the raw samples, replacing
+        the capture file from the previous acquisition.
+        """
+        self.removeCapture()
+        fd, self.captureFilename = tempfile.mkstemp(suffix=CAPTURE_EXT)
+        os.close(fd)
+        self.capture = self.dev.createCapture(self.captureFilename)
+
+    def removeCapture(self):
+        """
+        Closes and deletes the temporary capture file.
+        """
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+        if self.captureFilename is not None:
+            os.remove(self.captureFilename)
+            self.captureFilename = None
+
+    def closeEvent(self,event):
+        self.stopDataStreaming(plot=False)
+        self.removeCapture()
+        super(Sensor_MainWindow,self).closeEvent(event)
+
     def setStartStopText(self):
         """
         Sets the text of the start/stop button based on recoreding has been
@@ -362,15 +526,18 @@ class Sensor_MainWindow(QtGui.QMainWindow, Ui_AccelSensorMainWindow):
             self.startStopPushButton.setEnabled(True)
             self.durationLineEdit.setEnabled(True)
             self.durationLabel.setEnabled(True)
-            self.sampleRateLabel.setEnabled(True)
-            self.sampleRateLineEdit.setEnabled(True)
-            self.rangeLabel.setEnabled(True)
-            self.rangeComboBox.setEnabled(True)
+            # The port belongs to the acquisition worker while it runs
+            self.sampleRateLabel.setEnabled(not self.started)
+            self.sampleRateLineEdit.setEnabled(not self.started)
+            self.rangeLabel.setEnabled(not self.started)
+            self.rangeComboBox.setEnabled(not self.started)
 
         if self.data is None: 
             self.savePushButton.setEnabled(False)
         else:
             self.savePushButton.setEnabled(True)
+        self.liveCheckBox.setEnabled(self.connected and not self.started)
+        self.recordCheckBox.setEnabled(self.connected and not self.started)
 
     def getRange(self):
         """
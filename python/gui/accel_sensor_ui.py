@@ -153,6 +153,12 @@ class Ui_AccelSensorMainWindow(object):
         self.savePushButton = QtGui.QPushButton(self.frame_5)
         self.savePushButton.setObjectName("savePushButton")
         self.horizontalLayout.addWidget(self.savePushButton)
+        self.liveCheckBox = QtGui.QCheckBox(self.frame_5)
+        self.liveCheckBox.setObjectName("liveCheckBox")
+        self.horizontalLayout.addWidget(self.liveCheckBox)
+        self.recordCheckBox = QtGui.QCheckBox(self.frame_5)
+        self.recordCheckBox.setObjectName("recordCheckBox")
+        self.horizontalLayout.addWidget(self.recordCheckBox)
         spacerItem4 = QtGui.QSpacerItem(525, 20, QtGui.QSizePolicy.Expanding, QtGui.QSizePolicy.Minimum)
         self.horizontalLayout.addItem(spacerItem4)
         self.verticalLayout_2.addWidget(self.frame_5)
@@ -189,6 +195,10 @@ class Ui_AccelSensorMainWindow(object):
         self.startStopPushButton.setToolTip(QtGui.QApplication.translate("AccelSensorMainWindow", "set current data log file", None, QtGui.QApplication.UnicodeUTF8))
         self.startStopPushButton.setText(QtGui.QApplication.translate("AccelSensorMainWindow", "Start", None, QtGui.QApplication.UnicodeUTF8))
         self.savePushButton.setText(QtGui.QApplication.translate("AccelSensorMainWindow", "Save", None, QtGui.QApplication.UnicodeUTF8))
+        self.liveCheckBox.setToolTip(QtGui.QApplication.translate("AccelSensorMainWindow", "stream continuously and plot the last duration seconds", None, QtGui.QApplication.UnicodeUTF8))
+        self.liveCheckBox.setText(QtGui.QApplication.translate("AccelSensorMainWindow", "Live", None, QtGui.QApplication.UnicodeUTF8))
+        self.recordCheckBox.setToolTip(QtGui.QApplication.translate("AccelSensorMainWindow", "stream continuously to a series of capture files until stopped", None, QtGui.QApplication.UnicodeUTF8))
+        self.recordCheckBox.setText(QtGui.QApplication.translate("AccelSensorMainWindow", "Record", None, QtGui.QApplication.UnicodeUTF8))
         self.statusLabel.setText(QtGui.QApplication.translate("AccelSensorMainWindow", "Status:", None, QtGui.QApplication.UnicodeUTF8))
 
 from mplwidget import MplWidget
@@ -0,0 +1,84 @@
+"""
+acquisition_worker.py
+
+Reads samples from the accelerometer in a worker thread so that serial
+acquisition does not depend on the Qt event loop. Decoded samples are
+collected for EMIT_DT seconds and sent to the GUI thread as a single
+SampleChunk, with the sample times, by the chunkReady signal. If a capture writer is given the samples are
+also written to it from the worker thread, so disk writes do not hold up the
+GUI. When a fixed number of samples is acquired their times, allowing for
+gaps and the drift of the firmware clock, are left in times.
+"""
+import time
+import numpy
+from PyQt4 import QtCore
+
+EMIT_DT = 0.05
+
+
+class AcquisitionWorker(QtCore.QThread):
+
+    chunkReady = QtCore.pyqtSignal(object)
+    error = QtCore.pyqtSignal(str)
+    done = QtCore.pyqtSignal()
+
+    def __init__(self,dev,numSamples=None,capture=None,parent=None):
+        """
+        Streams numSamples samples from the device, dev, or until stop is
+        called if numSamples is None. The samples, up to numSamples, are 
+        written to capture if given. The device and capture must not be used
+        by other threads until the worker has finished.
+        """
+        super(AcquisitionWorker,self).__init__(parent)
+        self.dev = dev
+        self.numSamples = numSamples
+        self.capture = capture
+        self.stopRequested = False
+        self.times = None
+
+    def stop(self):
+        """
+        Asks the worker to stop streaming.
+        """
+        self.stopRequested = True
+
+    def run(self):
+        count = 0
+        emitStart = 0
+        chunks = []
+        lastEmit = time.time()
+        self.dev.emptyBuffer()
+        self.dev.startStreaming()
+        try:
+            while not self.stopRequested:
+                # Blocks until data arrives or the port times out
+                byteVals = self.dev.read(max(1,self.dev.inWaiting()))
+                data = self.dev.decoder.decode(byteVals)
+                if data.shape[0] > 0:
+                    if self.capture is not None:
+                        periods = self.dev.decoder.getPeriodIndex(count,data.shape[0])
+                        if self.numSamples is None:
+                            self.capture.write(data,periods)
+                        else:
+                            num = self.numSamples - count
+                            self.capture.write(data[:num],periods[:num])
+                    chunks.append(data)
+                    count += data.shape[0]
+                finished = self.numSamples is not None and count >= self.numSamples
+                if chunks and (finished or time.time() - lastEmit >= EMIT_DT):
+                    raw = numpy.concatenate(chunks)
+                    times = self.dev.getTimes(emitStart,raw.shape[0])
+                    self.chunkReady.emit(self.dev.createChunk(raw,emitStart,times))
+                    emitStart = count
+                    chunks = []
+                    lastEmit = time.time()
+                if finished:
+                    break
+        except IOError, e:
+            self.error.emit(str(e))
+        finally:
+            self.dev.stopStreaming()
+            if self.numSamples is not None:
+                self.times = self.dev.getTimes(0,min(count,self.numSamples))
+            self.dev.emptyBuffer()
+            self.done.emit()
@@ -17,6 +17,51 @@ class MplCanvas(FigureCanvas):
                 QtGui.QSizePolicy.Expanding
                 )
         FigureCanvas.updateGeometry(self)
+        self.blitArtists = []
+        self.background = None
+        self.drawCid = None
+
+    def startBlit(self,artists):
+        """
+        Animates the artists so that they can be redrawn with updateBlit without
+        redrawing the rest of the figure. 
+        """
+        self.blitArtists = artists
+        for artist in artists:
+            artist.set_animated(True)
+        self.drawCid = self.mpl_connect('draw_event',self.onDraw)
+        self.draw()
+
+    def stopBlit(self):
+        """
+        Returns the animated artists to normal drawing.
+        """
+        if self.drawCid is not None:
+            self.mpl_disconnect(self.drawCid)
+            self.drawCid = None
+        for artist in self.blitArtists:
+            artist.set_animated(False)
+        self.blitArtists = []
+        self.background = None
+
+    def onDraw(self,event):
+        # Full redraw, e.g. after a resize, so save the new background
+        self.background = self.copy_from_bbox(self.fig.bbox)
+        self.drawArtists()
+
+    def drawArtists(self):
+        for artist in self.blitArtists:
+            self.fig.draw_artist(artist)
+
+    def updateBlit(self):
+        """
+        Redraws the animated artists over the saved background.
+        """
+        if self.background is None:
+            return
+        self.restore_region(self.background)
+        self.drawArtists()
+        self.blit(self.fig.bbox)
 
 
 class MplWidget(QtGui.QWidget):
@@ -0,0 +1,83 @@
+"""
+strip_chart.py
+
+Live scrolling plot of the most recent samples streamed from the accelerometer.
+The samples are kept in a fixed size ring buffer and drawn with blitting, so
+only the lines are redrawn each frame. Before drawing the data is reduced to
+the min and max of each pixel column, so the cost of a frame is set by the
+width of the plot rather than the number of samples in view.
+"""
+import numpy
+from accel_adxl345 import SampleRingBuffer
+
+
+def minMaxDecimate(t,y,numBins):
+    """
+    Reduces the samples y, an (N,) or (N,M) array, with times t to the min and
+    max of each of numBins bins. The min and max are interleaved so that a line
+    drawn through them covers the same pixels as one drawn through all of the
+    samples. Data with no more than 2*numBins samples is returned unchanged.
+    """
+    num = t.shape[0]
+    if num <= 2*numBins:
+        return t, y
+    starts = (numpy.arange(numBins)*num)//numBins
+    tDec = numpy.repeat(t[starts],2)
+    yDec = numpy.empty((2*numBins,) + y.shape[1:],dtype=y.dtype)
+    yDec[0::2] = numpy.minimum.reduceat(y,starts,axis=0)
+    yDec[1::2] = numpy.maximum.reduceat(y,starts,axis=0)
+    return tDec, yDec
+
+
+class StripChart(object):
+
+    def __init__(self,canvas,axes,lines,window,sampleDt,scale):
+        """
+        Plots the last window seconds of samples on the lines, one per axis,
+        of the MplCanvas, canvas. The sample interval, sampleDt, is in seconds
+        and raw samples are multiplied by scale.
+        """
+        self.canvas = canvas
+        self.axes = axes
+        self.lines = lines
+        self.window = window
+        self.sampleDt = sampleDt
+        self.scale = scale
+        self.ring = SampleRingBuffer(max(1,int(window/sampleDt)))
+
+    def start(self,yLim):
+        """
+        Clears the chart, fixes the axes limits and starts blitting.
+        """
+        self.ring.clear()
+        for axis, line in zip(self.axes,self.lines):
+            line.set_data([],[])
+            line.set_visible(True)
+            axis.set_xlim(-self.window,0)
+            axis.set_ylim(-yLim,yLim)
+        self.canvas.startBlit(self.lines)
+
+    def stop(self):
+        """
+        Stops blitting.
+        """
+        self.canvas.stopBlit()
+
+    def write(self,samples):
+        """
+        Adds the (N,3) array of raw samples to the chart.
+        """
+        self.ring.write(samples)
+
+    def update(self):
+        """
+        Redraws the lines with the samples currently in the ring buffer.
+        """
+        data = self.ring.getScaled(self.scale)
+        num = data.shape[0]
+        t = self.sampleDt*numpy.arange(-num,0)
+        numBins = max(1,int(self.axes[0].bbox.width))
+        t, data = minMaxDecimate(t,data,numBins)
+        for i, line in enumerate(self.lines):
+            line.set_data(t,data[:,i])
+        self.canvas.updateBlit()